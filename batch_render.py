@@ -0,0 +1,433 @@
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+from itertools import chain, groupby
+
+import numpy as np
+
+from midi_codes import MIDI_CONTROL_CODES, MIDI_FINE_CONTROL_CODES, MIDI_14_BIT_MAX
+from pipeline import CURVES, SMOOTHING_FILTERS, PipelineContext, is_smoothed, is_high_resolution
+from midi_recorder import SMF_TICKS_PER_BEAT, SMF_TEMPO, SMF_TICKS_PER_SECOND, SMF_END_OF_TRACK
+
+# Offline counterpart of Controller.process_axes_input: applies the rules of one model key to a whole take
+# and produces the same messages the real-time path sends, in the same order.
+# One Euro smoothing is driven by the recorded timestamps instead of the time the events were processed.
+#
+# Takes are stored as .npz files with the arrays:
+#   key          3 strings: source, cursor, button
+#   t            sample timestamps in seconds
+#   x, y, z      axis values, only the axes present in the recorded events
+#   domains      (3, 2) domains of x, y, z, as passed to process_axes_input
+#   saturate     optional bools, thresholds were saturated before the sample (press, button change)
+#   reset        optional bools, thresholds were reset before the sample (release)
+#   flush        optional bools, smoothed rules were flushed before the sample (release, ink end, idle input)
+#
+# Takes are recorded from the live input by TakeRecorder, next to the MIDI recording.
+
+TAKE_EVENTS = ('saturate', 'reset', 'flush')
+Take = namedtuple('Take', ['key', 'timestamps', 'axes', 'domains'] + list(TAKE_EVENTS))
+Take.__new__.__defaults__ = (None,) * len(TAKE_EVENTS)  # takes without commands
+RenderedMessages = namedtuple('RenderedMessages', ['sample_indices', 'data', 'lengths'])
+
+AXES = ('x', 'y', 'z')
+
+
+def load_take(path):
+    with np.load(path) as f:
+        axes = {axis: f[axis].astype(np.float64) for axis in AXES if axis in f.files}
+        domains = {axis: tuple(f['domains'][i].tolist()) for i, axis in enumerate(AXES) if axis in axes}
+        events = [f[name].astype(bool) if name in f.files else None for name in TAKE_EVENTS]
+        return Take(tuple(str(k) for k in f['key']), f['t'].astype(np.float64), axes, domains, *events)
+
+
+def save_take(path, take):
+    domains = np.array([take.domains.get(axis, (np.nan, np.nan)) for axis in AXES], dtype=np.float64)
+    arrays = dict(take.axes, key=np.array(take.key), t=take.timestamps, domains=domains)
+    for name in TAKE_EVENTS:
+        if getattr(take, name) is not None:
+            arrays[name] = getattr(take, name)
+    np.savez(path, **arrays)
+
+
+class TakeRecorder:
+    # Collects the axis samples handed to the rules while recording, one take per model key and cursor instance,
+    # saved as .npz files on stop. Only the main thread, which enqueues the input, calls it.
+    # A take keeps the axes and domains of its first sample, samples with other axes are left out.
+    # The commands enqueued with the input are flagged on the next sample of every take they reach, of saturate
+    # and reset only the later one counts.
+
+    def __init__(self, directory='recordings'):
+        self.directory = directory
+        self.is_recording = False
+        self.skipped = 0
+        # (key, instance): [key, timestamps, {axis: values}, domains, {event: flags}, pending events]
+        self._takes = dict()
+
+    def start(self):
+        self._takes = dict()
+        self.is_recording = True
+
+    def record(self, key, timestamp, axis_values, domains, instance=None):
+        take = self._takes.get((key, instance))
+        if take is None:
+            take = self._takes[key, instance] = [key, [], {axis: [] for axis in axis_values},
+                                                 {axis: domains[axis] for axis in axis_values},
+                                                 {name: [] for name in TAKE_EVENTS}, set()]
+        _, timestamps, axes, _, events, pending = take
+        if len(axis_values) != len(axes) or any(axis not in axes for axis in axis_values):
+            self.skipped += 1
+            return
+        timestamps.append(timestamp)
+        for axis, value in axis_values.items():
+            axes[axis].append(value)
+        for name, flags in events.items():
+            flags.append(name in pending)
+        pending.clear()
+
+    def _pend(self, name, replaces=None, idle=None):
+        now = time.perf_counter()
+        for _, timestamps, _, _, _, pending in self._takes.values():
+            if idle is None or timestamps and now - timestamps[-1] >= idle:
+                pending.discard(replaces)
+                pending.add(name)
+
+    def saturate(self):
+        self._pend('saturate', replaces='reset')
+
+    def reset(self):
+        self._pend('reset', replaces='saturate')
+
+    def flush(self, idle=None):
+        # idle: only the takes without samples for as long, like Controller.flush_smoothing
+        self._pend('flush', idle=idle)
+
+    def stop(self):
+        if not self.is_recording:
+            return
+        self.is_recording = False
+        takes, self._takes = self._takes, dict()
+        if takes:
+            threading.Thread(target=self._save, args=(list(takes.values()), time.strftime('take-%Y%m%d-%H%M%S')),
+                             name='take-writer').start()
+
+    def _save(self, takes, name):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for i, (key, timestamps, axes, domains, events, _) in enumerate(takes):
+                save_take(os.path.join(self.directory, '%s-%d.npz' % (name, i)), Take(
+                    key, np.array(timestamps, dtype=np.float64),
+                    {axis: np.array(values, dtype=np.float64) for axis, values in axes.items()}, domains,
+                    *(np.array(events[name], dtype=bool) for name in TAKE_EVENTS)))
+        except OSError as e:
+            print(e)
+
+
+def threshold_passes(values, threshold, saturate=None, reset=None):
+    # Indices of the samples a ThresholdAxes lets through: the sequentially accumulated absolute change since
+    # the last pass reaches the threshold. Accumulation uses np.cumsum seeded with the running total, which adds
+    # in the same order as ThresholdAxes, so float results are identical. Before a saturated sample the total
+    # is set to the threshold, before a reset one to zero.
+    n = len(values)
+    if threshold <= 0:
+        return np.arange(n)
+
+    changes = np.abs(np.diff(values, prepend=0.0))
+    saturated = np.flatnonzero(saturate) if saturate is not None else np.empty(0, dtype=np.int64)
+    resets = np.flatnonzero(reset) if reset is not None else np.empty(0, dtype=np.int64)
+    mean_change = changes.mean() if n else 0
+    window = int(min(n, 2 * threshold / mean_change + 16)) if mean_change > 0 else n
+
+    passes = []
+    if window < 64:
+        # passes are dense, a plain loop beats one cumsum call per pass
+        saturated, resets = set(saturated.tolist()), set(resets.tolist())
+        total = 0.0
+        for i, change in enumerate(changes.tolist()):
+            if i in saturated:
+                total = threshold
+            elif i in resets:
+                total = 0.0
+            total += change
+            if total >= threshold:
+                passes.append(i)
+                total = 0.0
+        return np.array(passes, dtype=np.int64)
+
+    events = np.concatenate((saturated, resets))
+    order = np.argsort(events, kind='stable')
+    events, is_saturated = events[order], (np.arange(len(events)) < len(saturated))[order]
+    total, i, k = 0.0, 0, 0
+    while i < n:
+        while k < len(events) and events[k] < i:
+            k += 1
+        if k < len(events) and events[k] == i:
+            k += 1
+            if is_saturated[k - 1]:
+                passes.append(i)
+                total, i = 0.0, i + 1
+                continue
+            total = 0.0
+        next_event = events[k] if k < len(events) else n
+        found = None
+        while i < next_event:
+            end = min(next_event, i + window)
+            totals = np.cumsum(np.concatenate(((total,), changes[i:end])))[1:]
+            j = np.searchsorted(totals, threshold, 'left')
+            if j < len(totals):
+                found = i + j
+                break
+            total, i = totals[-1], end
+        if found is not None:
+            passes.append(found)
+            total, i = 0.0, found + 1
+    return np.array(passes, dtype=np.int64)
+
+
+def scale_values(values, domain, range_):
+    # same float operations, in the same order, as ScaleLinear.value
+    domain_scale = 1.0 / (domain[1] - domain[0])
+    return ((values + -domain[0]) * domain_scale * (range_[1] - range_[0]) + range_[0]).astype(np.int64)
+
+
+def shape_values(rule, values, domain):
+    # curve and quantize stages of the rule pipeline
+    low, high = domain
+    span = high - low
+    curve = CURVES.get(getattr(rule, 'curve', 'linear'), None)
+    if curve:
+        values = low + curve(np.clip((values - low) / span, 0.0, 1.0)) * span
+    steps = int(getattr(rule, 'quantize', 0) or 0)
+    if steps > 0:
+        values = low + np.round((values - low) / span * steps) / steps * span
+    return values
+
+
+def invert_values(rule, values):
+    if not getattr(rule, 'invert', False):
+        return values
+    return int(rule.range_from) + int(rule.range_to) - values
+
+
+def clamp_values(rule, values):
+    # like Controller.clamp_rule_value, zero passes through unclamped
+    return np.where(values != 0, np.clip(values, int(rule.range_from), int(rule.range_to)), values)
+
+
+def smooth_values(smoothing_filter, values, timestamps, positions, flushes=()):
+    # filters are sequential, the same objects as in the live pipeline run over the take, fed with its timestamps
+    # and flushed at the flush positions, returns the values and their positions
+    filter_value, flush = smoothing_filter.filter, getattr(smoothing_filter, 'flush', None)
+    events = sorted(chain(zip(positions.tolist(), values.tolist(), timestamps.tolist()),
+                          ((position, None, None) for position in flushes if flush)))
+    smoothed = [(position, filter_value(value, timestamp) if value is not None else flush())
+                for position, value, timestamp in events]
+    smoothed = [(position, value) for position, value in smoothed if value is not None]
+    return (np.array([value for _, value in smoothed], dtype=np.float64),
+            np.array([position for position, _ in smoothed], dtype=np.int64))
+
+
+def rule_values(rule, take, is_note=False, indices=None, flush=False):
+    # Runs the rule pipeline over the take, returns the positions of the values and the values. The value of
+    # sample i is at 2 * i, a value flushed before sample i + 1 at 2 * i + 1, flush only for the rules the
+    # controller flushes. indices restricts the rule to a subset of samples, as velocity rules are only
+    # evaluated for played notes.
+    values = take.axes[rule.axis]
+    range_ = (int(rule.range_from), int(rule.range_to))
+    if is_note:
+        r = range_[1] - range_[0]
+        step = int(take.domains[rule.axis][1] / r)
+        domain = (0, step * r)
+    else:
+        domain = take.domains[rule.axis]
+    is_velocity = rule.message_type == 'velocity'
+
+    if indices is None:
+        indices = threshold_passes(values, rule.threshold if not is_velocity else 0, take.saturate, take.reset)
+    values = values[indices]
+    positions = 2 * indices
+
+    make_filter = SMOOTHING_FILTERS.get(getattr(rule, 'smoothing', 'none'), None)
+    if make_filter:
+        flushes = 2 * np.flatnonzero(take.flush) - 1 if flush and take.flush is not None else ()
+        values, positions = smooth_values(make_filter(PipelineContext(domain, range_, None)), values,
+                                          take.timestamps[indices], positions, [p for p in flushes if p > 0])
+
+    values = scale_values(shape_values(rule, values, domain), domain, range_)
+    if not is_velocity:
+        sent = values != 0
+        positions, values = positions[sent], values[sent]
+    values = invert_values(rule, clamp_values(rule, values))
+
+    if is_smoothed(rule) and not is_velocity:
+        changed = np.concatenate(([True], values[1:] != values[:-1]))
+        positions, values = positions[changed], values[changed]
+    return positions, values
+
+
+def _message_data(rule, channel, values):
+    n = len(values)
+    data = np.zeros((n, 3), dtype=np.int64)
+    lengths = np.full(n, 3, dtype=np.int64)
+    message_type = rule.message_type
+    if message_type == 'pitch':
+        pitch = values + 8192
+        data[:, 0], data[:, 1], data[:, 2] = 0xE0 | channel, pitch & 0x7F, pitch >> 7
+    elif message_type == 'control':
+        data[:, 0], data[:, 1], data[:, 2] = 0xB0 | channel, MIDI_CONTROL_CODES[rule.control_type], values
+    elif message_type == 'program':
+        data[:, 0], data[:, 1], lengths[:] = 0xC0 | channel, values, 2
+    elif message_type == 'aftertouch':
+        data[:, 0], data[:, 1], lengths[:] = 0xD0 | channel, values, 2
+    elif message_type == 'polytouch':
+        data[:, 0], data[:, 1], data[:, 2] = 0xA0 | channel, 60, values
+    elif message_type == 'song select':
+        data[:, 0], data[:, 1], lengths[:] = 0xF3, values, 2
+    elif message_type == 'song position':
+        data[:, 0], data[:, 1], data[:, 2] = 0xF2, values & 0x7F, values >> 7
+    else:
+        return None
+    return data, lengths
+
+
+def _high_resolution_parts(rule, channel, indices, values):
+    # MSB and LSB control changes as sent by HighResolutionControls, starting from a receiver that knows nothing
+    values = np.clip(values, 0, MIDI_14_BIT_MAX)
+    msb, lsb = values >> 7, values & 0x7F
+    msb_sent = msb != np.concatenate(([-1], msb[:-1]))
+    lsb_sent = np.where(msb_sent, lsb != 0, lsb != np.concatenate(([-1], lsb[:-1])))
+    control = MIDI_CONTROL_CODES[rule.control_type]
+    parts = []
+    for sent, number, data in ((msb_sent, control, msb), (lsb_sent, MIDI_FINE_CONTROL_CODES[control], lsb)):
+        n = np.count_nonzero(sent)
+        message = np.stack([np.full(n, 0xB0 | channel), np.full(n, number), data[sent]], axis=1)
+        parts.append((indices[sent], message, np.full(n, 3, dtype=np.int64)))
+    return parts
+
+
+def render(rules, take):
+    # mirrors the rule selection and ordering of Controller.process_axes_input
+    rules = [rule for rule in rules or [] if rule.enabled and rule.axis in take.axes and 'step' not in rule._fields]
+    rules = sorted(rules, key=lambda x: x.channel)
+
+    def is_note_related(x):
+        return x.message_type in ['note', 'velocity']
+
+    parts = []  # (positions, data, lengths), concatenated in emission order, see rule_values
+    for channel, axes in groupby(rules, lambda x: x.channel):
+        axes = sorted(axes, key=is_note_related)
+        note_axes = [rule for rule in axes if is_note_related(rule)]
+        control_axes = [rule for rule in axes if not is_note_related(rule)]
+
+        note_axis = note_velocity_axis = None
+        for rule in note_axes:
+            if rule.message_type == 'note':
+                note_axis = rule
+            elif rule.message_type == 'velocity':
+                note_velocity_axis = rule
+
+        if note_axis:
+            positions, notes = rule_values(note_axis, take, is_note=True)
+            played = notes != 0
+            positions, notes = positions[played], notes[played]
+            # mido's default velocity, also used when the velocity rule drops the value
+            velocities = np.full(len(notes), 64, dtype=np.int64)
+            if note_velocity_axis:
+                velocity_positions, velocity_values = rule_values(note_velocity_axis, take, indices=positions // 2)
+                velocities[np.searchsorted(positions, velocity_positions)] = velocity_values
+            data = np.stack([np.full(len(notes), 0x90 | int(channel)), notes, velocities], axis=1)
+            parts.append((positions, data, np.full(len(notes), 3, dtype=np.int64)))
+
+        # the flushes of the controller reach the smoothed control rules, in their order of evaluation
+        for rule in control_axes:
+            positions, values = rule_values(rule, take, flush=True)
+            if is_high_resolution(rule):
+                parts.extend(_high_resolution_parts(rule, int(channel), positions, values))
+                continue
+            message = _message_data(rule, int(channel), values)
+            if message:
+                parts.append((positions,) + message)
+
+    if not parts:
+        empty = np.empty(0, dtype=np.int64)
+        return RenderedMessages(empty, np.empty((0, 3), dtype=np.int64), empty)
+
+    order = np.concatenate([np.full(len(positions), i) for i, (positions, _, _) in enumerate(parts)])
+    positions = np.concatenate([part[0] for part in parts])
+    emission_order = np.lexsort((order, positions))
+    return RenderedMessages(positions[emission_order] // 2,
+                            np.concatenate([part[1] for part in parts])[emission_order],
+                            np.concatenate([part[2] for part in parts])[emission_order])
+
+
+def encode_track(ticks, data, lengths):
+    # variable length delta times and message bytes laid out in a (n, 7) table, unused cells masked out
+    deltas = np.diff(ticks, prepend=0)
+    sizes = 1 + (deltas >= 1 << 7) + (deltas >= 1 << 14) + (deltas >= 1 << 21)
+    table = np.zeros((len(ticks), 7), dtype=np.uint8)
+    for k in range(4):
+        table[:, 3 - k] = ((deltas >> (7 * k)) & 0x7F) | (0x80 if k else 0)
+    table[:, 4:] = data
+    columns = np.arange(7)
+    used = (columns[:4] >= 4 - sizes[:, None])
+    used = np.concatenate([used, columns[4:] - 4 < lengths[:, None]], axis=1)
+    return table[used].tobytes()
+
+
+def write_midi_file(path, take, messages):
+    channel_messages = messages.data[:, 0] < 0xF0  # system messages have no place in a track
+    sample_indices = messages.sample_indices[channel_messages]
+    timestamps = take.timestamps[sample_indices] - (take.timestamps[0] if len(take.timestamps) else 0)
+    ticks = (timestamps * SMF_TICKS_PER_SECOND).astype(np.int64)
+    track = (b'\x00\xff\x51\x03' + SMF_TEMPO.to_bytes(3, 'big')
+             + encode_track(ticks, messages.data[channel_messages], messages.lengths[channel_messages])
+             + SMF_END_OF_TRACK)
+    with open(path, 'wb') as f:
+        f.write(b'MThd' + (6).to_bytes(4, 'big') + (0).to_bytes(2, 'big') + (1).to_bytes(2, 'big')
+                + SMF_TICKS_PER_BEAT.to_bytes(2, 'big'))
+        f.write(b'MTrk' + len(track).to_bytes(4, 'big') + track)
+
+
+def main(take_path, midi_path):
+    from bindings import model
+
+    model.load()
+    take = load_take(take_path)
+    messages = render(model[take.key], take)
+    write_midi_file(midi_path, take, messages)
+    print('%d samples rendered to %d messages' % (len(take.timestamps), len(messages.sample_indices)))
+
+
+def benchmark(rate=1000, noise=0.004, seed=1):
+    # A gesture replayed through every smoothing filter: one second held, a one second move over the whole range,
+    # one second held. Prints the messages sent for it with noise added, those while held, and the mean lag of
+    # the values sent for the noiseless move behind the time the move reached them.
+    rng = np.random.default_rng(seed)
+    timestamps = np.arange(3 * rate) / rate
+    clean = np.clip(timestamps - 1.0, 0.0, 1.0)
+    noisy = np.clip(clean + rng.normal(0, noise, len(clean)), 0.0, 1.0)
+    Rule = namedtuple('Rule', ['enabled', 'channel', 'message_type', 'control_type', 'range_from', 'range_to',
+                               'threshold', 'axis', 'smoothing'])
+    for smoothing in SMOOTHING_FILTERS:
+        rule = Rule(True, '0', 'control', 'Bank Select', '1', '127', 0, 'x', smoothing)
+        messages = render([rule], Take(('benchmark', 'cursor', '0'), timestamps, {'x': noisy}, {'x': (0.0, 1.0)}))
+        held = np.count_nonzero((timestamps[messages.sample_indices] <= 1.0)
+                                | (timestamps[messages.sample_indices] >= 2.0))
+        moved = render([rule], Take(('benchmark', 'cursor', '0'), timestamps, {'x': clean}, {'x': (0.0, 1.0)}))
+        # the first time every value is sent, unsmoothed rules repeat them
+        values, first = np.unique(moved.data[:, 2], return_index=True)
+        times = timestamps[moved.sample_indices[first]]
+        moving = (times > 1.0) & (values < 127)
+        reached = 1.0 + (values[moving] - 1) / 126  # the move reaches a value where it is truncated to it
+        print('%-10s %5d messages, %4d while held, lag %.1f ms' % (
+            smoothing, len(messages.sample_indices), held, 1e3 * np.mean(times[moving] - reached)))
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['benchmark']:
+        benchmark(*map(int, sys.argv[2:]))
+    elif len(sys.argv) != 3:
+        print('usage: batch_render.py take.npz output.mid | benchmark')
+        sys.exit(1)
+    else:
+        main(*sys.argv[1:])
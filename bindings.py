@@ -42,8 +42,11 @@ class Binding:
         self._listeners.setdefault('*', list())
         self._widgets = dict()
         
+        # one tuple class per binding class, a module attribute, so the rows of the model pickle by name
         named_tuple_name = type(self).__qualname__ + '_tuple'
-        self._to_named_tuple = namedtuple(named_tuple_name, self.keys())
+        self._to_named_tuple = globals().get(named_tuple_name)
+        if self._to_named_tuple is None:
+            self._to_named_tuple = globals()[named_tuple_name] = namedtuple(named_tuple_name, self.keys())
         
         self.defaults = self.to_tuple()
     
@@ -96,8 +99,9 @@ class Binding:
         return self._to_named_tuple(*self.values())
     
     def from_tuple(self, props: tuple):
+        # settings saved before a field was added have shorter tuples
         for i, key in enumerate(self.keys()):
-            setattr(self, key, props[i])
+            setattr(self, key, props[i] if i < len(props) else self.defaults[i])
 
     def _notify_listeners(self, key, value):
         # print(self.is_valid, key, self)
@@ -128,7 +132,8 @@ class MouseKeyBinding(Binding):
 
 @autoclass
 class RowBinding(Binding):
-    def __init__(self, enabled, channel, message_type, control_type, range_from, range_to, threshold, axis):
+    def __init__(self, enabled, channel, message_type, control_type, range_from, range_to, threshold, axis,
+                 curve='linear', quantize='0', invert=False, smoothing='none', interpolate=False):
         super().__init__()
 
 
@@ -155,7 +160,8 @@ class RowStepBinding(AttrTimestampMixin, Binding):
 
 @autoclass
 class ButtonsBinding(Binding):
-    def __init__(self, tablet_on=False, mouse_on=False, midi_output_on=False, log_output_on=False, log_input_on=False):
+    def __init__(self, tablet_on=False, mouse_on=False, midi_output_on=False, log_output_on=False, log_input_on=False,
+                 record_on=False, quantize_on=False, clock_on=False, thru_priority_on=False):
         super().__init__()
     
 
@@ -165,12 +171,29 @@ class LabelsBinding(Binding):
         super().__init__()
 
 
+@autoclass
+class TempoBinding(Binding):
+    def __init__(self, bpm='120', division='4'):
+        super().__init__()
+
+
 @autoclass
 class DevicesBinding(Binding):
-    def __init__(self, output_midi_port_name=None):
+    def __init__(self, output_midi_port_name=None, secondary_midi_port_name='none', secondary_midi_channel='all',
+                 input_midi_port_name='none', thru_midi_port_name='none', thru_channel='same', thru_filter='none'):
         super().__init__()
     
     
+def plain_storage(storage):
+    # the model storage with the rows as (tuple class name, values), for another process. Rows loaded from the
+    # settings by dill have classes of their own, which pickle can't find by name.
+    return {key: [(type(row).__name__, tuple(row)) for row in rows] for key, rows in storage.items()}
+
+
+def named_storage(storage):
+    return {key: [globals()[name](*values) for name, values in rows] for key, rows in storage.items()}
+
+
 def _binding_tablet_row(axis):
     return RowBinding(enabled=False, channel='0', message_type='control', control_type='Bank Select',
                       range_from='0', range_to='127', threshold=0, axis=axis)
@@ -201,7 +224,7 @@ bind_tablet_y = bind_tablet_rows[1]
 bind_tablet_p = bind_tablet_rows[2]
 
 bind_mouse_key = MouseKeyBinding()
-bind_mouse_rows = [_binding_mouse_row(_axis(i)) for i in range(3)]
+bind_mouse_rows = [_binding_mouse_row(_axis(i)) for i in range(2)]
 bind_mouse_x = bind_mouse_rows[0]
 bind_mouse_y = bind_mouse_rows[1]
 
@@ -212,6 +235,7 @@ bind_mouse_wheel_y = bind_mouse_wheel_rows[1]
 binding_buttons = ButtonsBinding()
 binding_labels = LabelsBinding()
 binding_devices = DevicesBinding()
+binding_tempo = TempoBinding()
 
 bindings_axle = [bind_tablet_x, bind_tablet_y, bind_tablet_p, bind_mouse_x, bind_mouse_y]
 
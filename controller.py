@@ -1,8 +1,10 @@
-from collections import namedtuple, deque
+from collections import namedtuple, deque, OrderedDict
 from datetime import datetime, timedelta
 
 import math
 import operator
+import threading
+import time
 from functools import reduce
 from itertools import groupby, chain, repeat
 
@@ -16,14 +18,40 @@ import pyglet.clock
 from pyglet.text import Label
 
 from bindings import bind_tablet_key, bind_tablet_x, bind_tablet_y, bind_tablet_p, bind_mouse_key, bind_mouse_x, \
-    bind_mouse_y, binding_buttons, binding_labels, binding_devices, bindings_axle, Binding, \
-    model, RowBinding, bind_mouse_wheel_x, bind_mouse_wheel_y, table_row_mouse_wheel, bind_mouse_wheel_rows
+    bind_mouse_y, binding_buttons, binding_labels, binding_devices, binding_tempo, bindings_axle, Binding, \
+    model, RowBinding, bind_mouse_wheel_x, bind_mouse_wheel_y, table_row_mouse_wheel, bind_mouse_wheel_rows, \
+    plain_storage
 from windows_ink import pointerFlagNames, penTypeFlagNames
-from midi_codes import MIDI_CONTROL_CODES
+from midi_codes import MIDI_CONTROL_CODES, MIDI_14_BIT_MAX
+from midi_outputs import get_output_names, open_output, FanOutSink, HighResolutionControls
+from midi_inputs import MidiInputListener, get_input_names
+from midi_recorder import MidiFileRecorder
+from batch_render import TakeRecorder
+from midi_thru import MidiThru, THRU_FILTERS
 from scale import ScaleLinear
+from input_thread import InputThread
+from midi_engine import MidiEngine, EngineSink
+from interpolation import OutputInterpolator, is_interpolated
+from scheduler import Scheduler, TempoGrid, MidiClock
+from pipeline import compile_rule_pipeline, PipelineContext, is_incremental, is_high_resolution, is_smoothed, CURVES, \
+    SMOOTHING_FILTERS
 from stateful_inputs import ThresholdAxes, AccumulatingAxes
+from osc_input import OscInput
+from web_input import WebInput
+from metrics import metrics, MetricsServer, LATENCY_BUCKETS
+from profiler import SamplingProfiler, profile_path
+from shared_input import SharedInput
+from evdev_input import EvdevInput, device_paths
 
 WindowsInkCursor = namedtuple("WindowsInkCursor", ["name"])
+SMOOTHING_IDLE = 0.05  # seconds without samples after which smoothed rules catch up with their input
+
+input_events = metrics.counter('touchy_input_events_total', 'Axis samples received', ('source',))
+input_seconds = metrics.histogram('touchy_input_seconds', 'Time spent generating MIDI from one axis sample',
+                                  LATENCY_BUCKETS)
+midi_messages = metrics.counter('touchy_midi_messages_total', 'MIDI messages generated', ('type',))
+pipeline_cache = metrics.counter('touchy_pipeline_cache_total', 'Rule pipeline lookups', ('result',))
+pipeline_cache_hits, pipeline_cache_misses = pipeline_cache.labels('hit'), pipeline_cache.labels('miss')
 
 
 def odd(x):
@@ -51,7 +79,8 @@ class WindowsInkInput:
 @autoclass
 class Controller:
     def __init__(self, window=None, manager=None, gui_visible=True):
-        self.midi_ports = mido.get_output_names()
+        self.midi_ports = get_output_names()
+        self.midi_input_ports = get_input_names()
         self.midi_channels = [str(x) for x in range(0, 16)]
         self.midi_message_types = [
             # https://mido.readthedocs.io/en/latest/message_types.html
@@ -61,15 +90,20 @@ class Controller:
         ]
         
         self.midi_control_types = list(MIDI_CONTROL_CODES.keys())
+        self.curve_names = list(CURVES.keys())
+        self.smoothing_names = list(SMOOTHING_FILTERS.keys())
         
         self.tablets = self.get_tablets()
         self.tablet_names = [tablet.name for tablet in self.tablets]
         self.selected_tablet_index = 0
         if self.tablets and len(self.tablets):
             self.selected_tablet = self.tablets[self.selected_tablet_index]
-            self.tablet_cursor_names = list(set([cursor.name for cursor in (self.selected_tablet.cursors)]))
+            # names of all sources are merged, so every source can be mapped from the same tablet rows
+            self.tablet_cursor_names = list(OrderedDict.fromkeys(
+                cursor.name for tablet in self.tablets for cursor in getattr(tablet, 'cursors', [])))
             # self.tablet_button_names = list(map(lambda i: str(i), list(range(len(self.selected_tablet.cursors)))))
-            self.tablet_button_names = self.selected_tablet.buttons
+            self.tablet_button_names = list(OrderedDict.fromkeys(
+                button for tablet in self.tablets for button in getattr(tablet, 'buttons', [])))
         else:
             self.selected_tablet = None
             self.tablet_cursor_names = []
@@ -81,21 +115,60 @@ class Controller:
         self.mouse_button_names = mouse_button_names
         
         self._canvas = None
-        self.port = None
+        self.port = FanOutSink()
+        self.recorder = MidiFileRecorder()
+        self.take_recorder = TakeRecorder()
+        self.high_resolution_controls = HighResolutionControls()
+        self.scheduler = Scheduler()
+        self.tempo_grid = TempoGrid(origin=self.scheduler.clock())
+        self.midi_clock = MidiClock(self.scheduler, self.tempo_grid, self.port.send_bytes)
+        self._pending_notes = dict()
+        self.midi_input = MidiInputListener()
+        self.thru = MidiThru(self.port)
+        self.thru_filter_names = list(THRU_FILTERS.keys())
+        self._input_binding = None
+        # interpolated values are sent from the interpolator thread, without touching the output label
+        self.interpolator = OutputInterpolator(
+            lambda rule, value: self.generate_midi_control_message_from_value(rule, value, log=False))
         
         self._scale_cache = dict()
         self._threshold_axes = dict()
+        self._smoothed = dict()  # (key, rule): capture time of the last sample, rules the filters may hold back
         # self._incremental_axes = defaultdict(lambda: AccumulatingAxes())
         self.pull_back_handlers = dict()
         
         self._last_canvas_button = None
         
         self._play_note_history = deque(maxlen=36)
+        # MIDI generation runs on the input thread, the main thread picks up what it changed once per frame
+        self.input_thread = InputThread()
+        self._note_history_version = 0
+        self._drawn_note_history_version = 0
+        self._output_status = None
+        self.engine = MidiEngine()
+        self.metrics_server = None
+        self.metrics_label = None
+        self.register_metrics()
+        self.profiler = None
         
         self.note_labels = []
         
     def clear_scale_cache(self, *args, **kwargs):
+        # the pipelines are used and rebuilt where the input is handled, they are dropped there too
+        self.enqueue_command('clear_pipelines')
+
+    def clear_pipelines(self):
         self._scale_cache.clear()
+        self._threshold_axes.clear()
+        self._smoothed.clear()
+        self.interpolator.clear()
+
+    def clear_instance(self, instance):
+        # the pipelines and filter state of a cursor instance that left, wheel rules add state from the main thread
+        for state in (self._scale_cache, self._threshold_axes, self._smoothed):
+            for cache_key in [cache_key for cache_key in list(state) if cache_key[0][3:] == (instance,)]:
+                state.pop(cache_key, None)
+        self.interpolator.clear(instance)
         
     @setter_override
     def window(self, window = None):
@@ -103,6 +176,11 @@ class Controller:
         if window is None:
             return
         
+        if not self.input_thread.is_alive():
+            self.input_thread.start()
+        pyglet.clock.schedule_interval(self.refresh_from_input, 1 / 60)
+        pyglet.clock.schedule_interval(lambda dt: self.enqueue_command('flush_idle_smoothing'), SMOOTHING_IDLE)
+        
         @self.window.event
         def on_mouse_press(x, y, button, modifiers):
             # self.manager.on_mouse_press(x, y, button, modifiers)
@@ -112,8 +190,8 @@ class Controller:
                 if binding_buttons.log_input_on:
                     binding_labels.mouse_status = 'on_mouse_press(%r, %r, %r=%r, %r' % (x, y, button, button_str, modifiers)
                 
-                self.saturate_thresholds()
-                self.process_axes_input(source='mouse', cursor='cursor', button=button,
+                self.enqueue_command('saturate_thresholds')
+                self.enqueue_axes_input(source='mouse', cursor='cursor', button=button,
                                         axis_values={"x": x, "y": y},
                                         domains={"x": (0, self.window.width), "y": (0, self.window.height)})
     
@@ -124,7 +202,8 @@ class Controller:
                 if binding_buttons.log_input_on:
                     binding_labels.mouse_status = 'on_mouse_release(%r, %r, %r, %r)' % (x, y, button, modifiers)
                     
-                self.reset_thresholds()
+                self.enqueue_command('reset_thresholds')
+                self.enqueue_command('flush_smoothing')
     
         @self.window.event
         def on_mouse_motion(x, y, dx, dy):
@@ -133,7 +212,7 @@ class Controller:
                 if binding_buttons.log_input_on:
                     binding_labels.mouse_status = 'on_mouse_motion(%r, %r)' % (x, y)
                     
-                self.process_axes_input(source='mouse', cursor='cursor', button=0,
+                self.enqueue_axes_input(source='mouse', cursor='cursor', button=0,
                                         axis_values={"x": x, "y": y},
                                         domains={"x": (0, self.window.width), "y": (0, self.window.height)})
     
@@ -147,7 +226,7 @@ class Controller:
                     binding_labels.mouse_status = 'on_mouse_drag(%r, %r, %r, %r, %r=%r, %r)' % (
                         x, y, dx, dy, button, button_str, modifiers)
                     
-                self.process_axes_input(source='mouse', cursor='cursor', button=button,
+                self.enqueue_axes_input(source='mouse', cursor='cursor', button=button,
                                         axis_values={"x": x, "y": y},
                                         domains={"x": (0, self.window.width), "y": (0, self.window.height)})
     
@@ -157,6 +236,7 @@ class Controller:
                 if binding_buttons.log_input_on:
                     binding_labels.mouse_status = 'on_mouse_scroll(%r, %r, %r, %r)' % (x, y, scroll_x, scroll_y)
                     
+                # wheel rules update their sliders, they stay on the main thread
                 value_range = -1, 1
                 self.process_axes_input(source='mouse', cursor='wheel', button=0,
                                         axis_values={"x": scroll_x, "y": scroll_y},
@@ -168,8 +248,9 @@ class Controller:
             
         @self.window.event
         def on_ink_end():
-            self.midi_all_notes_off()
-            self.saturate_thresholds()
+            self.enqueue_command('midi_all_notes_off')
+            self.enqueue_command('saturate_thresholds')
+            self.enqueue_command('flush_smoothing')
 
         @self.window.event
         def on_ink(x, y, pressure, buttons, pen_type):
@@ -186,7 +267,7 @@ class Controller:
             if binding_buttons.log_input_on:
                 binding_labels.mouse_status = 'on_ink(%r, %r, %r, %r, %r)' % (x, y, round(pressure, 3), button, cursor)
 
-            self.process_axes_input(source=WindowsInkInput.source_name, cursor=cursor, button=button,
+            self.enqueue_axes_input(source=WindowsInkInput.source_name, cursor=cursor, button=button,
                                     axis_values={"x": x, "y": y, "z": pressure},
                                     domains={
                                         "x": (0, self.window.width),
@@ -198,6 +279,19 @@ class Controller:
         @self.window.event
         def on_close():
             model.save()
+            self.recorder.stop()
+            self.take_recorder.stop()
+            self.interpolator.stop()
+            self.midi_clock.stop()
+            self.scheduler.stop()
+            self.midi_input.close()
+            self.thru.close()
+            self.input_thread.stop()
+            self.engine.stop()
+            if self.metrics_server:
+                self.metrics_server.stop()
+            if self.profiler:
+                self.toggle_profiler()
     
         model.load()
         
@@ -207,7 +301,14 @@ class Controller:
             bind_tablet_key.cursor = self.tablet_cursor_names[0]
             bind_tablet_key.button = self.tablet_button_names[0]
         bind_mouse_key.button = self.mouse_button_names[0]
+        # key widgets of sections not built yet don't pass the keys on to the model
+        model.update_bindings()
         
+        self.notify_row_widgets()
+        binding_devices.notify_widgets()
+        binding_tempo.notify_widgets()
+        
+    def notify_row_widgets(self):
         bind_tablet_x.notify_widgets()
         bind_tablet_y.notify_widgets()
         bind_tablet_p.notify_widgets()
@@ -218,11 +319,24 @@ class Controller:
         bind_mouse_wheel_y.notify_listeners()
         bind_mouse_wheel_x.notify_widgets()
         bind_mouse_wheel_y.notify_widgets()
-        binding_devices.notify_widgets()
         
     def toggle_fullscreen(self, *args):
         self.window.set_fullscreen(not self.window.fullscreen)
         
+    def select_tablet(self, name, *, binding):
+        if name not in self.tablet_names:
+            return
+        
+        is_on = binding_buttons.tablet_on
+        if is_on:
+            self.toggle_tablet_input(False, binding=binding)
+        
+        self.selected_tablet_index = self.tablet_names.index(name)
+        self.selected_tablet = self.tablets[self.selected_tablet_index]
+        
+        if is_on:
+            self.toggle_tablet_input(True, binding=binding)
+        
     def toggle_tablet_input(self, is_on, *, binding):
         if is_on:
             canvas = self.tablets[self.selected_tablet_index].open(self.window)
@@ -242,6 +356,8 @@ class Controller:
             def on_leave(cursor):
                 if binding_buttons.log_input_on:
                     binding_labels.touch_status = '%s: on_leave(%r)' % (name, cursor)
+                if getattr(cursor, 'instance', None) is not None:
+                    self.enqueue_command('clear_instance', cursor.instance)
 
             @canvas.event
             def on_motion(cursor, x, y, pressure, buttons):
@@ -250,16 +366,18 @@ class Controller:
                     binding_labels.touch_status = text
                 
                 if self._last_canvas_button != buttons:
-                    self.saturate_thresholds()
+                    self.enqueue_command('saturate_thresholds')
                 self._last_canvas_button = buttons
                 
-                self.process_axes_input(source=bind_tablet_key.tablet, cursor=cursor.name, button=buttons,
+                self.enqueue_axes_input(source=bind_tablet_key.tablet, cursor=cursor.name, button=buttons,
                                         axis_values={"x": x, "y": y, "z": pressure},
                                         domains={
                                                 "x": (0, self.window.width),
                                                 "y": (0, self.window.height),
                                                 "z": (0, 1)
-                                            })
+                                            },
+                                        timestamp=getattr(canvas, 'timestamp', None),
+                                        instance=getattr(cursor, 'instance', None))
         else:
             if self._canvas:
                 self._canvas.close()
@@ -299,10 +417,13 @@ class Controller:
         lines = reduce(operator.concat, ((step * i, 0 if not odd(i) else height, step * i, height if not odd(i) else 0)
                                          for i in xs))
         
+        # copied at once, the input thread keeps appending
+        play_note_history = list(self._play_note_history)
+        
         def played_note_index_in_history(note):
             try:
-                last_i = next((i for i, x in enumerate(reversed(self._play_note_history)) if note == x))
-                return len(self._play_note_history) - 1 - last_i
+                last_i = next((i for i, x in enumerate(reversed(play_note_history)) if note == x))
+                return len(play_note_history) - 1 - last_i
             except StopIteration:
                 return None
             
@@ -348,14 +469,155 @@ class Controller:
     
         self.note_labels = [get_note_label(x) for x in range(len(xs))]
 
+    def start_engine(self):
+        # from now on the worker process owns the output ports, this one sends them raw bytes
+        self.engine.start()
+        self.port.close()
+        self.port.open('engine', EngineSink(self.engine))
+        
     def open_midi_port(self, name, *, binding):
-        if self.port:
-            self.port.close()
-        self.port = mido.open_output(name=name)
+        if self.engine.is_running:
+            return
+        self.port.open('primary', open_output(name))
+        # a new receiver knows none of the sent 14 bit values
+        self.high_resolution_controls.reset()
+        
+    def open_midi_input_port(self, name, *, binding):
+        pyglet.clock.unschedule(self.on_midi_input)
+        self.midi_input.close()
+        if name not in self.midi_input_ports:
+            return
+        try:
+            self.midi_input.open(name)
+        except Exception as e:
+            print(e)
+            return
+        pyglet.clock.schedule_interval(self.on_midi_input, 1 / 60)
+        
+    def on_midi_input(self, dt):
+        for key, value in self.midi_input.drain():
+            if key[0] == 'program':
+                self.load_preset(value)
+                continue
+            for binding in bind_mouse_wheel_rows:
+                if binding.message_type != key[0] or int(binding.channel) != key[1]:
+                    continue
+                if key[0] == 'control' and MIDI_CONTROL_CODES.get(binding.control_type) != key[2]:
+                    continue
+                # the slider follows the input without sending the value back
+                self._input_binding = binding
+                binding.value = max(min(value, int(binding.range_to)), int(binding.range_from))
+                self._input_binding = None
+                
+    def load_preset(self, program):
+        # program 0 is the default settings file, the others have their own
+        model.switch('settings.pickle' if not program else 'settings-%d.pickle' % program)
+        model.update_bindings()
+        self.clear_scale_cache()
+        self.notify_row_widgets()
+        self.calculate_grid()
+        
+    def open_thru_port(self, name, *, binding):
+        self.thru.close()
+        if name not in self.midi_input_ports:
+            return
+        try:
+            self.thru.open(name)
+        except Exception as e:
+            print(e)
+        
+    def set_thru_channel(self, channel, *, binding):
+        self.thru.channel = int(channel) if channel in self.midi_channels else None
+        
+    def set_thru_filter(self, name, *, binding):
+        self.thru.dropped_status = THRU_FILTERS.get(name, frozenset())
+        
+    def toggle_thru_priority(self, is_on, *, binding):
+        self.thru.generated_priority = is_on
+        
+    def open_secondary_midi_port(self, name, *, binding):
+        if self.engine.is_running:
+            return
+        if name not in self.midi_ports:
+            self.port.remove('secondary')
+            return
+        self.port.open('secondary', open_output(name), self.get_secondary_midi_channels())
+        self.high_resolution_controls.reset()
+        
+    def route_secondary_midi_port(self, channel, *, binding):
+        if self.engine.is_running:
+            return
+        self.port.route('secondary', self.get_secondary_midi_channels())
+        
+    def get_secondary_midi_channels(self):
+        channel = binding_devices.secondary_midi_channel
+        return frozenset((int(channel),)) if channel in self.midi_channels else None
+        
+    def enqueue_axes_input(self, source, cursor, button=None, *, axis_values, domains, timestamp=None,
+                           instance=None):
+        # timestamp: perf_counter time of the capture, canvases fed from other threads know it, window events
+        # are handled as they arrive. instance: of the cursor, see InputCursor
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        if self.take_recorder.is_recording:
+            self.take_recorder.record((source, cursor, str(button)), timestamp, axis_values, domains, instance)
+        if self.engine.is_running:
+            self.engine.push_axes(source, cursor, button, axis_values, domains, timestamp, instance)
+        else:
+            self.input_thread.submit(self.process_axes_input, source, cursor, button, axis_values=axis_values,
+                                     domains=domains, timestamp=timestamp, instance=instance)
+        
+    def enqueue_command(self, name, instance=None):
+        # one of ENGINE_COMMANDS, in order with the axes input, instance for the commands taking one
+        if self.take_recorder.is_recording:
+            if name == 'saturate_thresholds':
+                self.take_recorder.saturate()
+            elif name == 'reset_thresholds':
+                self.take_recorder.reset()
+            elif name == 'flush_smoothing':
+                self.take_recorder.flush()
+            elif name == 'flush_idle_smoothing':
+                self.take_recorder.flush(SMOOTHING_IDLE)
+        if self.engine.is_running:
+            self.engine.push_command(name, instance)
+        elif instance is not None:
+            self.input_thread.submit(getattr(self, name), instance)
+        else:
+            self.input_thread.submit(getattr(self, name))
+        
+    def refresh_from_input(self, dt):
+        if self.engine.is_running:
+            self.engine.publish((plain_storage(model.snapshot()), binding_buttons.to_dict(), binding_devices.to_dict(),
+                                 binding_tempo.to_dict()))
+            status, recorded, generated = self.engine.poll_status()
+            self.thru.merge_generated(generated)
+            if self.recorder.is_recording:
+                for timestamp, data in recorded:
+                    self.recorder.record(mido.Message.from_bytes(data), timestamp)
+            if status:
+                notes, output_status = status
+                self._play_note_history = deque(notes, maxlen=self._play_note_history.maxlen)
+                self._note_history_version += 1
+                if output_status:
+                    self._output_status = output_status
+        
+        version = self._note_history_version
+        if version != self._drawn_note_history_version:
+            self._drawn_note_history_version = version
+            self.calculate_grid()
         
-    def process_axes_input(self, source, cursor, button=None, *, axis_values, domains):
+        midi_message, self._output_status = self._output_status, None
+        if midi_message is not None:
+            binding_labels.output_status = str(midi_message)
+        
+    def process_axes_input(self, source, cursor, button=None, *, axis_values, domains, timestamp=None,
+                           instance=None):
+        input_events.labels(source).inc()
         if not binding_buttons.midi_output_on:
             return
+        start = time.perf_counter()
+        if timestamp is None:
+            timestamp = start
         
         # print('generate_midi_messages(): ', source, cursor, button, 'xyz=', axis_values)
         
@@ -364,6 +626,8 @@ class Controller:
         
         if not generation_rules:
             return
+        if instance is not None:
+            key += (instance,)  # the rules of the cursor, the pipelines of the instance
         
         axes = filter(lambda x: x.enabled and x.axis in axis_values, generation_rules)
         axes = sorted(axes, key=lambda x: x.channel)
@@ -392,68 +656,92 @@ class Controller:
                     note_velocity_axis = rule
 
             if note_axis:
-                note = self.get_rule_value(note_axis, axis_values, domains, is_note=True)
-                note = self.clamp_rule_value(note_axis, note)
+                note = self.get_rule_value(key, note_axis, axis_values, domains, timestamp, is_note=True)
                 if note:
                     note_kwargs = {"channel": int(channel)}
                     if note_velocity_axis:
-                        velocity = self.get_rule_value(note_velocity_axis, axis_values, domains)
-                        velocity = self.clamp_rule_value(note_velocity_axis, velocity)
-                        note_kwargs["velocity"] = velocity
+                        velocity = self.get_rule_value(key, note_velocity_axis, axis_values, domains, timestamp)
+                        if velocity is not None:
+                            note_kwargs["velocity"] = velocity
                         
                     self.generate_midi_note(note, **note_kwargs)
                 
             for rule in control_axes:
-                self.generate_midi_control_message(rule, axis_values, domains)
-
-    def get_rule_value(self, rule, axis_values, domains, is_note=False):
-        is_incremental = 'step' in rule._fields
+                self.generate_midi_control_message(key, rule, axis_values, domains, timestamp)
+                
+        input_seconds.observe(time.perf_counter() - start)
 
-        cached_pair = self._scale_cache.get(rule, None)
+    def get_rule_value(self, key, rule, axis_values, domains, timestamp, is_note=False):
+        # keyed by the input key too, equal rules of two cursors or sources keep their own filter state
+        cache_key = key, rule
+        cached_pair = self._scale_cache.get(cache_key, None)
         if cached_pair:
-            old_domains, scale = cached_pair
+            old_domains, pipeline = cached_pair
         else:
-            old_domains, scale = None, None
+            old_domains, pipeline = None, None
             
-        if not scale or old_domains != domains:
+        if not pipeline or old_domains != domains:
+            pipeline_cache_misses.inc()
             range_ = (int(rule.range_from), int(rule.range_to))
             
             if not is_note:
-                domain = domains[rule.axis] if not is_incremental else range_
+                domain = domains[rule.axis] if not is_incremental(rule) else range_
             else:
                 r = range_[1] - range_[0]
                 d = domains[rule.axis][1]
                 step = int(d / r)
                 domain = (0, step * r)
+                
+            threshold_axes = None
+            if not is_incremental(rule):
+                threshold_axes = self._threshold_axes.get(cache_key)
+                if not threshold_axes:
+                    threshold_axes = ThresholdAxes(rule.axis, rule.threshold if rule.message_type != 'velocity' else 0)
+                    self._threshold_axes[cache_key] = threshold_axes
             
-            scale = ScaleLinear(domain, range_)
-            self._scale_cache[rule] = domains, scale
-
-        if is_incremental:
-            values = {axis: value * int(rule.step) for axis, value in axis_values.items()}
-            # incremental_axes = self._incremental_axes[rule]
-            # values = incremental_axes.value(stepped_axes)
+            pipeline = compile_rule_pipeline(rule, PipelineContext(domain, range_, threshold_axes))
+            self._scale_cache[cache_key] = domains, pipeline
         else:
-            threshold_axes = self._threshold_axes.get(rule)
-            if not threshold_axes:
-                threshold_axes = ThresholdAxes(rule.axis, rule.threshold if rule.message_type != 'velocity' else 0)
-                self._threshold_axes[rule] = threshold_axes
-            values = threshold_axes.value(axis_values)
+            pipeline_cache_hits.inc()
 
-        return scale.value(values[rule.axis]) if values else None
+        return pipeline(axis_values, timestamp)
 
-    def generate_midi_control_message(self, rule, axis_values, domains):
-        value = self.get_rule_value(rule, axis_values, domains)
+    def generate_midi_control_message(self, key, rule, axis_values, domains, timestamp):
+        value = self.get_rule_value(key, rule, axis_values, domains, timestamp)
+        # wheel rules run on the main thread, the flushes on the input thread
+        if is_smoothed(rule) and not is_incremental(rule):
+            self._smoothed[key, rule] = timestamp
     
-        if not value:
+        if value is None:
             return
     
-        if 'step' in rule._fields:
+        if is_incremental(rule):
             value = self.clamp_rule_value(rule, rule.value + value)
             model.update_row(table_row_mouse_wheel, rule, rule._replace(value=value))
         else:
-            value = self.clamp_rule_value(rule, value)
+            self.send_rule_value(key, rule, value, timestamp)
+
+    def send_rule_value(self, key, rule, value, timestamp):
+        if is_interpolated(rule):
+            self.interpolator.move(key, rule, value, timestamp)
+        else:
             self.generate_midi_control_message_from_value(rule, value)
+
+    def flush_smoothing(self, idle=0.0):
+        # smoothed rules without samples for idle seconds jump to the value of their last input, a filter left
+        # halfway would hold the output short of where the pen stopped
+        now = time.perf_counter()
+        for cache_key, timestamp in list(self._smoothed.items()):
+            if now - timestamp < idle:
+                continue
+            del self._smoothed[cache_key]
+            _, pipeline = self._scale_cache.get(cache_key, (None, None))
+            value = pipeline.flush() if pipeline and pipeline.flush else None
+            if value is not None:
+                self.send_rule_value(*cache_key, value, now)
+
+    def flush_idle_smoothing(self):
+        self.flush_smoothing(SMOOTHING_IDLE)
         
     def clamp_rule_value(self, rule, value):
         if not value:
@@ -462,10 +750,16 @@ class Controller:
     
     def generate_midi_note(self, note, **kwargs):
         midi_message = mido.Message(type='note_on', note=note, **kwargs)
-        self.port.send(midi_message)
-
-        if binding_buttons.log_output_on:
-            binding_labels.output_status = str(midi_message)
+        if binding_buttons.quantize_on:
+            # the last note of a grid step wins, notes are sent from the scheduler thread
+            pending = self._pending_notes.get(midi_message.channel)
+            if pending:
+                pending.cancel()
+            when = self.tempo_grid.next_step(self.scheduler.clock())
+            self._pending_notes[midi_message.channel] = self.scheduler.schedule(
+                when, self.send_midi_message, midi_message, False)
+        else:
+            self.send_midi_message(midi_message)
 
         prev_note = None
         try:
@@ -474,14 +768,21 @@ class Controller:
             pass
         if prev_note != note:
             self._play_note_history.append(note)
-            self.calculate_grid()
+            self._note_history_version += 1
 
-    def generate_midi_control_message_from_value(self, rule, value):
+    def generate_midi_control_message_from_value(self, rule, value, log=True):
         midi_message = None
         kwargs = {"channel": int(rule.channel)}
         
         if rule.message_type == 'pitch':
             midi_message = mido.Message(type='pitchwheel', pitch=value, **kwargs)
+        elif rule.message_type == 'control' and is_high_resolution(rule):
+            control_type = MIDI_CONTROL_CODES[rule.control_type]
+            value = max(min(value, MIDI_14_BIT_MAX), 0)
+            with self.high_resolution_controls.lock:
+                for control, data in self.high_resolution_controls.split(kwargs['channel'], control_type, value):
+                    self.send_midi_message(
+                        mido.Message(type='control_change', control=control, value=data, **kwargs), log=log)
         elif rule.message_type == 'control':
             control_type = MIDI_CONTROL_CODES[rule.control_type]
             midi_message = mido.Message(type='control_change', control=control_type, value=value, **kwargs)
@@ -497,13 +798,47 @@ class Controller:
             midi_message = mido.Message(type='songpos', pos=value, **kwargs)
     
         if midi_message:
-            self.port.send(midi_message)
+            self.send_midi_message(midi_message, log=log)
             
-            if binding_buttons.log_output_on:
-                binding_labels.output_status = str(midi_message)
+    def send_midi_message(self, midi_message, log=True):
+        self.port.send(midi_message)
+        midi_messages.labels(midi_message.type).inc()
+        if midi_message.type == 'control_change':
+            self.thru.note_generated(midi_message.channel, midi_message.control)
+        
+        if self.recorder.is_recording:
+            self.recorder.record(midi_message)
+        
+        if log and binding_buttons.log_output_on:
+            self._output_status = midi_message
             
+    def toggle_recording(self, is_on, *, binding):
+        if is_on:
+            self.recorder.start()
+            self.take_recorder.start()
+        else:
+            self.recorder.stop()
+            self.take_recorder.stop()
+            
+
+    def toggle_midi_clock(self, is_on, *, binding):
+        if is_on:
+            self.midi_clock.start()
+        else:
+            self.midi_clock.stop()
+            
+    def set_tempo(self, value, *, binding):
+        try:
+            bpm, division = float(binding.bpm), int(binding.division)
+        except ValueError as e:
+            print(e)
+            return
+        if bpm > 0 and division > 0:
+            self.tempo_grid.bpm, self.tempo_grid.division = bpm, division
+
     def on_wheel_slider_value_changed(self, value, *, binding):
-        self.generate_midi_control_message_from_value(binding.to_tuple(), int(value))
+        if binding is not self._input_binding:
+            self.generate_midi_control_message_from_value(binding.to_tuple(), int(value))
         
         if binding.pull_back and id(binding) not in self.pull_back_handlers:
             self.on_wheel_pull_back_checkbox_changed(True, binding=binding)
@@ -536,8 +871,19 @@ class Controller:
             self.pull_back_handlers[id(binding)] = pull_wheel_back
             pyglet.clock.schedule_interval(pull_wheel_back, 0.05)
 
+    def on_section_built(self, key_binding, row_bindings):
+        key_binding.notify_widgets()
+        for binding in row_bindings:
+            # the wheel sliders are built for 0 to 100, values outside of the range they get are ignored
+            if 'value' in binding.widgets:
+                self.update_wheel_slider_value(binding.value, binding=binding)
+            binding.notify_widgets()
+            self.on_message_type_changed(binding.message_type, binding=binding)
+        
     def update_wheel_slider_value(self, value, *, binding):
-        slider = binding.widgets['value']
+        slider = binding.widgets.get('value')
+        if not slider:
+            return
         range_from, range_to = int(binding.range_from), int(binding.range_to)
         slider._min_value, slider._max_value = range_from, range_to
         if not range_from <= binding.value <= range_to:
@@ -545,21 +891,24 @@ class Controller:
         slider.layout()
 
     def on_message_type_changed(self, message_type, *, binding):
-        control_group = binding.widgets['control_group']
+        control_group = binding.widgets.get('control_group')
+        if not control_group:
+            return
         control_group.hidden = message_type != 'control'
     
     def midi_all_notes_off(self, *args):
         if self.port:
             control_type = MIDI_CONTROL_CODES['All Notes Off']
             midi_message = mido.Message(type='control_change', control=control_type)
-            self.port.send(midi_message)
+            self.send_midi_message(midi_message)
         
     def reset_thresholds(self):
-        for threshold_axis in self._threshold_axes.values():
+        # wheel rules add their threshold axes from the main thread
+        for threshold_axis in list(self._threshold_axes.values()):
             threshold_axis.reset()
             
     def saturate_thresholds(self):
-        for threshold_axis in self._threshold_axes.values():
+        for threshold_axis in list(self._threshold_axes.values()):
             threshold_axis.saturate()
             
     def toggle_gui(self, *args):
@@ -576,10 +925,72 @@ class Controller:
         #
         # remove_listeners(self.manager)
         
+    def register_metrics(self):
+        # read when the metrics are, the hot paths keep their own counts
+        metrics.collector('touchy_port_messages_total', 'Messages handed to each output port', 'counter',
+                          lambda: [((('port', key),), worker.sent) for key, worker in list(self.port.workers.items())])
+        metrics.collector('touchy_port_dropped_total', 'Messages dropped by full output port queues', 'counter',
+                          lambda: [((('port', key),), worker.dropped) for key, worker in list(self.port.workers.items())])
+        metrics.collector('touchy_queue_depth', 'Items waiting in the queues between threads', 'gauge', lambda: [
+            *[((('queue', 'port ' + key),), worker.queue.qsize()) for key, worker in list(self.port.workers.items())],
+            ((('queue', 'input thread'),), len(self.input_thread.ring)),
+            ((('queue', 'engine'),), len(self.engine.ring) if self.engine.ring else 0),
+        ])
+        metrics.collector('touchy_queue_dropped_total', 'Items dropped by full queues between threads', 'counter',
+                          lambda: [((('queue', 'input thread'),), self.input_thread.ring.dropped),
+                                   ((('queue', 'engine'),), self.engine.ring.dropped if self.engine.ring else 0)])
+        metrics.collector('touchy_pipeline_cache_size', 'Rule pipelines compiled', 'gauge',
+                          lambda: [((), len(self._scale_cache))])
+        
+    def start_metrics_server(self):
+        try:
+            self.metrics_server = MetricsServer(metrics)
+        except OSError as e:
+            print(e)
+            return
+        self.metrics_server.start()
+        
+    def toggle_metrics_overlay(self):
+        if self.metrics_label:
+            pyglet.clock.unschedule(self.update_metrics_overlay)
+            self.metrics_label = None
+            return
+        self.metrics_label = Label('', x=10, y=self.window.height - 10, width=self.window.width - 20, multiline=True,
+                                   anchor_y='top', font_size=9, color=(255, 255, 0, 255))
+        self.update_metrics_overlay(0)
+        pyglet.clock.schedule_interval(self.update_metrics_overlay, 0.5)
+        
+    def update_metrics_overlay(self, dt):
+        self.metrics_label.y = self.window.height - 10
+        self.metrics_label.text = metrics.summary()
+        
+    def toggle_profiler(self):
+        if self.profiler:
+            self.profiler.stop()
+            path = profile_path()
+            try:
+                self.profiler.write_folded(path)
+            except OSError as e:
+                print(e)
+            print(self.profiler.report())
+            print('profile written to %s' % path)
+            self.profiler = None
+            return
+        # MIDI is generated on the input thread, drawing and the input handlers run on the main one
+        threads = {'main': threading.main_thread().ident}
+        if self.input_thread.is_alive():
+            threads['input'] = self.input_thread.ident
+        self.profiler = SamplingProfiler(threads)
+        self.profiler.start()
+        
     def on_keyboard_input(self, text: str):
         text = text.upper()
         if text == 'H':
             self.toggle_gui()
+        elif text == 'M':
+            self.toggle_metrics_overlay()
+        elif text == 'P':
+            self.toggle_profiler()
         elif text == 'F':
             self.toggle_fullscreen()
         elif text == ' ':
@@ -587,7 +998,18 @@ class Controller:
         
     def start_listen_bindings(self):
         binding_buttons.listen('tablet_on', controller.toggle_tablet_input)
+        binding_buttons.listen('record_on', controller.toggle_recording)
+        binding_buttons.listen('clock_on', controller.toggle_midi_clock)
+        binding_tempo.listen('*', controller.set_tempo)
+        bind_tablet_key.listen('tablet', controller.select_tablet)
         binding_devices.listen('output_midi_port_name', controller.open_midi_port)
+        binding_devices.listen('secondary_midi_port_name', controller.open_secondary_midi_port)
+        binding_devices.listen('input_midi_port_name', controller.open_midi_input_port)
+        binding_devices.listen('thru_midi_port_name', controller.open_thru_port)
+        binding_devices.listen('thru_channel', controller.set_thru_channel)
+        binding_devices.listen('thru_filter', controller.set_thru_filter)
+        binding_buttons.listen('thru_priority_on', controller.toggle_thru_priority)
+        binding_devices.listen('secondary_midi_channel', controller.route_secondary_midi_port)
 
         for binding in [bind_tablet_x, bind_tablet_y, bind_tablet_p, bind_mouse_x, bind_mouse_y]:
             binding.listen('message_type', controller.calculate_grid)
@@ -608,13 +1030,17 @@ class Controller:
             binding.listen('message_type', controller.on_message_type_changed)
             binding.listen('range_from', controller.clear_scale_cache)
             binding.listen('range_to', controller.clear_scale_cache)
-            binding.listen('threshold', lambda *args, **kwargs: self._threshold_axes.clear)
+            binding.listen('threshold', controller.clear_scale_cache)
             
     def get_tablets(self):
         tablets = pyglet.input.get_tablets()
         
         windowsInkInput = WindowsInkInput()
         tablets.insert(0, windowsInkInput)
+        tablets.append(OscInput())
+        tablets.append(WebInput())
+        tablets.append(SharedInput())
+        tablets.extend(EvdevInput(path) for path in device_paths())
         
         return tablets
 
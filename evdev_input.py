@@ -0,0 +1,296 @@
+import glob
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from input_canvas import InputCursor, QueuedTabletCanvas
+
+# Linux tablets read straight from evdev, with pressure and at the device rate. The device (or a capture of it,
+# `python evdev_input.py capture /dev/input/eventN capture`) is a stream of 24 byte struct input_event records,
+# little endian on 64 bit:
+#
+#   int64 seconds, int64 microseconds, uint16 type, uint16 code, int32 value
+#
+# Axes report only their changes, a SYN_REPORT closes every frame of changes. A SYN_DROPPED tells the reader fell
+# behind and the kernel dropped events, everything up to the next SYN_REPORT is discarded and the state is read
+# from the device again.
+# A capture has no device to ask for the axis ranges, they are kept next to it in a .ranges file.
+
+INPUT_EVENT = struct.Struct('<qqHHi')
+EV_SYN, EV_KEY, EV_ABS = 0, 1, 3
+SYN_REPORT, SYN_DROPPED = 0, 3
+ABS_X, ABS_Y, ABS_PRESSURE = 0x00, 0x01, 0x18
+BTN_TOOL_PEN, BTN_TOOL_RUBBER, BTN_TOUCH, BTN_STYLUS, BTN_STYLUS2 = 0x140, 0x141, 0x14a, 0x14b, 0x14c
+BUTTON_BITS = {BTN_TOUCH: 1, BTN_STYLUS: 2, BTN_STYLUS2: 4}
+EVIOCGABS = 0x80184540  # + axis code, reads struct input_absinfo: value, minimum, maximum, fuzz, flat, resolution
+ABS_INFO = struct.Struct('<6i')
+EVIOCGKEY = 0x80604518  # reads the key state, a bit per key code up to KEY_MAX
+READ_RECORDS = 512
+CAPTURE_RANGES = {ABS_X: (0, 4095), ABS_Y: (0, 4095), ABS_PRESSURE: (0, 1023)}  # for captures without ranges
+
+
+class EvdevDecoder:
+    # Decodes input_event records into (timestamp, cursor, x, y, pressure, buttons) frames, x, y and pressure
+    # normalized to [0, 1], y up.
+    # Axes without a known range are normalized to the range seen so far.
+    # resync() returns the ({axis code: value}, buttons) of the device after dropped events, None when it can't.
+
+    def __init__(self, ranges=None, resync=None):
+        self.ranges = dict(ranges or {})  # axis code: (minimum, maximum)
+        self.values = {ABS_X: 0, ABS_Y: 0, ABS_PRESSURE: 0}
+        self.buttons = 0
+        self.cursor = 'pen'
+        self.resync = resync
+        self.drops = 0
+        self._changed = False
+        self._dropping = False
+        self._partial = b''
+
+    def _normalize(self, code):
+        value = self.values[code]
+        minimum, maximum = self.ranges.get(code, (value, value))
+        if code not in self.ranges or not minimum <= value <= maximum:
+            self.ranges[code] = minimum, maximum = min(minimum, value), max(maximum, value)
+        return (value - minimum) / (maximum - minimum) if maximum > minimum else 0.0
+
+    def feed(self, data):
+        # records split between two reads are completed by the next one
+        if self._partial:
+            data = self._partial + data
+        end = len(data) - len(data) % INPUT_EVENT.size
+        self._partial = data[end:]
+
+        frames = []
+        values, changed, dropping = self.values, self._changed, self._dropping
+        for seconds, microseconds, event_type, code, value in INPUT_EVENT.iter_unpack(memoryview(data)[:end]):
+            if dropping and event_type != EV_SYN:
+                continue
+            if event_type == EV_ABS:
+                if code in values:
+                    values[code] = value
+                    changed = True
+            elif event_type == EV_KEY:
+                bit = BUTTON_BITS.get(code)
+                if bit:
+                    self.buttons = self.buttons | bit if value else self.buttons & ~bit
+                    changed = True
+                elif code in (BTN_TOOL_PEN, BTN_TOOL_RUBBER) and value:
+                    self.cursor = 'eraser' if code == BTN_TOOL_RUBBER else 'pen'
+            elif event_type == EV_SYN and code == SYN_DROPPED:
+                self.drops += 1
+                dropping, changed = True, False
+            elif event_type == EV_SYN and code == SYN_REPORT:
+                if dropping:
+                    dropping = False
+                    changed = self._resync()
+                if changed:
+                    changed = False
+                    frames.append((seconds + microseconds / 1e6, self.cursor, self._normalize(ABS_X),
+                                   1.0 - self._normalize(ABS_Y), self._normalize(ABS_PRESSURE), self.buttons))
+        self._changed, self._dropping = changed, dropping
+        return frames
+
+    def _resync(self):
+        state = self.resync() if self.resync else None
+        if state is None:
+            return False
+        device_values, self.buttons = state
+        self.values.update(device_values)
+        return True
+
+
+def read_abs_info(fd):
+    # axis code: (value, minimum, maximum) of the device now
+    import fcntl
+    info = dict()
+    for code in (ABS_X, ABS_Y, ABS_PRESSURE):
+        try:
+            value, minimum, maximum, _, _, _ = ABS_INFO.unpack(fcntl.ioctl(fd, EVIOCGABS + code, bytes(ABS_INFO.size)))
+        except OSError:
+            continue
+        info[code] = value, minimum, maximum
+    return info
+
+
+def read_abs_ranges(fd):
+    return {code: (minimum, maximum) for code, (_, minimum, maximum) in read_abs_info(fd).items()}
+
+
+def read_device_state(fd):
+    # ({axis code: value}, buttons) of the device now, for a resync after dropped events
+    import fcntl
+    try:
+        keys = int.from_bytes(fcntl.ioctl(fd, EVIOCGKEY, bytes(96)), 'little')
+    except OSError:
+        return None
+    buttons = sum(bit for code, bit in BUTTON_BITS.items() if keys >> code & 1)
+    return {code: value for code, (value, _, _) in read_abs_info(fd).items()}, buttons
+
+
+def capture_ranges(path):
+    # the device ranges saved with a capture, the ranges of write_capture() for captures without them
+    try:
+        with open(path + '.ranges') as f:
+            return {int(code): (int(minimum), int(maximum))
+                    for code, minimum, maximum in (line.split() for line in f if line.strip())}
+    except OSError:
+        return dict(CAPTURE_RANGES)
+
+
+def write_capture_ranges(path, ranges):
+    with open(path + '.ranges', 'w') as f:
+        f.writelines('%d %d %d\n' % (code, minimum, maximum) for code, (minimum, maximum) in sorted(ranges.items()))
+
+
+class EvdevReader(threading.Thread):
+    # Reads up to READ_RECORDS records per os.read from a device, or replays a capture file at its recorded pace.
+
+    def __init__(self, canvas, path):
+        super().__init__(name='evdev-input', daemon=True)
+        self.canvas = canvas
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY | getattr(os, 'O_NONBLOCK', 0))
+        self.is_device = path.startswith('/dev/')
+        if self.is_device:
+            self.decoder = EvdevDecoder(read_abs_ranges(self.fd), lambda: read_device_state(self.fd))
+        else:
+            self.decoder = EvdevDecoder(capture_ranges(path))
+        self._stopped = threading.Event()
+
+    def run(self):
+        push, feed = self.canvas.push, self.decoder.feed
+        size = READ_RECORDS * INPUT_EVENT.size
+        start = first = None
+        while not self._stopped.is_set():
+            if self.is_device:
+                if not select.select([self.fd], [], [], 0.1)[0]:
+                    continue
+                try:
+                    data = os.read(self.fd, size)
+                except BlockingIOError:
+                    continue
+                for timestamp, *frame in feed(data):
+                    push(*frame)
+                continue
+
+            data = os.read(self.fd, size)
+            if not data:
+                break
+            for timestamp, *frame in feed(data):
+                if start is None:
+                    start, first = time.perf_counter(), timestamp
+                delay = start + timestamp - first - time.perf_counter()
+                if delay > 0 and self._stopped.wait(delay):
+                    return
+                push(*frame)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        os.close(self.fd)
+
+
+class EvdevTabletCanvas(QueuedTabletCanvas):
+    def __init__(self, window, path, **kwargs):
+        super().__init__(window, **kwargs)
+        self.reader = EvdevReader(self, path)
+        self.reader.start()
+
+    def close(self):
+        self.reader.stop()
+        super().close()
+
+
+def device_paths():
+    # event devices with a pressure axis, and the capture file named by TOUCHY_EVDEV_CAPTURE
+    paths = []
+    for capabilities in sorted(glob.glob('/sys/class/input/event*/device/capabilities/abs')):
+        try:
+            with open(capabilities) as f:
+                words = f.read().split()
+        except OSError:
+            continue
+        mask = int(''.join('%016x' % int(word, 16) for word in words), 16) if words else 0
+        if mask >> ABS_PRESSURE & 1:
+            paths.append('/dev/input/' + capabilities.split('/')[4])
+    capture = os.environ.get('TOUCHY_EVDEV_CAPTURE')
+    if capture:
+        paths.append(capture)
+    return paths
+
+
+class EvdevInput:
+    source_name = "evdev"
+    cursor_names = ['pen', 'eraser']
+
+    def __init__(self, path):
+        self.path = path
+        self.cursors = list(map(InputCursor, self.cursor_names))
+        self.buttons = [str(buttons) for buttons in range(8)]  # bits of touch, stylus, stylus 2
+
+    @property
+    def name(self):
+        return '%s %s' % (EvdevInput.source_name, os.path.basename(self.path))
+
+    def open(self, window):
+        try:
+            return EvdevTabletCanvas(window, self.path)
+        except OSError as e:
+            print(e)
+
+
+def write_capture(path, frames, rate=1000, maximums=(4095, 4095, 1023)):
+    # a capture of normalized (x, y, pressure, buttons) frames, y up, as a tablet would send them
+    write_capture_ranges(path, {code: (0, maximum) for code, maximum in zip((ABS_X, ABS_Y, ABS_PRESSURE), maximums)})
+    with open(path, 'wb') as f:
+        records = []
+        for i, (x, y, pressure, buttons) in enumerate(frames):
+            seconds, microseconds = divmod(i * 1000000 // rate, 1000000)
+            for code, value, maximum in zip((ABS_X, ABS_Y, ABS_PRESSURE), (x, 1.0 - y, pressure), maximums):
+                records.append(INPUT_EVENT.pack(seconds, microseconds, EV_ABS, code, round(value * maximum)))
+            records.append(INPUT_EVENT.pack(seconds, microseconds, EV_KEY, BTN_TOUCH, buttons & 1))
+            records.append(INPUT_EVENT.pack(seconds, microseconds, EV_SYN, SYN_REPORT, 0))
+        f.write(b''.join(records))
+
+
+def benchmark(frames=100000):
+    # frames per second decoded from a synthetic capture file, read like a device
+    path = 'evdev-benchmark.capture'
+    write_capture(path, [((i % 1000) / 1000, 0.5, (i % 100) / 100, i & 1) for i in range(frames)])
+    decoder = EvdevDecoder({ABS_X: (0, 4095), ABS_Y: (0, 4095), ABS_PRESSURE: (0, 1023)})
+    decoded = 0
+    fd = os.open(path, os.O_RDONLY)
+    start = time.perf_counter()
+    while True:
+        data = os.read(fd, READ_RECORDS * INPUT_EVENT.size)
+        if not data:
+            break
+        decoded += len(decoder.feed(data))
+    duration = time.perf_counter() - start
+    os.close(fd)
+    os.remove(path)
+    os.remove(path + '.ranges')
+    print('%d frames in %.3f s, %.0f frames/s' % (decoded, duration, decoded / duration))
+
+
+def capture(device, path):
+    # copies the events of a device into a capture file with its ranges until interrupted
+    fd = os.open(device, os.O_RDONLY)
+    write_capture_ranges(path, read_abs_ranges(fd))
+    with open(path, 'wb') as f:
+        try:
+            while True:
+                f.write(os.read(fd, READ_RECORDS * INPUT_EVENT.size))
+        except KeyboardInterrupt:
+            pass
+    os.close(fd)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['capture']:
+        capture(*sys.argv[2:4])
+    else:
+        benchmark(*map(int, sys.argv[1:]))
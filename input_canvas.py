@@ -0,0 +1,62 @@
+import time
+from collections import namedtuple, deque
+
+import pyglet
+import pyglet.clock
+from pyglet.event import EventDispatcher
+
+# instance tells apart cursors of the same name used at once, like the pointers of several web clients. Rules are
+# chosen by the name, every instance keeps its own filter and threshold state.
+InputCursor = namedtuple("InputCursor", ["name", "instance"])
+InputCursor.__new__.__defaults__ = (None,)
+
+
+class QueuedTabletCanvas(EventDispatcher):
+    # Tablet-like canvas fed from a background thread.
+    # Producers call push() with coordinates normalized to [0, 1], the pyglet loop drains the bounded queue and
+    # dispatches the same on_motion events as pyglet tablet canvases, so Controller.toggle_tablet_input handles both.
+
+    def __init__(self, window, queue_size=4096, poll_interval=1 / 250):
+        self.window = window
+        self.samples = deque(maxlen=queue_size)
+        self.dropped = 0
+        self.timestamp = None  # perf_counter time the sample being dispatched was pushed
+        self._cursors = dict()
+        self._poll_interval = poll_interval
+        pyglet.clock.schedule_interval(self._drain, poll_interval)
+
+    def push(self, cursor, x, y, pressure, buttons):
+        samples = self.samples
+        if len(samples) == samples.maxlen:
+            self.dropped += 1
+        samples.append((time.perf_counter(), cursor, x, y, pressure, buttons))
+
+    def cursor(self, name, instance=None):
+        cursor = self._cursors.get((name, instance), None)
+        if cursor is None:
+            cursor = self._cursors[name, instance] = InputCursor(name, instance)
+            self.dispatch_event('on_enter', cursor)
+        return cursor
+
+    def leave(self, cursor):
+        if self._cursors.pop((cursor.name, cursor.instance), None):
+            self.dispatch_event('on_leave', cursor)
+
+    def _drain(self, dt):
+        samples = self.samples
+        width, height = self.window.width, self.window.height
+        for _ in range(len(samples)):
+            self.timestamp, name, x, y, pressure, buttons = samples.popleft()
+            self.dispatch_event('on_motion', self.cursor(name), x * width, y * height, pressure, buttons)
+
+    def close(self):
+        pyglet.clock.unschedule(self._drain)
+        for cursor in self._cursors.values():
+            self.dispatch_event('on_leave', cursor)
+        self._cursors.clear()
+        self.samples.clear()
+
+
+QueuedTabletCanvas.register_event_type('on_enter')
+QueuedTabletCanvas.register_event_type('on_leave')
+QueuedTabletCanvas.register_event_type('on_motion')
@@ -0,0 +1,73 @@
+import threading
+
+
+class SpscRing:
+    # Bounded single producer, single consumer ring. Only the producer moves the tail and only the consumer
+    # moves the head, so neither side takes a lock. push() drops and counts items while the ring is full.
+
+    def __init__(self, size=4096):
+        assert size & (size - 1) == 0, 'size must be a power of two'
+        self.size = size
+        self.dropped = 0
+        self._mask = size - 1
+        self._slots = [None] * size
+        self._head = 0
+        self._tail = 0
+
+    def __len__(self):
+        return self._tail - self._head
+
+    def push(self, item):
+        tail = self._tail
+        if tail - self._head >= self.size:
+            self.dropped += 1
+            return False
+        self._slots[tail & self._mask] = item
+        self._tail = tail + 1  # published after the slot is written
+        return True
+
+    def pop(self):
+        head = self._head
+        if head == self._tail:
+            return None
+        slot = head & self._mask
+        item = self._slots[slot]
+        self._slots[slot] = None
+        self._head = head + 1
+        return item
+
+
+class InputThread(threading.Thread):
+    # Runs the calls submitted by the main thread in order, on its own thread, so MIDI generation does not wait
+    # for drawing. Only the main thread may call submit().
+
+    def __init__(self, size=4096):
+        super().__init__(name='input', daemon=True)
+        self.ring = SpscRing(size)
+        self._wake = threading.Event()
+        self._stopped = False
+
+    def submit(self, function, *args, **kwargs):
+        if self.ring.push((function, args, kwargs)):
+            self._wake.set()
+
+    def run(self):
+        pop, wake = self.ring.pop, self._wake
+        while not self._stopped:
+            item = pop()
+            if item is None:
+                wake.clear()
+                if not len(self.ring):
+                    wake.wait(0.1)
+                continue
+            function, args, kwargs = item
+            try:
+                function(*args, **kwargs)
+            except Exception as e:
+                print(e)
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        if self.is_alive():
+            self.join()
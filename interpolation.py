@@ -0,0 +1,135 @@
+import threading
+import time
+
+# message types with a continuous value that can be ramped
+INTERPOLATED_MESSAGE_TYPES = ('pitch', 'control', 'aftertouch', 'polytouch')
+
+
+def is_interpolated(rule):
+    return getattr(rule, 'interpolate', False) and rule.message_type in INTERPOLATED_MESSAGE_TYPES \
+        and 'step' not in rule._fields
+
+
+class Ramp:
+    __slots__ = ('start', 'target', 'start_time', 'duration', 'sent', 'input_time')
+
+    def __init__(self, value, timestamp):
+        self.start = self.target = value
+        self.start_time = self.input_time = timestamp
+        self.duration = 0.0
+        self.sent = value
+
+    def move(self, target, timestamp, min_duration, max_duration):
+        # starts from where the ramp is now, takes as long as the gap between the last two input samples. A gap
+        # longer than max_duration was an idle input, not its rate, the first sample after it gets min_duration.
+        self.start = self.value(timestamp)
+        self.target = target
+        self.start_time = timestamp
+        gap = timestamp - self.input_time
+        self.duration = max(gap if gap <= max_duration else 0.0, min_duration)
+        self.input_time = timestamp
+
+    def value(self, timestamp):
+        progress = (timestamp - self.start_time) / self.duration if self.duration else 1.0
+        if progress >= 1.0:
+            return self.target
+        return self.start + (self.target - self.start) * progress
+
+    def finished(self, timestamp):
+        return timestamp - self.start_time >= self.duration
+
+
+class OutputInterpolator:
+    # Ramps the output of continuous rules between sparse input samples, one ramp per input key and rule.
+    # One timer thread steps all active ramps at a fixed rate and calls send(rule, value) only when the integer
+    # value changes. The thread waits on a condition while no ramp is active.
+    # Ramps start at the capture timestamp of their sample, a sample handled late is behind on its ramp already.
+
+    def __init__(self, send, rate=500, max_duration=0.1, clock=time.perf_counter):
+        self.send = send
+        self.period = 1.0 / rate
+        self.max_duration = max_duration
+        self.clock = clock
+        self.ticks = 0
+        self._ramps = dict()
+        self._active = set()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def move(self, key, rule, value, timestamp=None):
+        if timestamp is None:
+            timestamp = self.clock()
+        with self._condition:
+            ramp = self._ramps.get((key, rule))
+            if ramp is None:
+                # nothing to ramp from, the first value is sent as is
+                self._ramps[key, rule] = Ramp(value, timestamp)
+                first = True
+            else:
+                ramp.move(value, timestamp, 2 * self.period, self.max_duration)
+                self._active.add((key, rule))
+                first = False
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name='output-interpolator', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        if first:
+            self.send(rule, value)
+
+    def step(self, now):
+        with self._condition:
+            active = [(ramp_key, ramp, int(round(ramp.value(now))))
+                      for ramp_key, ramp in ((ramp_key, self._ramps[ramp_key]) for ramp_key in self._active)]
+        # sent outside of the lock, so a slow sink never blocks move()
+        for (_, rule), ramp, value in active:
+            if value != ramp.sent:
+                ramp.sent = value
+                try:
+                    self.send(rule, value)
+                except Exception as e:
+                    print(e)
+        with self._condition:
+            for ramp_key, ramp, _ in active:
+                # a ramp moved since now has not reached its new target
+                if ramp.start_time <= now and ramp.finished(now) and self._ramps.get(ramp_key) is ramp:
+                    self._active.discard(ramp_key)
+        self.ticks += 1
+
+    def clear(self, instance=None):
+        # drops the ramps of rules that were replaced, or of the input keys of a cursor instance that left,
+        # the next value of a rule is sent as is
+        with self._condition:
+            if instance is None:
+                self._ramps.clear()
+                self._active.clear()
+                return
+            for ramp_key in [ramp_key for ramp_key in self._ramps if ramp_key[0][3:] == (instance,)]:
+                del self._ramps[ramp_key]
+                self._active.discard(ramp_key)
+
+    def _run(self):
+        clock, period = self.clock, self.period
+        next_tick = clock()
+        while True:
+            with self._condition:
+                while not self._active and not self._stopped:
+                    self._condition.wait()
+                    next_tick = clock()
+                if self._stopped:
+                    return
+            now = clock()
+            if now < next_tick:
+                time.sleep(next_tick - now)
+                now = clock()
+            # a late tick is not made up for, the schedule restarts from now
+            next_tick = max(next_tick + period, now)
+            self.step(now)
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
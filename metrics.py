@@ -0,0 +1,218 @@
+import bisect
+import threading
+from itertools import chain
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# Counters, gauges and fixed bucket histograms, updated from the hot paths without locks: an update is a few
+# attribute writes, a reader may see a histogram halfway through one. Values that already exist elsewhere,
+# like queue depths, are read by collectors when the metrics are read, costing nothing meanwhile.
+# The registry is exposed in the Prometheus text format, on a loopback HTTP endpoint when it is started.
+# Snapshots of the registry of another process can be included, their samples get a process label.
+
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9464
+FRAME_BUCKETS = (0.002, 0.004, 0.008, 0.016, 0.033, 0.066, 0.133)
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01)
+
+
+class Counter:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class Gauge(Counter):
+    __slots__ = ()
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def samples(self, name, labels):
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield name + '_bucket', labels + (('le', '+Inf' if bound == float('inf') else repr(bound)),), total
+        yield name + '_count', labels, self.count
+        yield name + '_sum', labels, self.sum
+
+
+class MetricFamily:
+    def __init__(self, name, help, kind, label_names, factory):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.label_names = label_names
+        self.children = dict()
+        self._factory = factory
+        self._unlabelled = None if label_names else self.labels()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children.setdefault(values, self._factory())
+        return child
+
+    # the family itself stands for its child without labels
+    def inc(self, amount=1):
+        self._unlabelled.inc(amount)
+
+    def set(self, value):
+        self._unlabelled.set(value)
+
+    def observe(self, value):
+        self._unlabelled.observe(value)
+
+    def samples(self):
+        for values, child in list(self.children.items()):
+            yield from child.samples(self.name, tuple(zip(self.label_names, values)))
+
+
+class Registry:
+    def __init__(self):
+        self.families = []
+        self.collectors = []
+        self.included = dict()  # process: snapshot()
+
+    def _add(self, family):
+        self.families.append(family)
+        return family
+
+    def counter(self, name, help, label_names=()):
+        return self._add(MetricFamily(name, help, 'counter', label_names, Counter))
+
+    def gauge(self, name, help, label_names=()):
+        return self._add(MetricFamily(name, help, 'gauge', label_names, Gauge))
+
+    def histogram(self, name, help, buckets, label_names=()):
+        return self._add(MetricFamily(name, help, 'histogram', label_names, lambda: Histogram(buckets)))
+
+    def collector(self, name, help, kind, collect):
+        # collect() returns [(label pairs, value)] when the metrics are read
+        self.collectors.append((name, help, kind, collect))
+
+    def _local_families(self):
+        for family in self.families:
+            yield family.name, family.help, family.kind, family.samples()
+        for name, help, kind, collect in self.collectors:
+            try:
+                samples = [(name, labels, value) for labels, value in collect()]
+            except Exception as e:
+                print(e)
+                continue
+            yield name, help, kind, samples
+
+    def snapshot(self):
+        # the families with their samples in plain tuples, to be sent to another process
+        return [(name, help, kind, list(samples)) for name, help, kind, samples in self._local_families()]
+
+    def include(self, process, snapshot):
+        self.included[process] = snapshot
+
+    def _families(self):
+        # included samples join the local family of the same name, a family is listed once
+        included = dict()
+        for process, snapshot in list(self.included.items()):
+            for name, help, kind, samples in snapshot:
+                included.setdefault(name, (help, kind, []))[2].extend(
+                    (sample_name, labels + (('process', process),), value) for sample_name, labels, value in samples)
+        for name, help, kind, samples in self._local_families():
+            other = included.pop(name, None)
+            yield name, help, kind, chain(samples, other[2]) if other else samples
+        for name, (help, kind, samples) in included.items():
+            yield name, help, kind, samples
+
+    def exposition(self):
+        lines = []
+        for name, help, kind, samples in self._families():
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, kind))
+            lines.extend(format_sample(*sample) for sample in samples)
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        # one line per counter and gauge, count and mean per histogram, for the overlay
+        lines = []
+        for name, help, kind, samples in self._families():
+            if kind != 'histogram':
+                lines.extend(format_sample(*sample) for sample in samples)
+                continue
+            totals = dict()
+            for sample_name, labels, value in samples:
+                if not sample_name.endswith('_bucket'):
+                    totals.setdefault(labels, dict())[sample_name[len(name) + 1:]] = value
+            for labels, total in totals.items():
+                mean = total['sum'] / total['count'] if total['count'] else 0.0
+                lines.append('%s n=%d mean=%.2f ms' % (format_name(name, labels), total['count'], 1e3 * mean))
+        return '\n'.join(lines)
+
+
+def format_name(name, labels):
+    if not labels:
+        return name
+    return name + '{%s}' % ','.join('%s="%s"' % (key, str(label).replace('\\', '\\\\').replace('"', '\\"'))
+                                    for key, label in labels)
+
+
+def format_sample(name, labels, value):
+    return '%s %s' % (format_name(name, labels), value if isinstance(value, int) else repr(float(value)))
+
+
+class MetricsServer(threading.Thread):
+    # GET /metrics in the Prometheus text format, on the loopback interface only
+
+    def __init__(self, registry, host=METRICS_HOST, port=METRICS_PORT):
+        super().__init__(name='metrics', daemon=True)
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = self.server.registry.exposition().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = HTTPServer((host, port), Handler)
+        self.server.registry = registry
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def run(self):
+        self.server.serve_forever(poll_interval=0.5)
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+metrics = Registry()
@@ -69,3 +69,19 @@ MIDI_CONTROL_CODES['Omni Mode Off'] = 124
 MIDI_CONTROL_CODES['Omni Mode On'] = 125
 MIDI_CONTROL_CODES['Mono Operation'] = 126
 MIDI_CONTROL_CODES['Poly Operation'] = 127
+
+
+def midi_message_length(status):
+    # total length in bytes of a message starting with the given status byte, 0 for SysEx (terminated by 0xF7)
+    if status < 0xF0:
+        return 2 if status & 0xE0 == 0xC0 else 3
+    return {0xF0: 0, 0xF1: 2, 0xF2: 3, 0xF3: 2}.get(status, 1)
+
+
+# 14 bit controllers: the coarse controller carries the MSB, the one 32 above it the LSB
+MIDI_FINE_CONTROL_CODES = {code: code + 32 for code in MIDI_CONTROL_CODES.values()
+                           if code < 32 and code + 32 in MIDI_CONTROL_CODES.values()}
+MIDI_14_BIT_MAX = (1 << 14) - 1
+
+MIDI_14_BIT_MSB = bytes(value >> 7 for value in range(MIDI_14_BIT_MAX + 1))
+MIDI_14_BIT_LSB = bytes(value & 0x7F for value in range(MIDI_14_BIT_MAX + 1))
@@ -0,0 +1,392 @@
+import multiprocessing
+import queue
+import struct
+import sys
+import threading
+import time
+from collections import deque
+
+from metrics import metrics
+from midi_outputs import MidiSink
+from scheduler import JitterStatistics
+from shm_ring import RecordRing
+
+# Runs the rule evaluation and the output ports in a worker process, so garbage collection and GUI work of
+# the window process stop delaying the MIDI. The window process pushes its input into a shared memory ring,
+# one record per call, and publishes the mappings and settings as versioned snapshots; the worker sends back
+# what the note grid and the output log show, the messages to record and the controls generated for the thru.
+
+# Calls run by the worker, the record kind is the index. define_name is the worker's side of the name ids.
+ENGINE_COMMANDS = ('process_axes_input', 'saturate_thresholds', 'reset_thresholds', 'midi_all_notes_off', 'send_bytes',
+                   'flush_smoothing', 'flush_idle_smoothing', 'clear_pipelines', 'clear_instance', 'define_name')
+ENGINE_AXES = ('x', 'y', 'z')
+
+# kind, axes present (bit per ENGINE_AXES), byte count of data or the id of a defined name, ids of the source,
+# cursor and button names, cursor instance, data (raw bytes, a defined name), x, y, z, domains (from, to) of x,
+# y, z, timestamp.
+# Source, cursor and button names, like tablet names, can be long, each is sent once in a define_name record
+# ahead of the first record using its id, in order through the ring. Instances are short and change a lot, they
+# are sent as text. Names and instances that don't fit are refused, a cut name would never match its rules.
+ENGINE_RECORD = struct.Struct('<BBHHHH16s128s3d6dd')
+ENGINE_NAME_SIZE = 128
+ENGINE_INSTANCE_SIZE = 16
+ENGINE_STATUS_INTERVAL = 1 / 60
+ENGINE_METRICS_INTERVAL = 0.5
+
+
+def _text(value):
+    return value.rstrip(b'\0').decode()
+
+
+def wait_for_records(ring, wake, stopped, handle_batch, timeout=0.005):
+    # hands the records over in batches until stopped, sleeping on wake while the ring is empty. A wake up lost
+    # between the waiting flag and the producer's check only costs the timeout.
+    while not stopped.is_set():
+        records = ring.pop_batch()
+        if records:
+            handle_batch(records)
+            continue
+        ring.waiting = True
+        if not len(ring):
+            wake.wait(timeout)
+        wake.clear()
+        ring.waiting = False
+
+
+def apply_snapshot(controller, snapshot):
+    from bindings import model, binding_buttons, binding_devices, binding_tempo, named_storage
+    storage, buttons, devices, tempo = snapshot
+    storage = named_storage(storage)
+    if storage != model.snapshot():
+        model.restore(storage)
+        controller.clear_pipelines()
+    binding_buttons.from_dict(buttons)
+    binding_tempo.from_dict(tempo)
+    controller.set_tempo(None, binding=binding_tempo)
+
+    # only the output ports belong to the worker, inputs and thru stay with the window
+    previous = binding_devices.to_dict()
+    binding_devices.from_dict(devices)
+    if devices['output_midi_port_name'] != previous['output_midi_port_name']:
+        controller.open_midi_port(devices['output_midi_port_name'], binding=binding_devices)
+    if devices['secondary_midi_port_name'] != previous['secondary_midi_port_name']:
+        controller.open_secondary_midi_port(devices['secondary_midi_port_name'], binding=binding_devices)
+    elif devices['secondary_midi_channel'] != previous['secondary_midi_channel']:
+        controller.route_secondary_midi_port(devices['secondary_midi_channel'], binding=binding_devices)
+
+
+class ForwardingRecorder:
+    # The worker's recorder, the messages go back with the status and the window's recorder writes them, so a
+    # recording stays one file whichever process generated its messages.
+
+    def __init__(self, buttons, buffer_size=1 << 16):
+        self.buttons = buttons
+        self.messages = deque(maxlen=buffer_size)
+
+    @property
+    def is_recording(self):
+        return self.buttons.record_on
+
+    def record(self, message):
+        self.messages.append((time.perf_counter(), bytes(message.bytes())))
+
+    def take(self):
+        messages = self.messages
+        return [messages.popleft() for _ in range(len(messages))]
+
+    def stop(self):
+        pass
+
+
+def _send_status(controller, statuses, stopped):
+    sent_version, sent_generated, sent_metrics = None, 0.0, 0.0
+    while not stopped.wait(ENGINE_STATUS_INTERVAL):
+        version, output_status = controller._note_history_version, controller._output_status
+        now = time.perf_counter()
+        snapshot = None
+        if now - sent_metrics >= ENGINE_METRICS_INTERVAL:
+            snapshot, sent_metrics = metrics.snapshot(), now
+        recorded = controller.recorder.take()
+        # the control changes generated since the last status, the window's thru holds its input back for them
+        generated = {key: timestamp for key, timestamp in list(controller.thru._generated.items())
+                     if timestamp > sent_generated}
+        if version == sent_version and output_status is None and not recorded and not generated and not snapshot:
+            continue
+        controller._output_status = None
+        sent_version = version
+        sent_generated = max(generated.values(), default=sent_generated)
+        statuses.put((list(controller._play_note_history), str(output_status) if output_status else None,
+                      recorded, generated, snapshot))
+
+
+def run_engine(ring, wake, stopped, snapshots, statuses):
+    # worker process main, the controller is imported here without a window
+    import pyglet
+    pyglet.options['shadow_window'] = False
+    from controller import controller
+    from bindings import binding_buttons
+
+    controller.recorder = ForwardingRecorder(binding_buttons)
+    version = -1
+    names = dict()  # id: name
+
+    def handle(record):
+        kind, axes, length, source, cursor, button, instance, data = record[:8]
+        command = ENGINE_COMMANDS[kind]
+        try:
+            if command == 'process_axes_input':
+                values, domains = record[8:11], record[11:17]
+                axis_values = {axis: values[i] for i, axis in enumerate(ENGINE_AXES) if axes & (1 << i)}
+                controller.process_axes_input(
+                    names[source], names[cursor], names[button], axis_values=axis_values,
+                    domains={axis: domains[2 * i:2 * i + 2] for i, axis in enumerate(ENGINE_AXES) if axes & (1 << i)},
+                    timestamp=record[17], instance=_text(instance) or None)
+            elif command == 'define_name':
+                names[length] = _text(data)
+            elif command == 'send_bytes':
+                controller.port.send_bytes(data[:length])
+            elif command == 'clear_instance':
+                controller.clear_instance(_text(instance))
+            else:
+                getattr(controller, command)()
+        except Exception as e:
+            print(e)
+
+    def handle_batch(records):
+        nonlocal version
+        try:
+            while True:
+                version, snapshot = snapshots.get_nowait()
+                apply_snapshot(controller, snapshot)
+        except queue.Empty:
+            pass
+        # input arriving before the first snapshot has no mappings to go through, the names it defines are kept
+        for record in records:
+            if version >= 0 or ENGINE_COMMANDS[record[0]] == 'define_name':
+                handle(record)
+
+    threading.Thread(target=_send_status, args=(controller, statuses, stopped), name='engine-status',
+                     daemon=True).start()
+    wait_for_records(ring, wake, stopped, handle_batch)
+    controller.interpolator.stop()
+    controller.scheduler.stop()
+    controller.port.close()
+
+
+class EngineSink(MidiSink):
+    # the window process output while the engine runs, raw bytes are forwarded to the worker's ports
+    name = 'engine'
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def send_bytes(self, data):
+        self.engine.push_bytes(data)
+
+
+class MidiEngine:
+    # Window process side of the worker. Records are pushed from the main thread and from the output worker of
+    # the EngineSink, a lock keeps the ring single producer.
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.version = 0
+        self.oversized = 0
+        self.process = None
+        self.ring = None
+        self._snapshot = None
+        self._names = dict()  # name: id, defined in the worker
+        self._lock = threading.Lock()
+        self._context = multiprocessing.get_context('spawn')  # a forked window process would bring its GUI along
+
+    @property
+    def is_running(self):
+        return self.process is not None
+
+    def start(self):
+        if self.process:
+            return
+        context = self._context
+        self.ring = RecordRing.create(ENGINE_RECORD, self.capacity)
+        self._wake = context.Event()
+        self._stopped = context.Event()
+        self._snapshots = context.Queue()
+        self._statuses = context.Queue()
+        self._snapshot = None
+        self._names = dict()
+        self.process = context.Process(
+            target=run_engine, args=(self.ring, self._wake, self._stopped, self._snapshots, self._statuses),
+            name='touchy-engine', daemon=True)
+        self.process.start()
+
+    def _push(self, *values):
+        with self._lock:
+            pushed = self.ring.push(*values)
+        if pushed and self.ring.waiting:
+            self._wake.set()
+        return pushed
+
+    def _name_id(self, name):
+        # called from the main thread only, None when the definition was dropped, it is sent again next time,
+        # 0 for names that don't fit
+        name = str(name)
+        name_id = self._names.get(name)
+        if name_id is None:
+            data = name.encode()
+            if len(data) > ENGINE_NAME_SIZE:
+                print('name longer than %d bytes, its input is not sent to the engine: %r' % (ENGINE_NAME_SIZE, name))
+                self._names[name] = 0
+                return 0
+            name_id = len(self._names) + 1
+            if not self._push(ENGINE_COMMANDS.index('define_name'), 0, name_id, 0, 0, 0, b'', data, *[0.0] * 10):
+                return None
+            self._names[name] = name_id
+        return name_id
+
+    def _instance(self, instance):
+        data = str(instance).encode() if instance is not None else b''
+        if len(data) > ENGINE_INSTANCE_SIZE:
+            raise ValueError('cursor instance longer than %d bytes: %r' % (ENGINE_INSTANCE_SIZE, instance))
+        return data
+
+    def push_axes(self, source, cursor, button, axis_values, domains, timestamp, instance=None):
+        axes, values, ranges = 0, [0.0] * 3, [0.0] * 6
+        for i, axis in enumerate(ENGINE_AXES):
+            if axis in axis_values:
+                axes |= 1 << i
+                values[i] = axis_values[axis]
+                ranges[2 * i], ranges[2 * i + 1] = domains[axis]
+        ids = [self._name_id(name) for name in (source, cursor, button)]
+        if not all(ids):
+            self.oversized += 0 in ids
+            return
+        try:
+            instance = self._instance(instance)
+        except ValueError as e:
+            self.oversized += 1
+            print(e)
+            return
+        self._push(0, axes, 0, *ids, instance, b'', *values, *ranges, timestamp)
+
+    def push_command(self, name, instance=None):
+        try:
+            instance = self._instance(instance)
+        except ValueError as e:
+            self.oversized += 1
+            print(e)
+            return
+        self._push(ENGINE_COMMANDS.index(name), 0, 0, 0, 0, 0, instance, b'', *[0.0] * 10)
+
+    def push_bytes(self, data):
+        if len(data) > ENGINE_NAME_SIZE:
+            self.oversized += 1
+            return
+        self._push(ENGINE_COMMANDS.index('send_bytes'), 0, len(data), 0, 0, 0, b'', bytes(data), *[0.0] * 10)
+
+    def publish(self, snapshot):
+        # a new version only when something changed, the worker applies it before its next record
+        if snapshot == self._snapshot:
+            return
+        self._snapshot = snapshot
+        self.version += 1
+        self._snapshots.put((self.version, snapshot))
+
+    def poll_status(self):
+        # the latest (played notes, output message text) of the worker, None when nothing changed, the
+        # [(timestamp, bytes)] to record and the {(channel, control): timestamp} generated of every status.
+        # The worker's metrics are included in the window's registry as they arrive.
+        status, recorded, generated = None, [], dict()
+        try:
+            while True:
+                *status, messages, controls, snapshot = self._statuses.get_nowait()
+                recorded.extend(messages)
+                generated.update(controls)
+                if snapshot:
+                    metrics.include('engine', snapshot)
+        except queue.Empty:
+            return status, recorded, generated
+
+    def stop(self):
+        if not self.process:
+            return
+        self._stopped.set()
+        self._wake.set()
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process = None
+
+
+def _record_latency(latencies):
+    def handle_batch(records):
+        now = time.perf_counter()
+        latencies.extend(now - record[-1] for record in records)
+    return handle_batch
+
+
+def _benchmark_worker(ring, wake, stopped, ready, results):
+    latencies = []
+    ready.set()
+    wait_for_records(ring, wake, stopped, _record_latency(latencies))
+    results.put(latencies)
+
+
+def _gui_load(stopped, frame=1 / 60, busy=0.008):
+    # a frame of Python work and garbage every 60th of a second, like layout and drawing of the widgets
+    while not stopped.is_set():
+        start = time.perf_counter()
+        garbage = []
+        while time.perf_counter() - start < busy:
+            garbage.append([{'x': i} for i in range(50)])
+        time.sleep(max(frame - (time.perf_counter() - start), 0))
+
+
+def benchmark(samples=5000, rate=1000):
+    # latency from push to handling of axis samples, consumed by a thread of the same process or by a worker
+    # process, while another thread of the pushing process does GUI like work
+    context = multiprocessing.get_context('spawn')
+    for mode in ('in process', 'out of process'):
+        ring = RecordRing.create(ENGINE_RECORD, 4096)
+        wake, stopped, ready, results = context.Event(), context.Event(), context.Event(), context.Queue()
+        if mode == 'in process':
+            latencies = []
+            consumer = threading.Thread(target=wait_for_records,
+                                        args=(ring, wake, stopped, _record_latency(latencies)))
+        else:
+            consumer = context.Process(target=_benchmark_worker, args=(ring, wake, stopped, ready, results))
+        consumer.start()
+        if mode == 'out of process':
+            ready.wait()  # samples pushed while the worker starts would measure its start up
+        load_stopped = threading.Event()
+        load = threading.Thread(target=_gui_load, args=(load_stopped,))
+        load.start()
+
+        start = time.perf_counter()
+        for i in range(samples):
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            ring.push(0, 3, 0, 1, 2, 3, b'', b'', i, i, 0.0, 0.0, 1.0, 0.0, 1.0, 0.0, 0.0, time.perf_counter())
+            if ring.waiting:
+                wake.set()
+        while len(ring):
+            time.sleep(0.01)
+        load_stopped.set()
+        load.join()
+        stopped.set()
+        wake.set()
+        if mode == 'out of process':
+            latencies = results.get()
+        consumer.join()
+
+        statistics = JitterStatistics()
+        for latency in latencies:
+            statistics.add(latency)
+        latencies.sort()
+        print('%s: %d samples, latency mean %.1f us, deviation %.1f us, p99 %.1f us, max %.1f us' % (
+            mode, statistics.count, 1e6 * statistics.mean, 1e6 * statistics.deviation,
+            1e6 * latencies[int(len(latencies) * 0.99)], 1e6 * statistics.worst))
+
+
+if __name__ == '__main__':
+    benchmark(*map(int, sys.argv[1:]))
@@ -0,0 +1,67 @@
+import threading
+from collections import OrderedDict
+
+import mido
+
+
+def get_input_names():
+    try:
+        return mido.get_input_names()
+    except Exception as e:
+        print(e)
+        return []
+
+
+def input_message_key(message):
+    # key and value of the messages kept by MidiInputListener, None for the others
+    if message.type == 'control_change':
+        return ('control', message.channel, message.control), message.value
+    if message.type == 'pitchwheel':
+        return ('pitch', message.channel), message.pitch
+    if message.type == 'program_change':
+        return ('program', message.channel), message.program
+    return None, None
+
+
+class MidiInputListener:
+    # Callback based input: the port calls feed() from its own thread, only the latest value of every controller,
+    # pitch wheel and program of each channel is kept until drain() is called on the main thread.
+    # However much a DAW sends, one drain touches every widget at most once.
+
+    def __init__(self):
+        self.port = None
+        self.received = 0
+        self.coalesced = 0
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self.port.name if self.port else None
+
+    def open(self, name):
+        self.close()
+        self.port = mido.open_input(name, callback=self.feed)
+
+    def feed(self, message):
+        key, value = input_message_key(message)
+        self.received += 1
+        if key is None:
+            return
+        with self._lock:
+            if key in self._pending:
+                self.coalesced += 1
+                del self._pending[key]  # keeps the order of arrival of the latest values
+            self._pending[key] = value
+
+    def drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, OrderedDict()
+        return list(pending.items())
+
+    def close(self):
+        if self.port:
+            self.port.close()
+            self.port = None
+        with self._lock:
+            self._pending.clear()
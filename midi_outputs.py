@@ -0,0 +1,600 @@
+import os
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import deque, OrderedDict
+
+import mido
+
+from midi_codes import midi_message_length, MIDI_14_BIT_MSB, MIDI_14_BIT_LSB, MIDI_FINE_CONTROL_CODES
+
+NETWORK_MIDI_SCHEME = 'rtp-midi://'
+NETWORK_MIDI_PORT_NAMES = [NETWORK_MIDI_SCHEME + '127.0.0.1:5004']
+SERIAL_MIDI_SCHEME = 'serial://'
+SIMULATED_SERIAL_PORT_NAME = SERIAL_MIDI_SCHEME + 'simulated'
+
+MIDI_BAUD_RATE = 31250
+MIDI_BITS_PER_BYTE = 10  # start bit, 8 data bits, stop bit
+
+RTP_HEADER = struct.Struct('!BBHII')
+RTP_VERSION = 0x80
+RTP_MIDI_PAYLOAD_TYPE = 0x61
+RTP_MIDI_CLOCK_RATE = 10000  # timestamp units per second
+THROUGHPUT_WINDOW = 1.0  # seconds
+PORT_CLOSE_TIMEOUT = 0.5  # seconds the main thread waits for a closing port
+
+
+class MidiSink:
+    # Output sink interface, every sink accepts mido messages and raw message bytes.
+
+    def send(self, message):
+        self.send_bytes(message.bytes())
+
+    def send_bytes(self, data):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MidoSink(MidiSink):
+    def __init__(self, port):
+        self.port = port
+        # the rtmidi backend takes raw bytes, without parsing them into a message first
+        self._rt = getattr(port, '_rt', None)
+
+    @property
+    def name(self):
+        return self.port.name
+
+    def send(self, message):
+        self.port.send(message)
+
+    def send_bytes(self, data):
+        if self._rt:
+            self._rt.send_message(data)
+        else:
+            self.port.send(mido.Message.from_bytes(data))
+
+    def close(self):
+        self.port.close()
+
+
+class HighResolutionControls:
+    # Splits 14 bit controller values into MSB and LSB control changes, sending only what the receiver lacks:
+    # the MSB when it changes, the LSB when it changes. Receivers reset the LSB to zero on every MSB,
+    # so after an MSB the LSB is only sent when it is not zero.
+    # The input thread and the interpolator both split values, callers hold the lock over a split and the sending
+    # of its messages, so the receiver gets them in the order they were split.
+
+    def __init__(self):
+        self._sent = dict()  # (channel, coarse control): (msb, lsb)
+        self.lock = threading.Lock()
+
+    def split(self, channel, control, value):
+        msb, lsb = MIDI_14_BIT_MSB[value], MIDI_14_BIT_LSB[value]
+        key = channel, control
+        sent_msb, sent_lsb = self._sent.get(key, (None, None))
+        self._sent[key] = msb, lsb
+        if msb != sent_msb:
+            return [(control, msb), (MIDI_FINE_CONTROL_CODES[control], lsb)] if lsb else [(control, msb)]
+        if lsb != sent_lsb:
+            return [(MIDI_FINE_CONTROL_CODES[control], lsb)]
+        return []
+
+    def reset(self):
+        self._sent.clear()
+
+
+class RecordingSink(MidiSink):
+    # keeps every sent message with the time it was sent at, for checking timing against a simulated clock
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.messages = []
+
+    def send_bytes(self, data):
+        self.messages.append((self.clock(), bytes(data)))
+
+
+def encode_variable_length(value):
+    encoded = [value & 0x7F]
+    value >>= 7
+    while value:
+        encoded.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(encoded))
+
+
+def decode_variable_length(data, offset):
+    value = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, offset
+
+
+def pack_rtp_midi(sequence, ssrc, messages):
+    # messages: [(timestamp in clock units, bytes)], the first command carries no delta time (Z flag unset)
+    timestamp = messages[0][0]
+    commands = []
+    previous = timestamp
+    for i, (message_time, data) in enumerate(messages):
+        if i:
+            commands.append(encode_variable_length(max(0, message_time - previous)))
+        commands.append(data)
+        previous = message_time
+    command_list = b''.join(commands)
+    length = len(command_list)
+    # long command section header (B flag) with a 12 bit length
+    header = RTP_HEADER.pack(RTP_VERSION, RTP_MIDI_PAYLOAD_TYPE, sequence & 0xFFFF, timestamp & 0xFFFFFFFF, ssrc)
+    return header + bytes((0x80 | (length >> 8), length & 0xFF)) + command_list
+
+
+def unpack_rtp_midi(packet):
+    _, _, sequence, timestamp, ssrc = RTP_HEADER.unpack_from(packet)
+    offset = RTP_HEADER.size
+    flags = packet[offset]
+    if flags & 0x80:
+        length = ((flags & 0x0F) << 8) | packet[offset + 1]
+        offset += 2
+    else:
+        length = flags & 0x0F
+        offset += 1
+    end = offset + length
+    messages = []
+    message_time = timestamp
+    first = not flags & 0x20
+    while offset < end:
+        if not first:
+            delta, offset = decode_variable_length(packet, offset)
+            message_time += delta
+        first = False
+        size = midi_message_length(packet[offset])
+        if not size:
+            size = packet.index(0xF7, offset) - offset + 1
+        messages.append((message_time, packet[offset:offset + size]))
+        offset += size
+    return sequence, messages
+
+
+class NetworkMidiSink(MidiSink):
+    # Packs all messages sent during a flush interval into RTP-MIDI style datagrams.
+
+    def __init__(self, host, port, flush_interval=0.002, max_payload_size=1024):
+        self.address = (host, port)
+        self.flush_interval = flush_interval
+        self.max_payload_size = max_payload_size
+        self.sequence = 0
+        self.ssrc = struct.unpack('!I', os.urandom(4))[0]
+        self.sent_messages = 0
+        self.sent_datagrams = 0
+        self._pending = deque()
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._stopped = threading.Event()
+        self._flusher = threading.Thread(target=self._run, name='network-midi-output', daemon=True)
+        self._flusher.start()
+
+    @property
+    def name(self):
+        return '%s%s:%d' % (NETWORK_MIDI_SCHEME, *self.address)
+
+    def send_bytes(self, data):
+        self._pending.append((int(time.perf_counter() * RTP_MIDI_CLOCK_RATE), bytes(data)))
+
+    def flush(self):
+        pending = self._pending
+        batch, size = [], 0
+        for _ in range(len(pending)):
+            message = pending.popleft()
+            if size + len(message[1]) + 4 > self.max_payload_size and batch:
+                self._send_datagram(batch)
+                batch, size = [], 0
+            batch.append(message)
+            size += len(message[1]) + 4
+        if batch:
+            self._send_datagram(batch)
+
+    def _send_datagram(self, batch):
+        try:
+            self._socket.sendto(pack_rtp_midi(self.sequence, self.ssrc, batch), self.address)
+        except OSError as e:
+            print(e)
+        self.sequence = (self.sequence + 1) & 0xFFFF
+        self.sent_messages += len(batch)
+        self.sent_datagrams += 1
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self._stopped.set()
+        self._flusher.join()
+        self.flush()
+        self._socket.close()
+
+
+class NetworkMidiReceiver(threading.Thread):
+    # Loopback counterpart of NetworkMidiSink, calls on_message(timestamp, bytes) for every received message
+    # and keeps loss and RFC 3550 style interarrival jitter statistics.
+
+    def __init__(self, host, port, on_message=None):
+        super().__init__(name='network-midi-input', daemon=True)
+        self.on_message = on_message
+        self.received_messages = 0
+        self.received_datagrams = 0
+        self.lost_datagrams = 0
+        self.jitter = 0.0  # seconds
+        self._expected_sequence = None
+        self._transit = None
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.socket.settimeout(0.1)
+        self._stopped = threading.Event()
+
+    @property
+    def address(self):
+        return self.socket.getsockname()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                packet = self.socket.recv(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            arrival = time.perf_counter()
+            sequence, messages = unpack_rtp_midi(packet)
+            self._update_statistics(sequence, arrival, messages[0][0] if messages else None)
+            self.received_datagrams += 1
+            self.received_messages += len(messages)
+            if self.on_message:
+                for timestamp, data in messages:
+                    self.on_message(timestamp, data)
+
+    def _update_statistics(self, sequence, arrival, timestamp):
+        if self._expected_sequence is not None:
+            self.lost_datagrams += (sequence - self._expected_sequence) & 0xFFFF
+        self._expected_sequence = (sequence + 1) & 0xFFFF
+        if timestamp is None:
+            return
+        transit = arrival - timestamp / RTP_MIDI_CLOCK_RATE
+        if self._transit is not None:
+            self.jitter += (abs(transit - self._transit) - self.jitter) / 16
+        self._transit = transit
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        self.socket.close()
+
+
+def apply_running_status(messages, status=None):
+    # Drops the status byte of channel messages repeating the previous one, returns the wire bytes of every message
+    # and the running status after them. Note offs with zero velocity become note ons, which share their status.
+    # Real-time messages leave the running status alone, other system messages cancel it.
+    encoded = []
+    for data in messages:
+        first = data[0]
+        if first & 0xF0 == 0x80 and data[2] == 0:
+            data = bytes((0x90 | (first & 0x0F), data[1], 0))
+            first = data[0]
+        if first < 0xF0:
+            encoded.append(data[1:] if first == status else data)
+            status = first
+        else:
+            encoded.append(data)
+            if first < 0xF8:
+                status = None
+    return encoded, status
+
+
+# controllers whose order against notes matters: bank select, data entry, switch pedals, (N)RPN and channel mode
+ORDERED_CONTROLS = frozenset((0, 6, 32, 38, 64, 65, 66, 67, 68, 69, 96, 97, 98, 99, 100, 101)
+                             + tuple(range(120, 128)))
+
+
+def is_continuous_message(data):
+    # pitch bend and continuous control changes, the messages that may wait for the notes of their bundle
+    status = data[0] & 0xF0
+    return status == 0xE0 or status == 0xB0 and data[1] not in ORDERED_CONTROLS
+
+
+class SerialMidiSink(MidiSink):
+    # Writes to a serial line at MIDI speed, where every byte counts: messages sent during a flush window are
+    # bundled, continuous controllers and pitch bend go after the other messages, which keep their order, and
+    # consecutive messages with the same status use running status.
+
+    def __init__(self, stream, name=SERIAL_MIDI_SCHEME, flush_interval=0.001, running_status=True,
+                 clock=time.perf_counter):
+        self.stream = stream
+        self.name = name
+        self.flush_interval = flush_interval
+        self.running_status = running_status
+        self.clock = clock
+        self.sent_messages = 0
+        self.sent_bytes = 0
+        self._status = None
+        self._pending = deque()
+        self._stopped = threading.Event()
+        self._flusher = threading.Thread(target=self._run, name='serial-midi-output', daemon=True)
+        self._flusher.start()
+
+    def send_bytes(self, data):
+        self._pending.append((self.clock(), bytes(data)))
+
+    def flush(self):
+        pending = self._pending
+        bundle = [pending.popleft() for _ in range(len(pending))]
+        if not bundle:
+            return
+        # stable, both parts keep their order
+        bundle.sort(key=lambda message: is_continuous_message(message[1]))
+        messages = [data for _, data in bundle]
+        if self.running_status:
+            messages, self._status = apply_running_status(messages, self._status)
+        self.write(messages, [timestamp for timestamp, _ in bundle])
+        self.sent_messages += len(messages)
+        self.sent_bytes += sum(map(len, messages))
+
+    def write(self, messages, timestamps):
+        try:
+            self.stream.write(b''.join(messages))
+        except Exception as e:
+            print(e)
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self._stopped.set()
+        self._flusher.join()
+        self.flush()
+        if self.stream:
+            self.stream.close()
+
+
+class SimulatedUartSink(SerialMidiSink):
+    # Serial sink without hardware: puts the bytes on a simulated line of the given baud rate and measures
+    # the throughput and the latency of every message, from send_bytes() to its last bit on the line.
+
+    def __init__(self, baud_rate=MIDI_BAUD_RATE, **kwargs):
+        self.byte_time = MIDI_BITS_PER_BYTE / baud_rate
+        self.worst_latency = 0.0
+        self.total_latency = 0.0
+        self._line_start = None
+        self._line_free = 0.0
+        super().__init__(None, name=SIMULATED_SERIAL_PORT_NAME, **kwargs)
+
+    def write(self, messages, timestamps):
+        now = self.clock()
+        end = max(now, self._line_free)
+        if self._line_start is None:
+            self._line_start = end
+        for data, timestamp in zip(messages, timestamps):
+            end += len(data) * self.byte_time
+            latency = end - timestamp
+            self.total_latency += latency
+            self.worst_latency = max(self.worst_latency, latency)
+        self._line_free = end
+
+    @property
+    def messages_per_second(self):
+        if self._line_start is None or self._line_free <= self._line_start:
+            return 0.0
+        return self.sent_messages / (self._line_free - self._line_start)
+
+    @property
+    def mean_latency(self):
+        return self.total_latency / self.sent_messages if self.sent_messages else 0.0
+
+
+class PortWorker(threading.Thread):
+    # Sends to one sink from its own thread, a slow port only fills (and then drops from) its own queue.
+
+    def __init__(self, sink, channels=None, queue_size=1024):
+        super().__init__(name='midi-output-%s' % getattr(sink, 'name', ''), daemon=True)
+        self.sink = sink
+        self.channels = channels
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.sent = 0
+        self.dropped = 0
+        self._rate = 0.0
+        self._window_sent, self._window_start = 0, time.perf_counter()
+
+    def accepts(self, channel):
+        return self.channels is None or channel is None or channel in self.channels
+
+    def put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    @property
+    def throughput(self):
+        # messages per second over the last window, the worker rolls the windows, reading changes nothing. A
+        # window left open by an idle port counts up to now, so the rate falls off while nothing is sent.
+        elapsed = time.perf_counter() - self._window_start
+        if elapsed < THROUGHPUT_WINDOW:
+            return self._rate
+        return (self.sent - self._window_sent) / elapsed
+
+    def run(self):
+        get, sink = self.queue.get, self.sink
+        while True:
+            item = get()
+            if item is None:
+                break
+            is_message, payload = item
+            try:
+                if is_message:
+                    sink.send(payload)
+                else:
+                    sink.send_bytes(payload)
+                self.sent += 1
+            except Exception as e:
+                print(e)
+            now = time.perf_counter()
+            if now - self._window_start >= THROUGHPUT_WINDOW:
+                self._rate = (self.sent - self._window_sent) / (now - self._window_start)
+                self._window_sent, self._window_start = self.sent, now
+        try:
+            sink.close()
+        except Exception as e:
+            print(e)
+
+    def close(self):
+        # called from the main thread: the messages still queued are dropped, and a port stuck in a send is
+        # left to close its sink when the send returns
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(None)
+                break
+            except queue.Full:
+                continue
+        self.join(PORT_CLOSE_TIMEOUT)
+
+
+class FanOutSink(MidiSink):
+    # Routes every message to all ports accepting its channel, each port runs a PortWorker.
+    # Messages are sent from several threads while the main thread opens and removes ports, the workers are
+    # replaced by a new mapping on every change instead of being changed in place.
+
+    def __init__(self):
+        self.workers = OrderedDict()
+
+    def open(self, key, sink, channels=None):
+        self.remove(key)
+        worker = PortWorker(sink, channels)
+        worker.start()
+        workers = OrderedDict(self.workers)
+        workers[key] = worker
+        self.workers = workers
+
+    def remove(self, key):
+        if key not in self.workers:
+            return
+        workers = OrderedDict(self.workers)
+        worker = workers.pop(key)
+        self.workers = workers
+        worker.close()
+
+    def route(self, key, channels=None):
+        worker = self.workers.get(key, None)
+        if worker:
+            worker.channels = channels
+
+    def send(self, message):
+        channel = getattr(message, 'channel', None)
+        for worker in self.workers.values():
+            if worker.accepts(channel):
+                worker.put((True, message))
+
+    def send_bytes(self, data):
+        data = bytes(data)
+        channel = data[0] & 0x0F if data[0] < 0xF0 else None
+        for worker in self.workers.values():
+            if worker.accepts(channel):
+                worker.put((False, data))
+
+    def statistics(self):
+        return {key: {'sent': worker.sent, 'dropped': worker.dropped, 'queued': worker.queue.qsize(),
+                      'throughput': worker.throughput}
+                for key, worker in self.workers.items()}
+
+    def close(self):
+        for key in list(self.workers):
+            self.remove(key)
+
+
+def get_serial_port_names():
+    try:
+        from serial.tools.list_ports import comports
+    except ImportError:
+        return [SIMULATED_SERIAL_PORT_NAME]
+    return [SERIAL_MIDI_SCHEME + port.device for port in comports()] + [SIMULATED_SERIAL_PORT_NAME]
+
+
+def get_output_names():
+    return mido.get_output_names() + NETWORK_MIDI_PORT_NAMES + get_serial_port_names()
+
+
+def open_output(name):
+    if name.startswith(NETWORK_MIDI_SCHEME):
+        host, _, port = name[len(NETWORK_MIDI_SCHEME):].rpartition(':')
+        return NetworkMidiSink(host, int(port))
+    if name == SIMULATED_SERIAL_PORT_NAME:
+        return SimulatedUartSink()
+    if name.startswith(SERIAL_MIDI_SCHEME):
+        import serial
+        return SerialMidiSink(serial.Serial(name[len(SERIAL_MIDI_SCHEME):], baudrate=MIDI_BAUD_RATE), name=name)
+    return MidoSink(mido.open_output(name=name))
+
+
+def benchmark(messages=20000, rate=5000):
+    # messages per second delivered through a NetworkMidiSink to a NetworkMidiReceiver on the loopback interface,
+    # their latency from send_bytes to arrival, and the receiver's interarrival jitter
+    from scheduler import JitterStatistics
+    latencies = JitterStatistics()
+
+    def on_message(timestamp, data):
+        arrival = int(time.perf_counter() * RTP_MIDI_CLOCK_RATE)
+        latencies.add(((arrival - timestamp) & 0xFFFFFFFF) / RTP_MIDI_CLOCK_RATE)
+
+    receiver = NetworkMidiReceiver('127.0.0.1', 0, on_message)
+    receiver.start()
+    sink = NetworkMidiSink(*receiver.address)
+    start = time.perf_counter()
+    for i in range(messages):
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        sink.send_bytes((0xB0, 7, i & 0x7F))
+    sink.close()
+    deadline = time.perf_counter() + 1.0
+    while receiver.received_messages < sink.sent_messages and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    duration = time.perf_counter() - start
+    receiver.stop()
+    print('%d of %d messages in %d datagrams, %d lost, %.0f messages/s delivered' % (
+        receiver.received_messages, messages, receiver.received_datagrams, receiver.lost_datagrams,
+        receiver.received_messages / duration))
+    print('latency mean %.2f ms, deviation %.2f ms, max %.2f ms, jitter %.3f ms' % (
+        1e3 * latencies.mean, 1e3 * latencies.deviation, 1e3 * latencies.worst, 1e3 * receiver.jitter))
+
+
+def serial_benchmark(messages=5000, rate=1500):
+    # a dense stream of control changes through a SimulatedUartSink, with and without running status: messages
+    # per second on the line and their latency from send_bytes to the last bit
+    for running_status in (False, True):
+        sink = SimulatedUartSink(running_status=running_status)
+        start = time.perf_counter()
+        for i in range(messages):
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            sink.send_bytes((0xB0, 1 + i % 2, i & 0x7F))
+        sink.close()
+        print('running status %s: %d messages, %.1f bytes each, %.0f messages/s on the line, '
+              'latency mean %.2f ms, max %.2f ms' % (
+                  'on' if running_status else 'off', sink.sent_messages, sink.sent_bytes / sink.sent_messages,
+                  sink.messages_per_second, 1e3 * sink.mean_latency, 1e3 * sink.worst_latency))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['serial']:
+        serial_benchmark(*map(int, sys.argv[2:]))
+    else:
+        benchmark(*map(int, sys.argv[1:]))
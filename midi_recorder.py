@@ -0,0 +1,129 @@
+import os
+import struct
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from operator import itemgetter
+
+from midi_outputs import encode_variable_length
+
+SMF_TICKS_PER_BEAT = 480
+SMF_TEMPO = 500000  # microseconds per beat, 120 bpm
+SMF_TICKS_PER_SECOND = SMF_TICKS_PER_BEAT * 1000000 / SMF_TEMPO
+SMF_END_OF_TRACK = b'\x00\xff\x2f\x00'
+SMF_TEXT = b'\x01'  # meta event type, a superseded End of Track becomes an empty text event
+SMF_TRACK_LENGTH_OFFSET = 18  # MThd chunk (14 bytes) and the MTrk tag
+
+
+class MidiFileRecorder:
+    # Records every emitted message into Standard MIDI Files (format 0).
+    # record() only appends to a bounded deque, a writer thread encodes the messages and appends them in chunks.
+    # Every write leaves a valid file, so it stays readable after a crash at any point: a chunk and a new End of
+    # Track go after the old one, the track length is patched to take them in, then the old End of Track is turned
+    # into an empty text event by rewriting its type byte.
+
+    def __init__(self, directory='recordings', chunk_interval=0.5, max_file_size=16 << 20, max_duration=3600,
+                 buffer_size=1 << 16):
+        self.directory = directory
+        self.chunk_interval = chunk_interval
+        self.max_file_size = max_file_size
+        self.max_duration = max_duration
+        self.events = deque(maxlen=buffer_size)
+        self.dropped = 0
+        self.path = None
+        self._file = None
+        self._file_size = 0
+        self._file_start_time = None
+        self._last_tick = 0
+        self._writer = None
+        self._stopped = threading.Event()
+
+    @property
+    def is_recording(self):
+        return self._writer is not None
+
+    def record(self, message, timestamp=None):
+        # the message is converted to bytes on the writer thread
+        events = self.events
+        if len(events) == events.maxlen:
+            self.dropped += 1
+        events.append((time.perf_counter() if timestamp is None else timestamp, message))
+
+    def start(self):
+        if self._writer:
+            return
+        self._stopped.clear()
+        self._writer = threading.Thread(target=self._run, name='midi-recorder', daemon=True)
+        self._writer.start()
+
+    def stop(self):
+        if not self._writer:
+            return
+        self._stopped.set()
+        self._writer.join()
+        self._writer = None
+
+    def _run(self):
+        while not self._stopped.wait(self.chunk_interval):
+            self._write_chunk()
+        self._write_chunk()
+        self._close_file()
+
+    def _open_file(self, start_time):
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, datetime.now().strftime('touchy-%Y%m%d-%H%M%S-%f.mid'))
+        self._file = open(self.path, 'w+b')
+        track = b'\x00\xff\x51\x03' + SMF_TEMPO.to_bytes(3, 'big') + SMF_END_OF_TRACK
+        self._file.write(b'MThd' + struct.pack('>IHHH', 6, 0, 1, SMF_TICKS_PER_BEAT)
+                         + b'MTrk' + struct.pack('>I', len(track)) + track)
+        self._sync()
+        self._file_size = SMF_TRACK_LENGTH_OFFSET + 4 + len(track)
+        self._file_start_time = start_time
+        self._last_tick = 0
+
+    def _close_file(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _append(self, track_data):
+        f = self._file
+        end = self._file_size
+        f.seek(end)
+        f.write(track_data + SMF_END_OF_TRACK)
+        self._sync()
+        self._file_size = end + len(track_data) + len(SMF_END_OF_TRACK)
+        f.seek(SMF_TRACK_LENGTH_OFFSET)
+        f.write(struct.pack('>I', self._file_size - SMF_TRACK_LENGTH_OFFSET - 4))
+        self._sync()
+        f.seek(end - 2)
+        f.write(SMF_TEXT)
+        self._sync()
+
+    def _write_chunk(self):
+        events = self.events
+        track_data = bytearray()
+        # messages of the engine worker arrive a status interval late, they are sorted in among the window's own
+        chunk = sorted((events.popleft() for _ in range(len(events))), key=itemgetter(0))
+        for timestamp, message in chunk:
+            data = bytes(message.bytes())
+            if data[0] >= 0xF0:
+                continue  # system messages have no place in a track
+            if self._file and (timestamp - self._file_start_time > self.max_duration
+                               or self._file_size + len(track_data) > self.max_file_size):
+                self._append(bytes(track_data))
+                track_data.clear()
+                self._close_file()
+            if not self._file:
+                self._open_file(timestamp)
+            tick = int((timestamp - self._file_start_time) * SMF_TICKS_PER_SECOND)
+            track_data += encode_variable_length(max(0, tick - self._last_tick))
+            track_data += data
+            self._last_tick = tick
+        if track_data:
+            self._append(bytes(track_data))
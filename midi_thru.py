@@ -0,0 +1,124 @@
+import sys
+import threading
+import time
+
+from midi_outputs import FanOutSink, RecordingSink
+
+# status bytes (channel messages without their channel) dropped by each thru filter
+THRU_FILTERS = {
+    'none': frozenset(),
+    'notes only': frozenset((0xA0, 0xB0, 0xC0, 0xD0, 0xE0, 0xF0, 0xF1, 0xF2, 0xF3, 0xF6, 0xF8, 0xFA, 0xFB, 0xFC)),
+    'no controllers': frozenset((0xB0,)),
+    'no clock': frozenset((0xF8, 0xFA, 0xFB, 0xFC)),
+    'no aftertouch': frozenset((0xA0, 0xD0)),
+}
+
+
+class MidiThru:
+    # Merges the traffic of an input port into the output as raw bytes, no mido messages are built.
+    # Channel messages can be moved to another channel, and forwarded control changes can be held back while
+    # touchy generates the same controller, so the input does not fight the generated values.
+
+    def __init__(self, sink, channel=None, dropped_status=frozenset(), generated_priority=False, priority_hold=0.25,
+                 clock=time.perf_counter):
+        self.sink = sink
+        self.channel = channel  # None keeps the input channel
+        self.dropped_status = dropped_status
+        self.generated_priority = generated_priority
+        self.priority_hold = priority_hold
+        self.clock = clock
+        self.forwarded = 0
+        self.filtered = 0
+        self.overridden = 0
+        self.port = None
+        self._generated = dict()  # (channel, control): time generated
+
+    def open(self, name):
+        # python-rtmidi hands the callback the message as a list of ints, mido's rtmidi backend uses the same names
+        import rtmidi
+        self.close()
+        port = rtmidi.MidiIn()
+        port.ignore_types(sysex=False, timing=False, active_sense=True)
+        port.open_port(port.get_ports().index(name))
+        port.set_callback(self._on_rtmidi_message)
+        self.port = port
+
+    def _on_rtmidi_message(self, event, data=None):
+        self.feed_bytes(event[0])
+
+    def note_generated(self, channel, control):
+        self._generated[channel, control] = self.clock()
+
+    def merge_generated(self, generated):
+        # {(channel, control): time generated} of another process, on the same perf_counter clock
+        self._generated.update(generated)
+
+    def feed_bytes(self, data):
+        status = data[0]
+        kind = status & 0xF0 if status < 0xF0 else status
+        if kind in self.dropped_status:
+            self.filtered += 1
+            return
+        if status < 0xF0 and self.channel is not None and status & 0x0F != self.channel:
+            data = bytearray(data)
+            data[0] = kind | self.channel
+        if kind == 0xB0 and self.generated_priority:
+            generated = self._generated.get((data[0] & 0x0F, data[1]))
+            if generated is not None and self.clock() - generated < self.priority_hold:
+                self.overridden += 1
+                return
+        self.sink.send_bytes(data)
+        self.forwarded += 1
+
+    def close(self):
+        if self.port:
+            self.port.cancel_callback()
+            self.port.close_port()
+            self.port = None
+
+
+def benchmark(messages=100000, rate=20000):
+    # forwarding latency through a FanOutSink worker, while another thread generates control changes
+    clock = time.perf_counter
+    sink = FanOutSink()
+    recording = RecordingSink(clock)
+    sink.open('bench', recording, None)
+    worker = sink.workers['bench']
+    thru = MidiThru(sink, channel=1, generated_priority=True)
+    fed = []
+    stopped = threading.Event()
+
+    def generate():
+        while not stopped.is_set():
+            sink.send_bytes(b'\xb0\x07\x40')
+            thru.note_generated(0, 7)
+            time.sleep(0.0005)
+    generator = threading.Thread(target=generate, daemon=True)
+    generator.start()
+
+    start = clock()
+    for i in range(messages):
+        delay = start + i / rate - clock()
+        if delay > 0:
+            time.sleep(delay)  # a busy wait would keep the worker from running
+        fed.append(clock())
+        thru.feed_bytes((0x90, 60 + i % 12, 1 + i % 127))
+    stopped.set()
+    generator.join()
+    sink.close()
+
+    if worker.dropped:
+        print('%d dropped, latencies not measured' % worker.dropped)
+        return
+    forwarded = [timestamp for timestamp, data in recording.messages if data[0] == 0x91]
+    latencies = sorted(received - sent for sent, received in zip(fed, forwarded))
+    if not latencies:
+        print('nothing forwarded')
+        return
+    print('%d forwarded, latency mean %.1f us, p99 %.1f us, max %.1f us' % (
+        len(latencies), 1e6 * sum(latencies) / len(latencies), 1e6 * latencies[int(len(latencies) * 0.99)],
+        1e6 * latencies[-1]))
+
+
+if __name__ == '__main__':
+    benchmark(*map(int, sys.argv[1:]))
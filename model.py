@@ -1,3 +1,5 @@
+import os
+
 from autoclass import autoclass
 from functools import partial
 from dill import load, dump
@@ -13,6 +15,8 @@ class Model:
     def __init__(self, *rows: TableRow):
         super().__init__()
         self._storage = dict()
+        self.path = 'settings.pickle'
+        self._rows = rows
         
         for row in rows:
 
@@ -35,18 +39,33 @@ class Model:
 
     def save(self):
         try:
-            with open('settings.pickle', 'wb') as f:
+            with open(self.path, 'wb') as f:
                 dump(self._storage, f)
         except Exception as e:
             print(e)
             
     def load(self):
         try:
-            with open('settings.pickle', 'rb') as f:
+            with open(self.path, 'rb') as f:
                 self._storage = load(f)
         except Exception as e:
             print(e)
 
+    def switch(self, path):
+        # a preset that was never saved starts as a copy of the current one
+        if path == self.path:
+            return
+        self.save()
+        self.path = path
+        if os.path.exists(path):
+            self.load()
+
+    def snapshot(self):
+        return dict(self._storage)
+
+    def restore(self, storage):
+        self._storage = dict(storage)
+
     def __getitem__(self, item):
         return self._storage.get(item, None)
     
@@ -58,6 +77,10 @@ class Model:
             row_value = values[i] if values else None
             binding.from_tuple(row_value if row_value else binding.defaults)
 
+    def update_bindings(self):
+        for row in self._rows:
+            self.update_binding_from_table_row(row)
+
     def update_row(self, row, binding_old_value: tuple, binding_new_value: tuple):
         is_key_static = isinstance(row.key_binding, tuple)
         key = row.key_binding.model_key if not is_key_static else row.key_binding
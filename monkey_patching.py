@@ -1,4 +1,5 @@
 import ctypes
+from collections import OrderedDict
 
 import pyglet
 from pyglet_gui.constants import ANCHOR_TOP_LEFT, VALIGN_TOP
@@ -7,7 +8,6 @@ from pyglet_gui.controllers import Selector
 from pyglet_gui.gui import Frame, Label
 from pyglet_gui.manager import Manager as Manager
 from pyglet_gui.option_selectors import OptionButton
-from pyglet_gui.scrollable import Scrollable
 from pyglet_gui.sliders import Slider
 from pyglet_gui.option_selectors import Dropdown as _Dropdown
 from pyglet_gui.text_input import TextInput as _TextInput
@@ -70,8 +70,61 @@ def monkey_patching_Slider_set_value(self, value):
 Slider.set_value = monkey_patching_Slider_set_value
 
 
+class PulldownOption(OptionButton):
+    # one visible row of a Dropdown pulldown, shows whichever option is scrolled into it
+    def __init__(self, dropdown):
+        OptionButton.__init__(self, None, '', parent=dropdown)
+        self.dropdown = dropdown
+        self.option = None
+
+    def show_option(self, option, label, is_selected):
+        if option == self.option and label == self.label and is_selected == self._is_pressed:
+            return
+        self.option = option
+        self.label = label
+        self._is_pressed = is_selected
+        if self.is_loaded:
+            self.reload()
+            self.reset_size()
+
+    def select(self):
+        if self.option is not None:
+            self.dropdown.select(self.option)
+
+
+class PulldownManager(Manager):
+    # takes the keyboard and the mouse wheel while the pulldown is open
+    def __init__(self, content, dropdown, **kwargs):
+        Manager.__init__(self, content, **kwargs)
+        self.dropdown = dropdown
+
+    def on_text(self, text):
+        self.dropdown.filter_pulldown(self.dropdown.filter_text + text)
+        return pyglet.event.EVENT_HANDLED
+
+    def on_key_press(self, symbol, modifiers):
+        if symbol == pyglet.window.key.ESCAPE:
+            self.dropdown.close_pulldown()
+        elif symbol == pyglet.window.key.BACKSPACE:
+            self.dropdown.filter_pulldown(self.dropdown.filter_text[:-1])
+        elif symbol in (pyglet.window.key.ENTER, pyglet.window.key.RETURN):
+            self.dropdown.select_first_filtered()
+        elif symbol == pyglet.window.key.DOWN:
+            self.dropdown.scroll_pulldown(1)
+        elif symbol == pyglet.window.key.UP:
+            self.dropdown.scroll_pulldown(-1)
+        return pyglet.event.EVENT_HANDLED
+
+    def on_mouse_scroll(self, x, y, scroll_x, scroll_y):
+        self.dropdown.scroll_pulldown(-int(scroll_y))
+        return pyglet.event.EVENT_HANDLED
+
+
 class Dropdown(_Dropdown):
-    def __init__(self, options, labels=None, max_height=400, align=VALIGN_TOP, on_select=None):
+    # The pulldown only has visible_rows option rows, scrolling and filtering (typing while open) only relabel
+    # them. Its manager is built on the first opening, closing unloads it and takes it off the window's events,
+    # the next opening loads it again.
+    def __init__(self, options, labels=None, max_height=400, align=VALIGN_TOP, on_select=None, visible_rows=12):
         if options and len(options):
             Selector.__init__(self, options, labels, on_select=on_select, selected=options[0])
         else:
@@ -81,8 +134,16 @@ class Dropdown(_Dropdown):
 
         self.max_height = max_height
         self.align = align
-
-        self._pulldown_menu = None
+        self.visible_rows = visible_rows
+        self.filter_text = ''
+
+        self._pulldown_menu = None  # the manager while open
+        self._pulldown_manager = None
+        self._pulldown_rows = []
+        self._pulldown_filter_label = None
+        self._pulldown_first = 0
+        self._option_labels = None
+        self._filtered = dict()  # filter text: matching option names
         
     def load_graphics(self):
         if self._selected:
@@ -97,33 +158,108 @@ class Dropdown(_Dropdown):
     def on_lose_highlight(self):
         self._delete_pulldown_menu()
     
+    def filtered_options(self):
+        if self._option_labels is None:
+            self._option_labels = OrderedDict((name, option.label) for name, option in self._options.items())
+        text = self.filter_text.lower()
+        names = self._filtered.get(text)
+        if names is None:
+            # options matching a longer text are among those matching the text without its last character
+            names = self._filtered.get(text[:-1], list(self._option_labels)) if text else list(self._option_labels)
+            names = [name for name in names if text in self._option_labels[name].lower()]
+            self._filtered[text] = names
+        return names
+    
+    def _show_pulldown_rows(self):
+        names = self.filtered_options()
+        rows = self._pulldown_rows
+        self._pulldown_first = first = max(0, min(self._pulldown_first, len(names) - len(rows)))
+        for i, row in enumerate(rows):
+            if first + i < len(names):
+                name = names[first + i]
+                row.show_option(name, self._option_labels[name], name == self._selected)
+            else:
+                row.show_option(None, '', False)
+        self._pulldown_filter_label.set_text(
+            'type to filter' if not self.filter_text else '%s (%d)' % (self.filter_text, len(names)))
+    
+    def scroll_pulldown(self, rows):
+        self._pulldown_first += rows
+        self._show_pulldown_rows()
+    
+    def filter_pulldown(self, text):
+        self.filter_text = text
+        self._pulldown_first = 0
+        self._show_pulldown_rows()
+    
+    def select_first_filtered(self):
+        names = self.filtered_options()
+        if names:
+            self.select(names[0])
+    
+    def close_pulldown(self):
+        self._delete_pulldown_menu()
+    
+    def _delete_pulldown_menu(self):
+        # closes the pulldown, kept for the next opening
+        menu, self._pulldown_menu = self._pulldown_menu, None
+        if menu is not None:
+            self._manager.window.remove_handlers(menu)
+            menu.unload()
+        self.filter_text = ''
+        self._filtered.clear()
+    
+    def delete(self):
+        self._delete_pulldown_menu()
+        if self._pulldown_manager is not None:
+            self._pulldown_manager.delete()
+            self._pulldown_manager = None
+            self._pulldown_rows = []
+            self._pulldown_filter_label = None
+        _Dropdown.delete(self)
+    
     def on_mouse_press(self, x, y, button, modifiers):
         if not self._is_loaded or not self._options or len(self._options) == 0:
             return
         
-        """
-        A mouse press is going to create a manager with the options.
-        """
         # if it's already opened, we just close it.
         if self._pulldown_menu is not None:
             self._delete_pulldown_menu()
             return
         
-        # the function we pass to the manager.
-        def on_escape(_):
-            self._delete_pulldown_menu()
+        rows = min(self.visible_rows, len(self._options))
+        if self._pulldown_manager is not None and len(self._pulldown_rows) != rows:
+            # the options changed since the last opening
+            self._pulldown_manager.delete()
+            self._pulldown_manager = None
+        
+        names = self.filtered_options()
+        if self._selected in names:
+            self._pulldown_first = names.index(self._selected) - rows // 2
         
-        width, height = self._manager.window.get_size()
+        window = self._manager.window
+        width, height = window.get_size()
         x = self.x
         y = -(height - self.y - 1) + self.height
         
-        # we set the manager
-        self._pulldown_menu = Manager(
-            Frame(Scrollable(VerticalContainer(list(self._options.values())),
-                             height=self.max_height), path=['dropdown', 'pulldown']),
-            window=self._manager.window, batch=self._manager.batch,
-            group=self._manager.root_group.parent, theme=self._manager.theme,
-            is_movable=False, anchor=ANCHOR_TOP_LEFT, offset=(x, y))
+        menu = self._pulldown_manager
+        if menu is None:
+            self._pulldown_rows = [PulldownOption(self) for _ in range(rows)]
+            self._pulldown_filter_label = Label('')
+            self._show_pulldown_rows()
+            menu = self._pulldown_manager = PulldownManager(
+                Frame(VerticalContainer([self._pulldown_filter_label] + self._pulldown_rows),
+                      path=['dropdown', 'pulldown']),
+                self, window=window, batch=self._manager.batch,
+                group=self._manager.root_group.parent, theme=self._manager.theme,
+                is_movable=False, anchor=ANCHOR_TOP_LEFT, offset=(x, y))
+        else:
+            window.push_handlers(menu)
+            menu.load()
+            menu.offset = (x, y)
+            # relabeled once loaded, unloaded labels would load their graphics on the change
+            self._show_pulldown_rows()
+        self._pulldown_menu = menu
     
     def select(self, option_name):
         if self._is_loaded:
@@ -159,7 +295,77 @@ class TextInput(_TextInput):
         _TextInput.__init__(self, **kwargs, max_length=5, length=6)
 
 
+# Widgets whose hidden state changed since the last layout. Sizes are recomputed once per frame, from the changed
+# widgets up through their ancestors until one keeps its size. Only that ancestor lays out its content again, the
+# manager only when the size of its whole content changed.
+_layout_dirty = []
+
+
+def mark_layout_dirty(widget):
+    if not _layout_dirty:
+        pyglet.clock.schedule_once(flush_layout, 0)
+    if not any(dirty is widget for dirty in _layout_dirty):
+        _layout_dirty.append(widget)
+
+
+def _ancestors(viewer):
+    # the containers above a viewer and its manager, None when it is not part of a loaded tree
+    chain = []
+    parent = getattr(viewer, 'parent', None)
+    while parent is not None and not isinstance(parent, Manager):
+        chain.append(parent)
+        parent = getattr(parent, 'parent', None)
+    return chain, parent
+
+
+def flush_layout(dt=None):
+    widgets = list(_layout_dirty)
+    del _layout_dirty[:]
+    pyglet.clock.unschedule(flush_layout)
+    
+    containers = dict()  # id: (depth, container, manager)
+    resized = set()  # ids of the containers with content of another size
+    roots = OrderedDict()  # id: container keeping its size, its content is laid out
+    managers = OrderedDict()
+    for widget in widgets:
+        chain, manager = _ancestors(widget)
+        if manager is None:
+            continue
+        for i, container in enumerate(chain):
+            containers[id(container)] = (len(chain) - i, container, manager)
+        size = widget.width, widget.height
+        widget.reset_size(False)  # lays the widget out when its size holds
+        if (widget.width, widget.height) == size:
+            continue
+        if chain:
+            resized.add(id(chain[0]))
+        else:
+            managers[id(manager)] = manager
+    
+    for _, container, manager in sorted(containers.values(), key=lambda entry: -entry[0]):
+        if id(container) not in resized:
+            continue
+        width, height = container.compute_size()
+        if (width, height) == (container.width, container.height):
+            roots[id(container)] = container
+        else:
+            container.width, container.height = width, height
+            if container.parent is manager:
+                managers[id(manager)] = manager
+            else:
+                resized.add(id(container.parent))
+    
+    for container in roots.values():
+        chain, manager = _ancestors(container)
+        if id(manager) not in managers and not any(id(parent) in roots for parent in chain):
+            container.layout()
+    for manager in managers.values():
+        manager.reset_size()
+
+
 def set_hidden(self, value):
+    if value == self._hidden:
+        return
     self._hidden = value
     
     if self._hidden:
@@ -175,8 +381,7 @@ def set_hidden(self, value):
             else:
                 self.load_graphics()
 
-    self.reset_size(False)
-    Container.reset_size(self)
+    mark_layout_dirty(self)
 
 
 def monkey_patch_Container_load(self):
@@ -0,0 +1,173 @@
+import math
+import socket
+import struct
+import threading
+
+from input_canvas import InputCursor, QueuedTabletCanvas
+
+# OSC over UDP, messages may be sent one per datagram or batched in (nested) bundles:
+#
+#   /touchy/<cursor> x y [pressure [button]]
+#
+# x, y and pressure are floats normalized to [0, 1], button is an int (0 = released).
+# Cursor names should be one of OscInput.cursor_names to be mappable from the tablet rows.
+# Anyone on the network can send, samples with other argument types are counted and skipped, and a datagram
+# is dropped from where it fails to decode.
+
+OSC_ADDRESS_PREFIX = '/touchy/'
+OSC_BUNDLE_TAG = b'#bundle\0'
+OSC_MAX_BUNDLE_DEPTH = 8
+
+_int32 = struct.Struct('>i')
+_float32 = struct.Struct('>f')
+_int64 = struct.Struct('>q')
+_float64 = struct.Struct('>d')
+
+
+def _read_string(data, offset):
+    end = data.index(b'\0', offset)
+    return data[offset:end].decode('ascii', 'replace'), (end + 4) & ~3
+
+
+def _read_blob(data, offset):
+    size = _int32.unpack_from(data, offset)[0]
+    offset += 4
+    return data[offset:offset + size], (offset + size + 3) & ~3
+
+
+_osc_arg_readers = {
+    'i': lambda data, offset: (_int32.unpack_from(data, offset)[0], offset + 4),
+    'f': lambda data, offset: (_float32.unpack_from(data, offset)[0], offset + 4),
+    'h': lambda data, offset: (_int64.unpack_from(data, offset)[0], offset + 8),
+    'd': lambda data, offset: (_float64.unpack_from(data, offset)[0], offset + 8),
+    's': _read_string,
+    'b': _read_blob,
+    'T': lambda data, offset: (True, offset),
+    'F': lambda data, offset: (False, offset),
+    'N': lambda data, offset: (None, offset),
+}
+
+
+def decode_osc_message(data):
+    address, offset = _read_string(data, 0)
+    if offset >= len(data):
+        return address, []
+    type_tags, offset = _read_string(data, offset)
+    args = []
+    for tag in type_tags[1:]:
+        read = _osc_arg_readers.get(tag, None)
+        if read is None:
+            break
+        value, offset = read(data, offset)
+        args.append(value)
+    return address, args
+
+
+def decode_osc_packet(data, depth=0):
+    if not data.startswith(OSC_BUNDLE_TAG):
+        yield decode_osc_message(data)
+        return
+    if depth >= OSC_MAX_BUNDLE_DEPTH:
+        raise ValueError('OSC bundles nested deeper than %d' % OSC_MAX_BUNDLE_DEPTH)
+    offset = 16  # tag and time tag, bundles are applied as soon as they arrive
+    end = len(data)
+    while offset + 4 <= end:
+        size = _int32.unpack_from(data, offset)[0]
+        offset += 4
+        yield from decode_osc_packet(data[offset:offset + size], depth + 1)
+        offset += size
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def osc_sample(args):
+    # (x, y, pressure, button) of the arguments of a sample message, None when they are not numbers
+    if len(args) < 2:
+        return None
+    pressure = args[2] if len(args) > 2 else 1.0
+    button = args[3] if len(args) > 3 else 0
+    if not all(map(_is_number, (args[0], args[1], pressure, button))):
+        return None
+    return args[0], args[1], pressure, int(button)
+
+
+def decode_osc_samples(data, prefix=OSC_ADDRESS_PREFIX):
+    # (cursor, x, y, pressure, button) of the sample messages, None for each malformed one
+    for address, args in decode_osc_packet(data):
+        if address.startswith(prefix):
+            sample = osc_sample(args)
+            yield (address[len(prefix):],) + sample if sample else None
+
+
+class OscServer(threading.Thread):
+    def __init__(self, canvas, host, port, receive_buffer_size=1 << 20):
+        super().__init__(name='osc-input', daemon=True)
+        self.canvas = canvas
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer_size)
+        self.socket.bind((host, port))
+        self.socket.settimeout(0.1)
+        self.rejected = 0  # malformed messages and datagrams
+        self._stopped = threading.Event()
+
+    @property
+    def address(self):
+        return self.socket.getsockname()
+
+    def run(self):
+        recv, push = self.socket.recv, self.canvas.push
+        while not self._stopped.is_set():
+            try:
+                data = recv(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            try:
+                for sample in decode_osc_samples(data):
+                    if sample:
+                        push(*sample)
+                    else:
+                        self.rejected += 1
+            except Exception as e:
+                self.rejected += 1
+                print(e)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        self.socket.close()
+
+
+class OscTabletCanvas(QueuedTabletCanvas):
+    def __init__(self, window, host, port, **kwargs):
+        super().__init__(window, **kwargs)
+        self.server = OscServer(self, host, port)
+        self.server.start()
+
+    def close(self):
+        self.server.stop()
+        super().close()
+
+
+class OscInput:
+    source_name = "osc"
+    host = '0.0.0.0'
+    port = 9000
+    cursor_names = ['touch0', 'touch1', 'touch2', 'touch3', 'touch4']
+
+    def __init__(self):
+        self.cursors = list(map(InputCursor, self.cursor_names))
+        self.buttons = ['0', '1']
+
+    @property
+    def name(self):
+        return OscInput.source_name
+
+    def open(self, window):
+        try:
+            return OscTabletCanvas(window, self.host, self.port)
+        except OSError as e:
+            print(e)
@@ -0,0 +1,208 @@
+from collections import namedtuple, OrderedDict
+
+from midi_codes import MIDI_CONTROL_CODES, MIDI_FINE_CONTROL_CODES
+from scale import ScaleLinear
+from stateful_inputs import ExponentialFilter, OneEuroFilter, DeadBandFilter
+
+# Per-rule value pipeline: input -> smoothing -> curve -> quantize -> scale -> gate -> clamp -> invert -> change
+#
+# Every stage factory gets the rule and a PipelineContext and returns a function of the value,
+# or None when the rule does not use the stage. compile_rule_pipeline() generates one function calling only
+# the used stages, so rules pay nothing for transforms they don't use. A stage returning None drops the event.
+# Timed stages also get the capture timestamp of the sample, filters see the pace of the input, not of its handling.
+# A stage with a flush() holds values back, pipeline.flush() runs the stages after it on what flush() returns.
+
+PipelineContext = namedtuple('PipelineContext', ['domain', 'range', 'threshold_axes'])
+
+PIPELINE_STAGES = OrderedDict()
+
+CURVES = OrderedDict([
+    ('linear', None),
+    ('ease in', lambda u: u * u),
+    ('ease out', lambda u: 1 - (1 - u) * (1 - u)),
+    ('s-curve', lambda u: u * u * (3 - 2 * u)),
+])
+
+SMOOTHING_FILTERS = OrderedDict([
+    ('none', None),
+    ('ema', lambda context: ExponentialFilter()),
+    ('one euro', lambda context: OneEuroFilter(speed_scale=1.0 / _span(context.domain))),
+    # one output step wide
+    ('dead band', lambda context: DeadBandFilter(abs(_span(context.domain) / (_span(context.range) or 1)))),
+])
+
+
+def _span(pair):
+    return pair[1] - pair[0]
+
+
+def is_smoothed(rule):
+    return SMOOTHING_FILTERS.get(getattr(rule, 'smoothing', 'none'), None) is not None
+
+
+def is_high_resolution(rule):
+    # controllers with a fine pair are sent as 14 bit values when the range does not fit in 7 bits
+    return rule.message_type == 'control' and MIDI_CONTROL_CODES.get(rule.control_type) in MIDI_FINE_CONTROL_CODES \
+        and max(abs(int(rule.range_from)), abs(int(rule.range_to))) > 127
+
+
+def pipeline_stage(name, drops=False, timed=False):
+    def register(factory):
+        PIPELINE_STAGES[name] = (factory, drops, timed)
+        return factory
+    return register
+
+
+def is_incremental(rule):
+    return 'step' in rule._fields
+
+
+@pipeline_stage('input', drops=True)
+def input_stage(rule, context):
+    axis = rule.axis
+
+    if is_incremental(rule):
+        step = int(rule.step)
+
+        def stepped(axis_values):
+            return axis_values[axis] * step
+        return stepped
+
+    threshold_axes_value = context.threshold_axes.value
+
+    def threshold(axis_values):
+        values = threshold_axes_value(axis_values)
+        return values[axis] if values else None
+    return threshold
+
+
+@pipeline_stage('smoothing', drops=True, timed=True)
+def smoothing_stage(rule, context):
+    make_filter = SMOOTHING_FILTERS.get(getattr(rule, 'smoothing', 'none'), None)
+    if not make_filter:
+        return None
+
+    smoothing_filter = make_filter(context)
+    filter_value = smoothing_filter.filter
+
+    def smooth(value, timestamp):
+        return filter_value(value, timestamp)
+    smooth.flush = getattr(smoothing_filter, 'flush', None)
+    return smooth
+
+
+@pipeline_stage('curve')
+def curve_stage(rule, context):
+    curve = CURVES.get(getattr(rule, 'curve', 'linear'), None)
+    if not curve:
+        return None
+
+    low, high = context.domain
+    span = high - low
+
+    def shape(value):
+        return low + curve(min(max((value - low) / span, 0.0), 1.0)) * span
+    return shape
+
+
+@pipeline_stage('quantize')
+def quantize_stage(rule, context):
+    steps = int(getattr(rule, 'quantize', 0) or 0)
+    if steps <= 0:
+        return None
+
+    low, high = context.domain
+    span = high - low
+
+    def quantize(value):
+        return low + round((value - low) / span * steps) / steps * span
+    return quantize
+
+
+@pipeline_stage('scale')
+def scale_stage(rule, context):
+    return ScaleLinear(context.domain, context.range).value
+
+
+@pipeline_stage('gate', drops=True)
+def gate_stage(rule, context):
+    # zero values are not sent, except for velocities
+    if rule.message_type == 'velocity':
+        return None
+
+    def gate(value):
+        return value if value else None
+    return gate
+
+
+@pipeline_stage('clamp')
+def clamp_stage(rule, context):
+    # incremental rules are clamped after the step is added to their value
+    if is_incremental(rule):
+        return None
+
+    low, high = context.range
+
+    def clamp(value):
+        return max(min(int(value), high), low) if value else value
+    return clamp
+
+
+@pipeline_stage('invert')
+def invert_stage(rule, context):
+    if is_incremental(rule) or not getattr(rule, 'invert', False):
+        return None
+
+    total = context.range[0] + context.range[1]
+
+    def invert(value):
+        return total - value
+    return invert
+
+
+@pipeline_stage('change', drops=True)
+def change_stage(rule, context):
+    # smoothed rules repeat values a lot, only changes are sent
+    if not is_smoothed(rule) or rule.message_type == 'velocity':
+        return None
+
+    last = [None]
+
+    def changed(value):
+        if value == last[0]:
+            return None
+        last[0] = value
+        return value
+    return changed
+
+
+def compile_rule_pipeline(rule, context):
+    namespace = dict()
+    lines = ['def pipeline(value, timestamp):']
+    flush_lines = None  # from the last stage with a flush() on
+    for name, (factory, drops, timed) in PIPELINE_STAGES.items():
+        stage = factory(rule, context)
+        if not stage:
+            continue
+        namespace[name] = stage
+        lines.append(('    value = %s(value, timestamp)' if timed else '    value = %s(value)') % name)
+        if getattr(stage, 'flush', None):
+            namespace[name + '_flush'] = stage.flush
+            flush_lines = ['def flush():', '    value = %s_flush()' % name]
+            drops = True  # flush() returns None when nothing was held back
+        elif flush_lines:
+            flush_lines.append('    value = %s(value)' % name)
+        for stage_lines in (lines, flush_lines or []):
+            if drops:
+                stage_lines.append('    if value is None:')
+                stage_lines.append('        return None')
+    lines.append('    return value')
+    exec('\n'.join(lines), namespace)
+    pipeline = namespace['pipeline']
+    if flush_lines:
+        flush_lines.append('    return value')
+        exec('\n'.join(flush_lines), namespace)
+        pipeline.flush = namespace['flush']
+    else:
+        pipeline.flush = None
+    return pipeline
@@ -0,0 +1,101 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Sampling profiler for live sessions: a background thread looks at the stacks of the profiled threads every
+# interval, nothing runs while it is off. Stacks are cut to start at the outermost hot path function, the
+# others count as idle or other, and are written as folded stacks (flamegraph.pl, speedscope) on stop.
+
+HOT_PATH_FUNCTIONS = frozenset((
+    'on_mouse_press', 'on_mouse_release', 'on_mouse_motion', 'on_mouse_drag', 'on_mouse_scroll', 'on_ink',
+    'on_motion', 'process_axes_input', 'calculate_grid', 'on_draw',
+))
+IDLE_FUNCTIONS = frozenset(('wait', 'sleep', 'select', 'get', 'run'))
+
+
+class SamplingProfiler(threading.Thread):
+    def __init__(self, threads, interval=0.001, focus=HOT_PATH_FUNCTIONS):
+        # threads: name: thread ident
+        super().__init__(name='profiler', daemon=True)
+        self.threads = threads
+        self.interval = interval
+        self.focus = focus
+        self.samples = 0
+        self.stacks = Counter()
+        self._labels = dict()
+        self._stopped = threading.Event()
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = '%s (%s:%d)' % (
+                code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+        return label
+
+    def _stack(self, frame):
+        # the frames from the outermost hot path function on, None outside of them
+        codes = []
+        while frame is not None:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        for i in range(len(codes) - 1, -1, -1):
+            if codes[i].co_name in self.focus:
+                return ';'.join(self._label(code) for code in reversed(codes[:i + 1]))
+        return None
+
+    def run(self):
+        # the sampler needs the GIL, a busy thread hands it over only every switch interval
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(switch_interval, self.interval))
+        try:
+            self._sample()
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+    def _sample(self):
+        wait, current_frames = self._stopped.wait, sys._current_frames
+        while not wait(self.interval):
+            frames = current_frames()
+            self.samples += 1
+            for name, ident in self.threads.items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = self._stack(frame)
+                if stack is None:
+                    stack = 'idle' if frame.f_code.co_name in IDLE_FUNCTIONS else 'other'
+                self.stacks[name + ';' + stack] += 1
+            del frames
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def write_folded(self, path):
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write('%s %d\n' % (stack, count))
+
+    def report(self, limit=10):
+        # share of the samples of each thread spent in every hot path function, inner calls included
+        lines = []
+        for name in self.threads:
+            total = sum(count for stack, count in self.stacks.items() if stack.startswith(name + ';'))
+            if not total:
+                continue
+            functions = Counter()
+            for stack, count in self.stacks.items():
+                frames = stack.split(';')
+                if frames[0] == name:
+                    for function in set(frames[1:]):
+                        functions[function] += count
+            lines.append('%s: %d samples' % (name, total))
+            lines.extend('  %5.1f%% %s' % (100 * count / total, function)
+                         for function, count in functions.most_common(limit))
+        return '\n'.join(lines)
+
+
+def profile_path(directory='.'):
+    return os.path.join(directory, time.strftime('profile-%Y%m%d-%H%M%S.folded'))
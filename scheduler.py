@@ -0,0 +1,202 @@
+import heapq
+import itertools
+import math
+import threading
+import time
+
+MIDI_CLOCK_PER_BEAT = 24
+MIDI_CLOCK = b'\xf8'
+MIDI_START = b'\xfa'
+MIDI_STOP = b'\xfc'
+
+
+class ScheduledEvent:
+    __slots__ = ('time', 'sequence', 'callback', 'args', 'cancelled')
+
+    def __init__(self, when, sequence, callback, args):
+        self.time = when
+        self.sequence = sequence
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.time, self.sequence) < (other.time, other.sequence)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class JitterStatistics:
+    # lateness of fired events in seconds, running mean and variance (Welford)
+    __slots__ = ('count', 'mean', 'worst', '_m2')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.worst = 0.0
+        self._m2 = 0.0
+
+    def add(self, lateness):
+        self.count += 1
+        delta = lateness - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (lateness - self.mean)
+        self.worst = max(self.worst, lateness)
+
+    @property
+    def deviation(self):
+        return math.sqrt(self._m2 / self.count) if self.count else 0.0
+
+
+class Scheduler:
+    # Fires callbacks at given times of a monotonic clock from one thread, earliest first.
+    # Sleeps are cut short by the overshoot they usually have, the rest of the wait is spent yielding,
+    # and sleeps are never longer than max_sleep, so earlier events scheduled meanwhile are not missed.
+    # clock and sleep can be replaced by a SimulatedClock.
+
+    def __init__(self, clock=time.perf_counter, sleep=time.sleep, max_sleep=0.005):
+        self.clock = clock
+        self.sleep = sleep
+        self.max_sleep = max_sleep
+        self.overshoot = 0.0  # average sleep overshoot in seconds
+        self.jitter = JitterStatistics()
+        self._events = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def schedule(self, when, callback, *args):
+        event = ScheduledEvent(when, next(self._sequence), callback, args)
+        with self._condition:
+            heapq.heappush(self._events, event)
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return event
+
+    def run_pending(self, now=None):
+        # fires the events due at now, returns the time of the next one
+        now = self.clock() if now is None else now
+        while True:
+            with self._condition:
+                if not self._events or self._events[0].time > now:
+                    return self._events[0].time if self._events else None
+                event = heapq.heappop(self._events)
+            if event.cancelled:
+                continue
+            self.jitter.add(self.clock() - event.time)
+            try:
+                event.callback(*event.args)
+            except Exception as e:
+                print(e)
+
+    def _wait(self, remaining):
+        duration = min(remaining - self.overshoot, self.max_sleep)
+        if duration <= 0:
+            self.sleep(0)
+            return
+        start = self.clock()
+        self.sleep(duration)
+        self.overshoot += (self.clock() - start - duration - self.overshoot) / 8
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._events and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+            next_time = self.run_pending()
+            if next_time is not None:
+                remaining = next_time - self.clock()
+                if remaining > 0:
+                    self._wait(remaining)
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+
+class SimulatedClock:
+    # clock and sleep for a Scheduler, time only moves when the scheduler sleeps, by the duration plus an overshoot
+    def __init__(self, start=0.0, overshoot=0.0):
+        self.time = start
+        self.overshoot = overshoot
+
+    def __call__(self):
+        return self.time
+
+    def sleep(self, duration):
+        self.time += duration + (self.overshoot if duration > 0 else 1e-6)
+
+
+class TempoGrid:
+    def __init__(self, bpm=120.0, division=4, origin=0.0):
+        self.bpm = bpm
+        self.division = division  # grid steps per beat
+        self.origin = origin
+
+    @property
+    def beat_duration(self):
+        return 60.0 / self.bpm
+
+    @property
+    def step_duration(self):
+        return self.beat_duration / self.division
+
+    def next_step(self, timestamp):
+        step = self.step_duration
+        return self.origin + math.ceil((timestamp - self.origin) / step) * step
+
+    def next_beat(self, timestamp):
+        beat = self.beat_duration
+        return self.origin + math.ceil((timestamp - self.origin) / beat) * beat
+
+
+class MidiClock:
+    # Sends start and the first clock on the next beat of the grid, then 24 clocks per beat until stopped.
+    # Each clock is scheduled one period after the previous one was due, not after it fired, so lateness
+    # does not add up. Tempo changes apply from the next clock.
+
+    def __init__(self, scheduler, grid, send_bytes):
+        self.scheduler = scheduler
+        self.grid = grid
+        self.send_bytes = send_bytes
+        self._event = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_running(self):
+        return self._event is not None
+
+    def start(self):
+        with self._lock:
+            if self._event:
+                return
+            when = self.grid.next_beat(self.scheduler.clock())
+            self._event = self.scheduler.schedule(when, self._tick, when, True)
+
+    def _tick(self, when, first=False):
+        with self._lock:
+            if not self._event:
+                return
+            if first:
+                self.send_bytes(MIDI_START)
+            self.send_bytes(MIDI_CLOCK)
+            when += self.grid.beat_duration / MIDI_CLOCK_PER_BEAT
+            self._event = self.scheduler.schedule(when, self._tick, when)
+
+    def stop(self):
+        with self._lock:
+            if not self._event:
+                return
+            self._event.cancel()
+            self._event = None
+            self.send_bytes(MIDI_STOP)
@@ -0,0 +1,49 @@
+from collections import OrderedDict
+
+from input_canvas import InputCursor, QueuedTabletCanvas
+from touchy_client import INJECTION_CAPACITY, INJECTION_PATH, open_ring_file
+
+# Samples of local tools through the memory mapped ring of touchy_client.py, drained in batches by the pyglet loop.
+
+
+class SharedTabletCanvas(QueuedTabletCanvas):
+    def __init__(self, window, path, capacity, **kwargs):
+        self.mapping, self.ring = open_ring_file(path, capacity)
+        super().__init__(window, **kwargs)
+
+    def _drain(self, dt):
+        width, height = self.window.width, self.window.height
+        # moves of the same cursor with unchanged buttons collapse into the latest one
+        latest = OrderedDict()
+        for source, cursor, buttons, x, y, pressure, timestamp in self.ring.pop_batch(self.ring.capacity):
+            key = ('%d.%d' % (source, cursor), buttons)
+            latest.pop(key, None)
+            latest[key] = x, y, pressure
+        for (name, buttons), (x, y, pressure) in latest.items():
+            self.dispatch_event('on_motion', self.cursor(name), x * width, y * height, pressure, buttons)
+
+    def close(self):
+        super().close()
+        self.ring.release()
+        self.mapping.close()
+
+
+class SharedInput:
+    source_name = "shared"
+    path = INJECTION_PATH
+    capacity = INJECTION_CAPACITY
+    cursor_names = ['%d.%d' % (source, cursor) for source in range(2) for cursor in range(5)]
+
+    def __init__(self):
+        self.cursors = list(map(InputCursor, self.cursor_names))
+        self.buttons = ['0', '1']
+
+    @property
+    def name(self):
+        return SharedInput.source_name
+
+    def open(self, window):
+        try:
+            return SharedTabletCanvas(window, self.path, self.capacity)
+        except OSError as e:
+            print(e)
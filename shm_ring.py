@@ -0,0 +1,95 @@
+import ctypes
+import multiprocessing
+import struct
+
+# Single producer, single consumer ring of fixed size struct records in a shared buffer, between two processes.
+# Layout of the buffer, little endian:
+#   0   u64 head, records consumed, written by the consumer only
+#   8   u64 tail, records produced, written by the producer only
+#   16  u64 waiting, set by the consumer while it sleeps, the producer then wakes it
+#   24  u64 capacity, records, a power of two
+#   32  u64 record size, bytes
+#   64  capacity records, record i at 64 + (i % capacity) * record size
+# The indices are aligned 64 bit words, stored whole. A record is written before the tail moves past it and read
+# before the head does, so the two sides never touch the same record at the same time.
+
+RING_HEADER_SIZE = 64
+_HEAD, _TAIL, _WAITING, _CAPACITY, _RECORD_SIZE = range(5)
+
+
+def ring_size(record, capacity):
+    return RING_HEADER_SIZE + record.size * capacity
+
+
+class RecordRing:
+    def __init__(self, buffer, record, capacity=None):
+        # capacity is given when the ring is created in the buffer, left out when attaching to an existing one
+        self.buffer = buffer
+        self.record = record
+        self.dropped = 0
+        self._view = memoryview(buffer).cast('B')
+        self._indices = (ctypes.c_uint64 * 5).from_buffer(buffer)
+        if capacity is not None:
+            assert capacity & (capacity - 1) == 0, 'capacity must be a power of two'
+            assert len(self._view) >= ring_size(record, capacity), 'buffer too small'
+            self._indices[_CAPACITY] = capacity
+            self._indices[_RECORD_SIZE] = record.size
+        elif self._indices[_RECORD_SIZE] != record.size:
+            raise ValueError('ring records are %d bytes, not %d' % (self._indices[_RECORD_SIZE], record.size))
+        self.capacity = self._indices[_CAPACITY]
+        self._mask = self.capacity - 1
+
+    @classmethod
+    def create(cls, record, capacity=4096):
+        # in memory shared with processes started afterwards, the ring is passed to them as a Process argument
+        return cls(multiprocessing.RawArray(ctypes.c_char, ring_size(record, capacity)), record, capacity)
+
+    def __getstate__(self):
+        return self.buffer, self.record.format
+
+    def __setstate__(self, state):
+        buffer, record_format = state
+        self.__init__(buffer, struct.Struct(record_format))
+
+    def __len__(self):
+        return self._indices[_TAIL] - self._indices[_HEAD]
+
+    @property
+    def waiting(self):
+        return bool(self._indices[_WAITING])
+
+    @waiting.setter
+    def waiting(self, value):
+        self._indices[_WAITING] = int(value)
+
+    def push(self, *values):
+        indices = self._indices
+        tail = indices[_TAIL]
+        if tail - indices[_HEAD] >= self.capacity:
+            self.dropped += 1
+            return False
+        self.record.pack_into(self._view, RING_HEADER_SIZE + (tail & self._mask) * self.record.size, *values)
+        indices[_TAIL] = tail + 1
+        return True
+
+    def pop_batch(self, limit=256):
+        # up to limit records as tuples, unpacked from at most two contiguous spans
+        indices, size = self._indices, self.record.size
+        head = indices[_HEAD]
+        count = min(indices[_TAIL] - head, limit)
+        if count <= 0:
+            return []
+        start = head & self._mask
+        first = min(count, self.capacity - start)
+        offset = RING_HEADER_SIZE + start * size
+        records = list(self.record.iter_unpack(self._view[offset:offset + first * size]))
+        if count > first:
+            records.extend(self.record.iter_unpack(
+                self._view[RING_HEADER_SIZE:RING_HEADER_SIZE + (count - first) * size]))
+        indices[_HEAD] = head + count
+        return records
+
+    def release(self):
+        # drops the views into the buffer, an mmap can only be closed afterwards
+        self._view.release()
+        self._indices = None
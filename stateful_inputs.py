@@ -1,5 +1,11 @@
+import math
+
 from autoclass import autoclass
 
+from metrics import metrics
+
+threshold_dropped = metrics.counter('touchy_threshold_dropped_total', 'Axis samples held back by rule thresholds')
+
 
 class StatefulAxes:
     def __init__(self):
@@ -39,6 +45,7 @@ class ThresholdAxes(StatefulAxes):
         axis_values = super(ThresholdAxes, self).value(axis_values)
         # ignore = all(map(lambda axis: self.axis_values[axis] < self.threshold, ['tdx', 'tdy', 'tdz']))
         if self.axis_values[f'td{self.rule_axis}'] < self.threshold:
+            threshold_dropped.inc()
             return None
         else:
             self.reset(self.rule_axis)
@@ -62,3 +69,87 @@ class AccumulatingAxes(StatefulAxes):
     def value(self, axis_values):
         super(AccumulatingAxes, self).value(axis_values)
         return self.total
+
+
+class ExponentialFilter:
+    __slots__ = ('alpha', 'value', 'target')
+
+    def __init__(self, alpha=0.3):
+        self.alpha = alpha
+        self.value = None
+        self.target = None
+
+    def filter(self, x, timestamp):
+        self.target = x
+        if self.value is None:
+            self.value = x
+        else:
+            self.value += self.alpha * (x - self.value)
+        return self.value
+
+    def flush(self):
+        # jumps to the last input once it stopped moving, None when already there
+        if self.value == self.target:
+            return None
+        self.value = self.target
+        return self.value
+
+
+class OneEuroFilter:
+    # https://gery.casiez.net/1euro/ - smooths slow movements, follows fast ones with little lag.
+    # speed_scale converts input units per second into domain spans per second, so the defaults fit any axis.
+    __slots__ = ('min_cutoff', 'beta', 'derivative_cutoff', 'speed_scale', 'value', 'derivative', 'timestamp',
+                 'target')
+
+    def __init__(self, speed_scale=1.0, min_cutoff=1.0, beta=10.0, derivative_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.derivative_cutoff = derivative_cutoff
+        self.speed_scale = speed_scale
+        self.value = None
+        self.derivative = 0.0
+        self.timestamp = None
+        self.target = None
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def filter(self, x, timestamp):
+        self.target = x
+        if self.value is None:
+            self.value, self.timestamp = x, timestamp
+            return x
+
+        dt = timestamp - self.timestamp
+        if dt <= 0:
+            return self.value
+        self.timestamp = timestamp
+
+        derivative = (x - self.value) / dt * self.speed_scale
+        self.derivative += self._alpha(self.derivative_cutoff, dt) * (derivative - self.derivative)
+        cutoff = self.min_cutoff + self.beta * abs(self.derivative)
+        self.value += self._alpha(cutoff, dt) * (x - self.value)
+        return self.value
+
+    def flush(self):
+        if self.value == self.target:
+            return None
+        self.value, self.derivative = self.target, 0.0
+        return self.value
+
+
+class DeadBandFilter:
+    # holds the value until the input leaves the band around it, jitter around a boundary is swallowed
+    __slots__ = ('width', 'value')
+
+    def __init__(self, width):
+        self.width = width
+        self.value = None
+
+    def filter(self, x, timestamp):
+        if self.value is not None and abs(x - self.value) < self.width:
+            return None
+        self.value = x
+        return x
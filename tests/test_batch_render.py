@@ -0,0 +1,78 @@
+from collections import namedtuple
+
+import numpy as np
+
+from batch_render import TakeRecorder, load_take, render
+from pipeline import PipelineContext, compile_rule_pipeline
+from stateful_inputs import ThresholdAxes
+
+Rule = namedtuple('Rule', ['enabled', 'channel', 'message_type', 'control_type', 'range_from', 'range_to',
+                           'threshold', 'axis', 'curve', 'quantize', 'invert', 'smoothing', 'interpolate'])
+KEY = ('mouse', 'cursor', '0')
+
+
+def _gestures(rng, strokes=20, length=50):
+    # (command before the sample or None, value) of strokes pressed and released, 1 ms apart
+    samples = []
+    for _ in range(strokes):
+        values = np.clip(np.cumsum(rng.normal(0, 0.02, length)) + rng.random(), 0, 1)
+        samples.append(('saturate', values[0]))
+        samples.extend((None, value) for value in values[1:])
+        samples[-1] = ('reset', samples[-1][1])
+    return samples
+
+
+def _live(rule, samples):
+    # the controller's handling of the samples and commands, (sample index, value) of every sent value
+    threshold_axes = ThresholdAxes('x', rule.threshold)
+    pipeline = compile_rule_pipeline(rule, PipelineContext((0, 1), (0, 127), threshold_axes))
+    sent = []
+    for i, (command, value) in enumerate(samples):
+        if command == 'saturate':
+            threshold_axes.saturate()
+        elif command == 'reset':
+            threshold_axes.reset()
+            flushed = pipeline.flush() if pipeline.flush else None
+            if flushed is not None:
+                sent.append((i - 1, flushed))
+        result = pipeline({'x': value}, i / 1000)
+        if result is not None:
+            sent.append((i, result))
+    return sent
+
+
+def _rendered(rule, samples, directory):
+    recorder = TakeRecorder(str(directory))
+    recorder.start()
+    for i, (command, value) in enumerate(samples):
+        if command == 'saturate':
+            recorder.saturate()
+        elif command == 'reset':
+            recorder.reset()
+            recorder.flush()
+        recorder.record(KEY, i / 1000, {'x': value}, {'x': (0, 1)})
+    takes = list(recorder._takes.values())
+    recorder._save(takes, 'take')
+    messages = render([rule], load_take(str(directory / 'take-0.npz')))
+    return list(zip(messages.sample_indices.tolist(), messages.data[:, 2].tolist()))
+
+
+def test_render_matches_live_pipeline_across_releases(tmp_path):
+    samples = _gestures(np.random.default_rng(3))
+    for smoothing in ('none', 'ema', 'one euro', 'dead band'):
+        for threshold in (0, 0.05):
+            rule = Rule(True, '0', 'control', 'Bank Select', '0', '127', threshold, 'x', 'linear', '0', False,
+                        smoothing, False)
+            assert _rendered(rule, samples, tmp_path) == _live(rule, samples), (smoothing, threshold)
+
+
+def test_idle_flush_reaches_only_idle_takes():
+    recorder = TakeRecorder()
+    recorder.start()
+    recorder.record(KEY, 0.0, {'x': 0.5}, {'x': (0, 1)})
+    recorder.record(('tablet', 'pen', '0'), 1e12, {'x': 0.5}, {'x': (0, 1)})
+    recorder.flush(0.05)
+    recorder.record(KEY, 1.0, {'x': 0.6}, {'x': (0, 1)})
+    recorder.record(('tablet', 'pen', '0'), 1e12 + 1, {'x': 0.6}, {'x': (0, 1)})
+    flags = {key: events['flush'] for (key, _), (_, _, _, _, events, _) in recorder._takes.items()}
+    assert flags == {KEY: [False, True], ('tablet', 'pen', '0'): [False, False]}
@@ -0,0 +1,68 @@
+import pickle
+import threading
+import time
+
+import pytest
+
+from midi_engine import MidiEngine, ENGINE_COMMANDS, ENGINE_RECORD
+from midi_outputs import NetworkMidiReceiver, NETWORK_MIDI_SCHEME
+from shm_ring import RecordRing
+
+
+def _with_bindings():
+    pytest.importorskip('pyglet_gui')
+    import pyglet
+    pyglet.options['shadow_window'] = False
+    import bindings
+    return bindings
+
+
+def test_long_names_reach_the_worker_whole():
+    engine = MidiEngine()
+    engine.ring, engine._wake = RecordRing.create(ENGINE_RECORD, 64), threading.Event()
+    tablet = 'Wacom Intuos Pro L Pen stylus Pen (0x12345678) \u00e9'
+    for i in range(2):
+        engine.push_axes(tablet, 'cursor', 1, {'x': i}, {'x': (0, 1)}, float(i), instance='12.65535')
+    engine.push_axes('x' * 200, 'cursor', 1, {'x': 0}, {'x': (0, 1)}, 0.0)
+    names, received = dict(), []
+    for record in engine.ring.pop_batch():
+        if ENGINE_COMMANDS[record[0]] == 'define_name':
+            names[record[2]] = record[7].rstrip(b'\0').decode()
+        else:
+            received.append((names[record[3]], names[record[4]], names[record[5]], record[6].rstrip(b'\0')))
+    assert received == [(tablet, 'cursor', '1', b'12.65535')] * 2
+    assert engine.oversized == 1
+
+
+def test_snapshot_storage_pickles():
+    bindings = _with_bindings()
+    bind_tablet_x, plain_storage, named_storage = bindings.bind_tablet_x, bindings.plain_storage, bindings.named_storage
+    storage = {('tablet', 'pen', '0'): [bind_tablet_x.to_tuple()._replace(enabled=True)]}
+    assert named_storage(pickle.loads(pickle.dumps(plain_storage(storage)))) == storage
+
+
+def test_engine_sends_midi_of_a_mapped_rule():
+    bindings = _with_bindings()
+    model, binding_buttons, binding_devices = bindings.model, bindings.binding_buttons, bindings.binding_devices
+    bind_tablet_x = bindings.bind_tablet_x
+    from controller import controller
+    received = []
+    receiver = NetworkMidiReceiver('127.0.0.1', 0, lambda timestamp, data: received.append(data))
+    receiver.start()
+    key = ('tablet', 'pen', '0')
+    model.restore({key: [bind_tablet_x.to_tuple()._replace(enabled=True)]})
+    binding_buttons.midi_output_on = True
+    binding_devices.output_midi_port_name = NETWORK_MIDI_SCHEME + '%s:%d' % receiver.address
+    controller.start_engine()
+    try:
+        deadline = time.perf_counter() + 10
+        i = 0
+        while not received and time.perf_counter() < deadline:
+            controller.refresh_from_input(0)
+            controller.enqueue_axes_input(*key, axis_values={'x': i % 100}, domains={'x': (0, 100)})
+            i += 1
+            time.sleep(0.01)
+    finally:
+        controller.engine.stop()
+        receiver.stop()
+    assert received and received[0][0] & 0xF0 == 0xB0
@@ -0,0 +1,65 @@
+import socket
+import struct
+import time
+
+from osc_input import OscServer, OSC_BUNDLE_TAG
+
+
+def _string(text):
+    data = text.encode() + b'\0'
+    return data + b'\0' * (-len(data) % 4)
+
+
+def _message(address, type_tags, *values):
+    return _string(address) + _string(type_tags) + b''.join(values)
+
+
+def _bundle(*packets):
+    return OSC_BUNDLE_TAG + bytes(8) + b''.join(struct.pack('>i', len(packet)) + packet for packet in packets)
+
+
+class _Canvas:
+    def __init__(self):
+        self.samples = []
+
+    def push(self, *sample):
+        self.samples.append(sample)
+
+
+def _serve(*datagrams):
+    canvas = _Canvas()
+    server = OscServer(canvas, '127.0.0.1', 0)
+    server.start()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    good = _message('/touchy/touch0', ',ff', struct.pack('>f', 0.25), struct.pack('>f', 0.75))
+    for datagram in datagrams + (good,):
+        sender.sendto(datagram, server.address)
+    deadline = time.perf_counter() + 2
+    while not canvas.samples and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    alive = server.is_alive()
+    server.stop()
+    sender.close()
+    return canvas.samples, server.rejected, alive
+
+
+def test_bad_type_tags_are_skipped():
+    samples, rejected, alive = _serve(
+        _message('/touchy/touch0', ',NNNN'),
+        _message('/touchy/touch0', ',ss', _string('a'), _string('b')),
+        _message('/touchy/touch0', ',TF'),
+        _message('/touchy/touch0', ',fffs', *[struct.pack('>f', 0.5)] * 3, _string('x')),
+        _message('/touchy/touch0', ',ff', struct.pack('>f', float('nan')), struct.pack('>f', 0.5)))
+    assert alive
+    assert rejected == 5
+    assert samples == [('touch0', 0.25, 0.75, 1.0, 0)]
+
+
+def test_truncated_and_nested_datagrams_are_dropped():
+    nested = _message('/touchy/touch1', ',ff', struct.pack('>f', 0.5), struct.pack('>f', 0.5))
+    for _ in range(100):
+        nested = _bundle(nested)
+    samples, rejected, alive = _serve(_message('/touchy/touch0', ',ff', b'\0\0'), nested, b'\xff' * 7)
+    assert alive
+    assert rejected == 3
+    assert samples == [('touch0', 0.25, 0.75, 1.0, 0)]
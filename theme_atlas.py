@@ -0,0 +1,109 @@
+import json
+import os
+import sys
+
+import pyglet
+
+# Packs the images of a pyglet_gui theme into one atlas image, so the GUI batch draws from a single texture,
+# and writes the theme with every image pointing to its region of the atlas. Both are rebuilt when the theme
+# or any of its images is newer.
+
+ATLAS_IMAGE = 'atlas.png'
+ATLAS_THEME = 'theme.atlas.json'
+ATLAS_PADDING = 1  # border pixels repeated around every image, so filtering never samples a neighbour
+
+
+def _image_sources(node, sources):
+    if isinstance(node, dict):
+        image = node.get('image')
+        if isinstance(image, dict) and 'source' in image:
+            sources.add(image['source'])
+        for value in node.values():
+            _image_sources(value, sources)
+    return sources
+
+
+def _rewrite_images(node, regions):
+    if not isinstance(node, dict):
+        return node
+    node = {key: _rewrite_images(value, regions) for key, value in node.items()}
+    image = node.get('image')
+    if isinstance(image, dict) and 'source' in image:
+        x, y, width, height = regions[image['source']]
+        region = image.get('region', [0, 0, width, height])
+        node['image'] = dict(image, source=ATLAS_IMAGE, region=[x + region[0], y + region[1], region[2], region[3]])
+    return node
+
+
+def pack(sizes, width):
+    # shelf packing, tallest first: name: (width, height) -> name: (x, y), total height
+    positions = dict()
+    x = y = shelf_height = 0
+    for name, (w, h) in sorted(sizes.items(), key=lambda item: (-item[1][1], item[0])):
+        if x + w > width:
+            x, y, shelf_height = 0, y + shelf_height, 0
+        positions[name] = (x, y)
+        x += w
+        shelf_height = max(shelf_height, h)
+    return positions, y + shelf_height
+
+
+def _extruded_rows(image, padding):
+    # RGBA rows of the image, bottom first, with the border pixels repeated padding times on every side
+    width = image.width
+    data = image.get_image_data().get_data('RGBA', width * 4)
+    rows = []
+    for i in range(image.height):
+        row = data[i * width * 4:(i + 1) * width * 4]
+        rows.append(row[:4] * padding + row + row[-4:] * padding)
+    return [rows[0]] * padding + rows + [rows[-1]] * padding
+
+
+def build_atlas(path='theme', width=256):
+    with open(os.path.join(path, 'theme.json')) as f:
+        theme = json.load(f)
+    images = {source: pyglet.image.load(os.path.join(path, source)) for source in sorted(_image_sources(theme, set()))}
+    padding = ATLAS_PADDING
+    sizes = {source: (image.width + 2 * padding, image.height + 2 * padding) for source, image in images.items()}
+    width = max([width] + [w for w, _ in sizes.values()])
+    positions, height = pack(sizes, width)
+
+    atlas = bytearray(width * height * 4)
+    regions = dict()
+    for source, image in images.items():
+        x, y = positions[source]
+        for i, row in enumerate(_extruded_rows(image, padding)):
+            offset = ((y + i) * width + x) * 4
+            atlas[offset:offset + len(row)] = row
+        regions[source] = (x + padding, y + padding, image.width, image.height)
+
+    pyglet.image.ImageData(width, height, 'RGBA', bytes(atlas)).save(os.path.join(path, ATLAS_IMAGE))
+    with open(os.path.join(path, ATLAS_THEME), 'w') as f:
+        json.dump(_rewrite_images(theme, regions), f, indent=1)
+
+
+def is_atlas_stale(path='theme'):
+    try:
+        built = min(os.path.getmtime(os.path.join(path, name)) for name in (ATLAS_IMAGE, ATLAS_THEME))
+    except OSError:
+        return True
+    with open(os.path.join(path, 'theme.json')) as f:
+        sources = _image_sources(json.load(f), {'theme.json'})
+    return any(os.path.getmtime(os.path.join(path, source)) > built for source in sources)
+
+
+def load_theme_dict(path='theme'):
+    # the atlas theme, built on first run, or the plain theme if the atlas can't be built
+    try:
+        if is_atlas_stale(path):
+            build_atlas(path)
+        with open(os.path.join(path, ATLAS_THEME)) as f:
+            return json.load(f)
+    except Exception as e:
+        print(e)
+    with open(os.path.join(path, 'theme.json')) as f:
+        return json.load(f)
+
+
+if __name__ == '__main__':
+    build_atlas(*sys.argv[1:])
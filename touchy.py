@@ -1,10 +1,22 @@
-import pyglet
+import sys
 
-from main_window import MainWindow
-from widgets import MainManager
+# the MIDI engine process starts by importing this module again, without opening a window
+if __name__ == '__main__':
+    import pyglet
 
-window = MainWindow(1200, 1000, resizable=True)
-window.set_caption('Touchy - Virtual MIDI X-Y Pad')
+    from controller import controller
+    from main_window import MainWindow
+    from widgets import MainManager
 
-MainManager(window=window, is_movable=True)
-pyglet.app.run()
+    if '--engine' in sys.argv:
+        controller.start_engine()
+    if '--metrics' in sys.argv:
+        controller.start_metrics_server()
+
+    window = MainWindow(1200, 1000, resizable=True)
+    window.set_caption('Touchy - Virtual MIDI X-Y Pad')
+
+    MainManager(window=window, is_movable=True)
+    if '--profile' in sys.argv:
+        controller.toggle_profiler()
+    pyglet.app.run()
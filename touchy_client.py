@@ -0,0 +1,86 @@
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import tempfile
+import time
+
+from shm_ring import RecordRing, ring_size
+
+# Feeds axis samples to touchy through a memory mapped file, for tools on the same machine sending at high
+# rates. Touchy creates the file when the `shared` tablet input is turned on; clients attach to it and push
+# records into a single producer, single consumer ring, one producer per file. The file layout is described
+# in shm_ring.py, records are 40 bytes, little endian:
+#
+#   uint32 source id, uint32 cursor, int32 buttons, 4 bytes padding,
+#   float64 x, float64 y, float64 pressure  (normalized to [0, 1], y pointing up),
+#   float64 timestamp  (seconds, any monotonic clock of the producer)
+#
+# Source 0..1 and cursor 0..4 show up as the cursors '<source>.<cursor>' of the tablet rows.
+
+INJECTION_RECORD = struct.Struct('<IIi4xdddd')
+INJECTION_CAPACITY = 1 << 14
+INJECTION_PATH = os.path.join(tempfile.gettempdir(), 'touchy-input.ring')
+
+
+def open_ring_file(path=INJECTION_PATH, capacity=None):
+    # creates the ring when a capacity is given, attaches to the existing one otherwise
+    with open(path, 'w+b' if capacity else 'r+b') as f:
+        if capacity:
+            f.truncate(ring_size(INJECTION_RECORD, capacity))
+        mapping = mmap.mmap(f.fileno(), 0)
+    return mapping, RecordRing(mapping, INJECTION_RECORD, capacity)
+
+
+class TouchyClient:
+    def __init__(self, path=INJECTION_PATH, source=0, clock=time.perf_counter):
+        self.source = source
+        self.clock = clock
+        self.mapping, self.ring = open_ring_file(path)
+
+    @property
+    def dropped(self):
+        return self.ring.dropped
+
+    def send(self, x, y, pressure=1.0, buttons=0, cursor=0):
+        # False when touchy is behind and the ring is full, the sample is then dropped
+        return self.ring.push(self.source, cursor, buttons, x, y, pressure, self.clock())
+
+    def close(self):
+        self.ring.release()
+        self.mapping.close()
+
+
+def _produce(path, samples):
+    client = TouchyClient(path)
+    for i in range(samples):
+        while not client.send((i % 1000) / 1000, 0.5, 1.0, 1, i % 5):
+            pass  # a producer keeping every sample waits for room
+    client.close()
+
+
+def benchmark(samples=1000000):
+    # records per second from a producer process to batches drained here
+    path = INJECTION_PATH + '.benchmark'
+    mapping, ring = open_ring_file(path, INJECTION_CAPACITY)
+    producer = multiprocessing.get_context('spawn').Process(target=_produce, args=(path, samples))
+    producer.start()
+    received, batches, start = 0, 0, None
+    while received < samples:
+        records = ring.pop_batch(INJECTION_CAPACITY)
+        if records:
+            start = start or time.perf_counter() - 1e-6
+            received += len(records)
+            batches += 1
+    duration = time.perf_counter() - start
+    producer.join()
+    ring.release()
+    mapping.close()
+    os.remove(path)
+    print('%d records in %.3f s, %.0f records/s, %.1f records per batch' % (
+        received, duration, received / duration, received / batches))
+
+
+if __name__ == '__main__':
+    benchmark(*map(int, sys.argv[1:]))
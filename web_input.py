@@ -0,0 +1,302 @@
+import asyncio
+import base64
+import hashlib
+import struct
+import threading
+from collections import deque, OrderedDict
+
+from input_canvas import InputCursor, QueuedTabletCanvas
+
+# Browser touch pad: GET / serves the page, GET /ws upgrades to a WebSocket.
+# Clients batch pointer events per animation frame into binary frames of 16 byte little-endian records:
+#
+#   uint8 pointer type (index in WebInput.cursor_names), uint8 buttons, uint16 pointer id,
+#   float32 x, float32 y, float32 pressure  (x, y normalized to [0, 1], y pointing up)
+#
+# Buttons are the low bits of the pointer event buttons: 1 left or contact, 2 right or barrel, 4 middle.
+# The type has POINTER_GONE set on the last sample of a pointer, lifted, cancelled or out of the page.
+# Every pointer of every client is a cursor instance of its own, 'client id.pointer id', that leaves with it.
+
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+POINTER_RECORD = struct.Struct('<BBHfff')
+POINTER_GONE = 0x80
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+TOUCH_PAD_PAGE = b'''<!DOCTYPE html>
+<html><head><meta name="viewport" content="width=device-width, initial-scale=1, user-scalable=no">
+<title>Touchy</title>
+<style>html, body { margin: 0; height: 100%; overflow: hidden; background: #222; touch-action: none; }</style>
+</head><body><script>
+const TYPES = ['mouse', 'pen', 'touch'];
+const RECORD = 16, HIGH_WATER = 1 << 16;
+let ws, pending = new Map(), queue = [];
+function connect() {
+    ws = new WebSocket('ws://' + location.host + '/ws');
+    ws.binaryType = 'arraybuffer';
+    ws.onclose = () => setTimeout(connect, 1000);
+}
+function collect(e) {
+    e.preventDefault();
+    const gone = e.type === 'pointercancel' || e.type === 'pointerleave'
+        || (e.type === 'pointerup' && e.pointerType !== 'mouse');
+    const sample = [Math.max(0, TYPES.indexOf(e.pointerType)) | (gone ? 0x80 : 0), e.buttons & 7,
+                    e.clientX / innerWidth, 1 - e.clientY / innerHeight, e.pressure, e.pointerId & 0xFFFF];
+    queue.push(sample);
+    pending.set(e.pointerId, sample);
+}
+function flush() {
+    requestAnimationFrame(flush);
+    if (!queue.length || !ws || ws.readyState !== 1) return;
+    // backpressure: while the socket is congested only the latest sample of every pointer is kept
+    if (ws.bufferedAmount > HIGH_WATER) { queue = Array.from(pending.values()); return; }
+    const view = new DataView(new ArrayBuffer(queue.length * RECORD));
+    queue.forEach((s, i) => {
+        const o = i * RECORD;
+        view.setUint8(o, s[0]); view.setUint8(o + 1, s[1]); view.setUint16(o + 2, s[5], true);
+        view.setFloat32(o + 4, s[2], true); view.setFloat32(o + 8, s[3], true); view.setFloat32(o + 12, s[4], true);
+    });
+    ws.send(view.buffer);
+    queue = []; pending.clear();
+}
+for (const type of ['pointerdown', 'pointermove', 'pointerup', 'pointercancel', 'pointerleave']) {
+    addEventListener(type, collect, {passive: false});
+}
+connect();
+requestAnimationFrame(flush);
+</script></body></html>
+'''
+
+
+def is_websocket_key(key):
+    # 16 bytes in base64
+    try:
+        return len(base64.b64decode(key.encode('ascii'), validate=True)) == 16
+    except ValueError:
+        return False
+
+
+def websocket_accept_key(key):
+    return base64.b64encode(hashlib.sha1(key.encode('ascii') + WEBSOCKET_GUID).digest()).decode('ascii')
+
+
+def unmask(payload, mask):
+    if not payload:
+        return payload
+    n = len(payload)
+    key = (mask * (n // 4 + 1))[:n]
+    return (int.from_bytes(payload, 'little') ^ int.from_bytes(key, 'little')).to_bytes(n, 'little')
+
+
+def websocket_frame(opcode, payload=b''):
+    n = len(payload)
+    if n < 126:
+        header = struct.pack('!BB', 0x80 | opcode, n)
+    elif n < 1 << 16:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, n)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, n)
+    return header + payload
+
+
+class WebClientShard:
+    # per client state, only touched by the server thread (append, closed) and the pyglet loop (popleft, removal)
+
+    def __init__(self, client_id, queue_size):
+        self.client_id = client_id
+        self.samples = deque(maxlen=queue_size)
+        self.received = 0
+        self.dropped = 0
+        self.closed = False
+        self.cursors = set()
+
+    def push_records(self, payload, cursor_names):
+        samples = self.samples
+        for pointer_type, buttons, pointer_id, x, y, pressure in POINTER_RECORD.iter_unpack(payload):
+            if len(samples) == samples.maxlen:
+                self.dropped += 1
+            gone, pointer_type = pointer_type & POINTER_GONE, pointer_type & ~POINTER_GONE
+            cursor = cursor_names[pointer_type] if pointer_type < len(cursor_names) else cursor_names[0]
+            samples.append((cursor, '%d.%d' % (self.client_id, pointer_id), x, y, pressure, buttons, bool(gone)))
+        self.received += len(payload) // POINTER_RECORD.size
+
+
+class WebServer(threading.Thread):
+    def __init__(self, canvas, host, port, cursor_names, max_clients=64, max_frame_size=1 << 20):
+        super().__init__(name='web-input', daemon=True)
+        self.canvas = canvas
+        self.host, self.port = host, port
+        self.cursor_names = cursor_names
+        self.max_clients = max_clients
+        self.max_frame_size = max_frame_size
+        self.address = None
+        self._loop = asyncio.new_event_loop()
+        self._server = None
+        self._listening = threading.Event()
+        self._next_client_id = 0
+        self._tasks = set()
+
+    def start(self):
+        super().start()
+        self._listening.wait()
+
+    def run(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._server = self._loop.run_until_complete(asyncio.start_server(self._accept, self.host, self.port))
+            self.address = self._server.sockets[0].getsockname()
+        except OSError as e:
+            print(e)
+            return
+        finally:
+            self._listening.set()
+        self._loop.run_forever()
+        # the connections are closed by their handlers, which have to run to the end
+        self._server.close()
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        self._loop.run_until_complete(asyncio.gather(self._server.wait_closed(), *tasks, return_exceptions=True))
+        self._loop.close()
+
+    def stop(self):
+        if self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        self.join()
+
+    def _accept(self, reader, writer):
+        task = self._loop.create_task(self._handle(reader, writer))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await reader.readuntil(b'\r\n\r\n')
+            lines = request.decode('latin-1').split('\r\n')
+            path = lines[0].split(' ')[1] if len(lines[0].split(' ')) > 1 else '/'
+            headers = {k.strip().lower(): v.strip() for k, _, v in (line.partition(':') for line in lines[1:] if line)}
+
+            if headers.get('upgrade', '').lower() == 'websocket' and 'sec-websocket-key' in headers:
+                if not is_websocket_key(headers['sec-websocket-key']):
+                    writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n')
+                elif len(self.canvas.shards) >= self.max_clients:
+                    writer.write(b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\n\r\n')
+                else:
+                    await self._serve_websocket(reader, writer, headers['sec-websocket-key'])
+            elif path == '/':
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\n'
+                             b'Content-Length: %d\r\nConnection: close\r\n\r\n' % len(TOUCH_PAD_PAGE) + TOUCH_PAD_PAGE)
+            else:
+                writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, IndexError):
+            pass
+        finally:
+            writer.close()
+
+    async def _serve_websocket(self, reader, writer, key):
+        writer.write(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                     b'Sec-WebSocket-Accept: ' + websocket_accept_key(key).encode('ascii') + b'\r\n\r\n')
+        await writer.drain()
+
+        self._next_client_id += 1
+        shard = self.canvas.add_shard(self._next_client_id)
+        fragments = []
+        try:
+            while True:
+                b0, b1 = await reader.readexactly(2)
+                fin, opcode, length = b0 & 0x80, b0 & 0x0F, b1 & 0x7F
+                if length == 126:
+                    length = struct.unpack('!H', await reader.readexactly(2))[0]
+                elif length == 127:
+                    length = struct.unpack('!Q', await reader.readexactly(8))[0]
+                if length > self.max_frame_size:
+                    writer.write(websocket_frame(OPCODE_CLOSE, struct.pack('!H', 1009)))
+                    return
+                mask = await reader.readexactly(4) if b1 & 0x80 else b'\0\0\0\0'
+                payload = unmask(await reader.readexactly(length), mask)
+
+                if opcode == OPCODE_CLOSE:
+                    writer.write(websocket_frame(OPCODE_CLOSE, payload[:2]))
+                    return
+                elif opcode == OPCODE_PING:
+                    writer.write(websocket_frame(OPCODE_PONG, payload))
+                    await writer.drain()
+                elif opcode in (OPCODE_BINARY, OPCODE_CONTINUATION):
+                    fragments.append(payload)
+                    if fin:
+                        data = b''.join(fragments)
+                        fragments = []
+                        data = data[:len(data) - len(data) % POINTER_RECORD.size]
+                        shard.push_records(data, self.cursor_names)
+        finally:
+            shard.closed = True
+
+
+class WebTabletCanvas(QueuedTabletCanvas):
+    def __init__(self, window, host, port, cursor_names, shard_queue_size=1024, **kwargs):
+        self.shards = OrderedDict()
+        self.shard_queue_size = shard_queue_size
+        super().__init__(window, **kwargs)
+        self.server = WebServer(self, host, port, cursor_names)
+        self.server.start()
+
+    def add_shard(self, client_id):
+        shard = self.shards[client_id] = WebClientShard(client_id, self.shard_queue_size)
+        return shard
+
+    def _drain(self, dt):
+        width, height = self.window.width, self.window.height
+        for shard in list(self.shards.values()):
+            # a closed client leaves once its last samples are handled
+            closed = shard.closed
+            samples = shard.samples
+            # moves of the same pointer with unchanged buttons collapse into the latest one
+            latest = OrderedDict()
+            for _ in range(len(samples)):
+                name, instance, x, y, pressure, buttons, gone = sample = samples.popleft()
+                key = (name, instance, buttons)
+                latest.pop(key, None)
+                latest[key] = sample
+            for name, instance, x, y, pressure, buttons, gone in latest.values():
+                cursor = self.cursor(name, instance)
+                shard.cursors.add(cursor)
+                self.dispatch_event('on_motion', cursor, x * width, y * height, pressure, buttons)
+                if gone:
+                    shard.cursors.discard(cursor)
+                    self.leave(cursor)
+            if closed:
+                del self.shards[shard.client_id]
+                for cursor in shard.cursors:
+                    self.leave(cursor)
+
+    def close(self):
+        self.server.stop()
+        self.shards.clear()
+        super().close()
+
+
+class WebInput:
+    source_name = "web"
+    host = '0.0.0.0'
+    port = 8000
+    cursor_names = ['mouse', 'pen', 'touch']
+
+    def __init__(self):
+        self.cursors = list(map(InputCursor, self.cursor_names))
+        self.buttons = [str(buttons) for buttons in range(8)]  # bits of left, right, middle
+
+    @property
+    def name(self):
+        return WebInput.source_name
+
+    def open(self, window):
+        canvas = WebTabletCanvas(window, self.host, self.port, self.cursor_names)
+        if canvas.server.address is None:
+            canvas.close()
+            return None
+        return canvas
@@ -1,3 +1,5 @@
+import time
+
 import pyglet
 import pyglet.graphics
 from pyglet_gui.buttons import Checkbox, OneTimeButton
@@ -6,13 +8,109 @@ from pyglet_gui.gui import Frame, SectionHeader, Label
 from pyglet_gui.manager import Manager
 from pyglet_gui.sliders import HorizontalSlider
 from pyglet_gui.theme import Theme
-from json import load
 
-from bindings import bind_tablet_key, bind_tablet_x, bind_tablet_y, bind_tablet_p, bind_mouse_key, bind_mouse_x, \
-    bind_mouse_y, binding_buttons, binding_labels, binding_devices, bind_mouse_wheel_x, bind_mouse_wheel_y
+from bindings import bind_tablet_key, bind_tablet_rows, bind_mouse_key, bind_mouse_rows, bind_mouse_wheel_rows, \
+    binding_buttons, binding_labels, binding_devices, binding_tempo
 
-from monkey_patching import Dropdown, Button, TextInput
+from monkey_patching import Dropdown, Button, TextInput, mark_layout_dirty
+from theme_atlas import load_theme_dict
 from controller import controller
+from metrics import metrics, FRAME_BUCKETS
+
+
+def _slider(max_value=100.0):
+    return HorizontalSlider(min_value=0.0, max_value=max_value, steps=20)
+
+
+def _field(make_widget):
+    def build(binding, field):
+        return binding.bind(make_widget(), field)
+    return build
+
+
+def _message_type_widget(binding, field):
+    return HorizontalContainer([
+        binding.bind(Dropdown(controller.midi_message_types), 'message_type'),
+        binding.widget(
+            HorizontalContainer([
+                Label("for"),
+                binding.bind(Dropdown(controller.midi_control_types), 'control_type'),
+            ], hidden=True), 'control_group'),
+    ])
+
+
+AXIS_LABELS = {'x': "X", 'y': "Y", 'z': "Pressure"}
+THRESHOLD_MAXIMUMS = {'z': 1.0}  # pressure is normalized, the other axes move in pixels
+
+
+def _threshold_widget(binding, field):
+    return binding.bind(_slider(THRESHOLD_MAXIMUMS.get(binding.axis, 100.0)), field)
+
+# Row widgets of binding fields: (label, build(binding, field)), in the order of the binding fields.
+# Fields shown by another widget (control_type) or without one (axis) are left out.
+ROW_FIELD_WIDGETS = {
+    'enabled': (None, lambda binding, field: binding.bind(Button(AXIS_LABELS[binding.axis]), field)),
+    'channel': ("to channel", _field(lambda: Dropdown(controller.midi_channels))),
+    'message_type': ("as", _message_type_widget),
+    'range_from': ("ranging from", _field(TextInput)),
+    'range_to': ("to", _field(TextInput)),
+    'threshold': ("threshold", _threshold_widget),
+    'curve': ("curve", _field(lambda: Dropdown(controller.curve_names))),
+    'quantize': ("steps", _field(TextInput)),
+    'invert': (None, _field(lambda: Checkbox('invert'))),
+    'smoothing': ("smoothing", _field(lambda: Dropdown(controller.smoothing_names))),
+    'interpolate': (None, _field(lambda: Checkbox('interpolate'))),
+    'step': ("step", _field(TextInput)),
+    'value': ("value", _field(_slider)),
+    'pull_back': (None, _field(lambda: Checkbox('pull back'))),
+}
+
+
+def row_widgets(binding):
+    widgets = []
+    for field in binding.keys():
+        if field not in ROW_FIELD_WIDGETS:
+            continue
+        label, build = ROW_FIELD_WIDGETS[field]
+        if label:
+            widgets.append(Label(label))
+        widgets.append(build(binding, field))
+    return widgets
+
+
+def rows_grid(bindings):
+    return GridContainer([row_widgets(binding) for binding in bindings])
+
+
+class LazySection(VerticalContainer):
+    # The header button expands the section, its widgets are built the first time, afterwards only hidden.
+    # on_built is called once the widgets of a section expanded after startup are loaded.
+    def __init__(self, title, build, on_built=None, expanded=False):
+        self._build = build
+        self._on_built = on_built
+        self._body = None
+        VerticalContainer.__init__(self, [Button(title, is_pressed=expanded, on_press=self.set_expanded)])
+        if expanded:
+            self._body = self._make_body()
+            self._content.append(self._body)
+    
+    def _make_body(self):
+        return HorizontalContainer([VerticalContainer(self._build())])
+    
+    def set_expanded(self, expanded):
+        if self._body is not None:
+            self._body.hidden = not expanded
+            return
+        if not expanded:
+            return
+        self._body = self._make_body()
+        self._content.append(self._body)
+        self._body.set_manager(self._manager)
+        self._body.parent = self
+        self._body.load()
+        mark_layout_dirty(self._body)
+        if self._on_built:
+            self._on_built()
 
 
 class MainManager(Manager):
@@ -22,16 +120,14 @@ class MainManager(Manager):
         controller.window = window
         controller.manager = self
         
-        with open('theme/theme.json') as f:
-            theme = Theme(load(f), resources_path='./theme')
+        theme = Theme(load_theme_dict('theme'), resources_path='./theme')
 
         super().__init__(VerticalContainer([
             
-            Frame(Wrapper(VerticalContainer([
-                SectionHeader("Map Tablet to MIDI outputs"),
+            Frame(Wrapper(LazySection("Map Tablet to MIDI outputs", lambda: [
                 HorizontalContainer([
                     Label("Controller tablet"),
-                    binding_devices.bind(Dropdown(controller.tablet_names), 'tablet'),
+                    bind_tablet_key.bind(Dropdown(controller.tablet_names), 'tablet'),
                 ]),
                 HorizontalContainer([
                     Label("Map pointer"),
@@ -41,185 +137,21 @@ class MainManager(Manager):
                     bind_tablet_key.bind(Dropdown(controller.tablet_button_names), 'button'),
                     Label("as:")
                 ]),
-                GridContainer([
-                    [
-                        bind_tablet_x.bind(Button("X"), 'enabled'),
-                        Label("to channel"),
-                        bind_tablet_x.bind(Dropdown(controller.midi_channels), 'channel'),
-                        
-                        Label("as"),
-                        HorizontalContainer([
-                            bind_tablet_x.bind(Dropdown(controller.midi_message_types), 'message_type'),
-                            bind_tablet_x.widget(
-                                HorizontalContainer([
-                                    Label("for"),
-                                    bind_tablet_x.bind(Dropdown(controller.midi_control_types), 'control_type'),
-                                ], hidden=True), 'control_group'),
-                        ]),
-    
-                        Label("ranging from"),
-                        bind_tablet_x.bind(TextInput(), 'range_from'),
-                        Label("to"),
-                        bind_tablet_x.bind(TextInput(), 'range_to'),
-                        Label("threshold"),
-                        bind_tablet_x.bind(HorizontalSlider(min_value=0.0, max_value=100.0, steps=20), 'threshold'),
-                    ],
-                    [
-                        bind_tablet_y.bind(Button("Y"), 'enabled'),
-                        Label("to channel"),
-                        bind_tablet_y.bind(Dropdown(controller.midi_channels), 'channel'),
-                        
-                        Label("as"),
-                        HorizontalContainer([
-                            bind_tablet_y.bind(Dropdown(controller.midi_message_types), 'message_type'),
-                            bind_tablet_y.widget(
-                                HorizontalContainer([
-                                    Label("for"),
-                                    bind_tablet_y.bind(Dropdown(controller.midi_control_types), 'control_type'),
-                                ], hidden=True), 'control_group'),
-                        ]),
-    
-                        Label("ranging from"),
-                        bind_tablet_y.bind(TextInput(), 'range_from'),
-                        Label("to"),
-                        bind_tablet_y.bind(TextInput(), 'range_to'),
-                        Label("threshold"),
-                        bind_tablet_y.bind(HorizontalSlider(min_value=0.0, max_value=100.0, steps=20), 'threshold'),
-                    ],
-                    [
-                        bind_tablet_p.bind(Button("Pressure"), 'enabled'),
-                        Label("to channel"),
-                        bind_tablet_p.bind(Dropdown(controller.midi_channels), 'channel'),
-                        
-                        Label("as"),
-                        HorizontalContainer([
-                            bind_tablet_p.bind(Dropdown(controller.midi_message_types), 'message_type'),
-                            bind_tablet_p.widget(
-                                HorizontalContainer([
-                                    Label("for"),
-                                    bind_tablet_p.bind(Dropdown(controller.midi_control_types), 'control_type'),
-                                ], hidden=True), 'control_group'),
-                        ]),
-    
-                        Label("ranging from"),
-                        bind_tablet_p.bind(TextInput(), 'range_from'),
-                        Label("to"),
-                        bind_tablet_p.bind(TextInput(), 'range_to'),
-                        Label("threshold"),
-                        bind_tablet_p.bind(HorizontalSlider(min_value=0.0, max_value=1.0, steps=20), 'threshold'),
-                    ],
-                ]),
-            ]))),
+                rows_grid(bind_tablet_rows),
+            ], on_built=lambda: controller.on_section_built(bind_tablet_key, bind_tablet_rows), expanded=True))),
             
-            Frame(Wrapper(VerticalContainer([
-                SectionHeader("Map Mouse to MIDI outputs"),
+            Frame(Wrapper(LazySection("Map Mouse to MIDI outputs", lambda: [
                 HorizontalContainer([
                     Label("Map mouse with active button"),
                     bind_mouse_key.bind(Dropdown(controller.mouse_button_names), 'button'),
                     Label("as:"),
                 ]),
-                GridContainer([
-                    [
-                        bind_mouse_x.bind(Button("X"), 'enabled'),
-                        Label("to channel"),
-                        bind_mouse_x.bind(Dropdown(controller.midi_channels), 'channel'),
-    
-                        Label("as"),
-                        HorizontalContainer([
-                            bind_mouse_x.bind(Dropdown(controller.midi_message_types), 'message_type'),
-                            bind_mouse_x.widget(
-                                HorizontalContainer([
-                                    Label("for"),
-                                    bind_mouse_x.bind(Dropdown(controller.midi_control_types), 'control_type'),
-                                ], hidden=True), 'control_group'),
-                        ]),
-    
-                        Label("ranging from"),
-                        bind_mouse_x.bind(TextInput(), 'range_from'),
-                        Label("to"),
-                        bind_mouse_x.bind(TextInput(), 'range_to'),
-                        Label("threshold"),
-                        bind_mouse_x.bind(HorizontalSlider(min_value=0.0, max_value=100.0, steps=20), 'threshold'),
-                    ],
-                    [
-                        bind_mouse_y.bind(Button("Y"), 'enabled'),
-                        Label("to channel"),
-                        bind_mouse_y.bind(Dropdown(controller.midi_channels), 'channel'),
-                        
-                        Label("as"),
-                        HorizontalContainer([
-                            bind_mouse_y.bind(Dropdown(controller.midi_message_types), 'message_type'),
-                            bind_mouse_y.widget(
-                                HorizontalContainer([
-                                    Label("for"),
-                                    bind_mouse_y.bind(Dropdown(controller.midi_control_types), 'control_type'),
-                                ], hidden=True), 'control_group'),
-                        ]),
-    
-                        Label("ranging from"),
-                        bind_mouse_y.bind(TextInput(), 'range_from'),
-                        Label("to"),
-                        bind_mouse_y.bind(TextInput(), 'range_to'),
-                        Label("threshold"),
-                        bind_mouse_y.bind(HorizontalSlider(min_value=0.0, max_value=100.0, steps=20), 'threshold'),
-                    ],
-                ]),
+                rows_grid(bind_mouse_rows),
                 HorizontalContainer([
                     Label("Map mouse wheel as:"),
                 ]),
-                GridContainer([
-                    [
-                        bind_mouse_wheel_x.bind(Button("X"), 'enabled'),
-                        Label("to channel"),
-                        bind_mouse_wheel_x.bind(Dropdown(controller.midi_channels), 'channel'),
-    
-                        Label("as"),
-                        HorizontalContainer([
-                            bind_mouse_wheel_x.bind(Dropdown(controller.midi_message_types), 'message_type'),
-                            bind_mouse_wheel_x.widget(
-                                HorizontalContainer([
-                                    Label("for"),
-                                    bind_mouse_wheel_x.bind(Dropdown(controller.midi_control_types), 'control_type'),
-                                ], hidden=True), 'control_group'),
-                        ]),
-    
-                        Label("ranging from"),
-                        bind_mouse_wheel_x.bind(TextInput(), 'range_from'),
-                        Label("to"),
-                        bind_mouse_wheel_x.bind(TextInput(), 'range_to'),
-                        Label("step"),
-                        bind_mouse_wheel_x.bind(TextInput(), 'step'),
-                        Label("value"),
-                        bind_mouse_wheel_x.bind(HorizontalSlider(min_value=0.0, max_value=100.0, steps=20), 'value'),
-                        bind_mouse_wheel_x.bind(Checkbox('pull back'), 'pull_back'),
-                    ],
-                    [
-                        bind_mouse_wheel_y.bind(Button("Y"), 'enabled'),
-                        Label("to channel"),
-                        bind_mouse_wheel_y.bind(Dropdown(controller.midi_channels), 'channel'),
-    
-                        Label("as"),
-                        HorizontalContainer([
-                            bind_mouse_wheel_y.bind(Dropdown(controller.midi_message_types), 'message_type'),
-                            bind_mouse_wheel_y.widget(
-                                HorizontalContainer([
-                                    Label("for"),
-                                    bind_mouse_wheel_y.bind(Dropdown(controller.midi_control_types), 'control_type'),
-                                ], hidden=True), 'control_group'),
-                        ]),
-                        
-                        Label("ranging from"),
-                        bind_mouse_wheel_y.bind(TextInput(), 'range_from'),
-                        Label("to"),
-                        bind_mouse_wheel_y.bind(TextInput(), 'range_to'),
-                        Label("step"),
-                        bind_mouse_wheel_y.bind(TextInput(), 'step'),
-                        Label("value"),
-                        bind_mouse_wheel_y.bind(HorizontalSlider(min_value=0.0, max_value=100.0, steps=20), 'value'),
-                        bind_mouse_wheel_y.bind(Checkbox('pull back'), 'pull_back'),
-                    ],
-                ]),
-            ]))),
+                rows_grid(bind_mouse_wheel_rows),
+            ], on_built=lambda: controller.on_section_built(bind_mouse_key, bind_mouse_rows + bind_mouse_wheel_rows)))),
             
             HorizontalContainer([
                 binding_buttons.bind(Button(label="Tablet Input On"), 'tablet_on'),
@@ -237,10 +169,37 @@ class MainManager(Manager):
                         binding_devices.bind(Dropdown(controller.midi_ports), 'output_midi_port_name'),
                     ],
                 ]),
+                HorizontalContainer([
+                    Label("Input MIDI port"),
+                    binding_devices.bind(Dropdown(['none'] + controller.midi_input_ports), 'input_midi_port_name'),
+                ]),
+                HorizontalContainer([
+                    Label("Thru from"),
+                    binding_devices.bind(Dropdown(['none'] + controller.midi_input_ports), 'thru_midi_port_name'),
+                    Label("to channel"),
+                    binding_devices.bind(Dropdown(['same'] + controller.midi_channels), 'thru_channel'),
+                    binding_devices.bind(Dropdown(controller.thru_filter_names), 'thru_filter'),
+                    binding_buttons.bind(Button(label="Generated CCs Win"), 'thru_priority_on'),
+                ]),
+                HorizontalContainer([
+                    Label("Also send to"),
+                    binding_devices.bind(Dropdown(['none'] + controller.midi_ports), 'secondary_midi_port_name'),
+                    Label("channels"),
+                    binding_devices.bind(Dropdown(['all'] + controller.midi_channels), 'secondary_midi_channel'),
+                ]),
                 HorizontalContainer([
                     binding_buttons.bind(Button(label="MIDI Output On"), 'midi_output_on'),
                     binding_buttons.bind(Button(label="Log Output"), 'log_output_on'),
                     binding_buttons.bind(Button(label="Log Input"), 'log_input_on'),
+                    binding_buttons.bind(Button(label="Record"), 'record_on'),
+                ]),
+                HorizontalContainer([
+                    binding_buttons.bind(Button(label="Quantize Notes"), 'quantize_on'),
+                    Label("bpm"),
+                    binding_tempo.bind(TextInput(), 'bpm'),
+                    Label("steps per beat"),
+                    binding_tempo.bind(Dropdown(['1', '2', '3', '4', '6', '8']), 'division'),
+                    binding_buttons.bind(Button(label="MIDI Clock"), 'clock_on'),
                 ]),
             ]))),
             
@@ -267,8 +226,11 @@ class MainManager(Manager):
         # if __debug__:
         #     fps_display = pyglet.clock.ClockDisplay()
         
+        frame_seconds = metrics.histogram('touchy_frame_seconds', 'Time spent drawing a frame', FRAME_BUCKETS)
+        
         @window.event
         def on_draw():
+            start = time.perf_counter()
             window.clear()
 
             if self.vertex_list:
@@ -280,8 +242,12 @@ class MainManager(Manager):
             for label in controller.note_labels:
                 label.draw()
             
+            if controller.metrics_label:
+                controller.metrics_label.draw()
+            
             # if __debug__:
             #     fps_display.draw()
+            frame_seconds.observe(time.perf_counter() - start)
 
         @window.event
         def on_text(text):